@@ -35,7 +35,7 @@ class ReadOnlyModelSerializer(serializers.ModelSerializer):
 class QueryParamSerializer(serializers.Serializer):
     @classmethod
     def parse(cls, query_params):
-        serializer = QueryParamSerializer(data=query_params)
+        serializer = cls(data=query_params)
         serializer.is_valid(raise_exception=True)
         return serializer.validated_data
 
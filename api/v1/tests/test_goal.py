@@ -4,6 +4,8 @@ from datetime import date, timedelta, datetime
 from unittest import mock, skip
 from unittest.mock import MagicMock
 
+from django.core.cache import cache
+from django.test import override_settings
 from django.utils import timezone
 
 
@@ -16,7 +18,9 @@ from .factories import MarkowitzScaleFactory, GoalTypeFactory, \
     ExecutionDistributionFactory, RecurringTransactionFactory, \
     ContentTypeFactory, TransactionFactory, PositionLotFactory
 from common.constants import GROUP_SUPPORT_STAFF
+from main import redis
 from main.event import Event
+from main.finance import performance_history
 from main.models import GoalMetric, Execution, Transaction, Goal
 from main.risk_profiler import max_risk, MINIMUM_RISK
 from main.management.commands.populate_test_data import populate_prices, populate_cycle_obs, populate_cycle_prediction
@@ -148,6 +152,76 @@ class GoalTests(APITestCase):
         self.assertEqual(response.data[1]['memos'], ['A memo for e2'])
         self.assertFalse('memos' in response.data[2])
 
+    def test_activity_pages(self):
+        Fixture1.settings_event1()
+        Fixture1.transaction_event1()
+        Fixture1.populate_balance1()
+        ActivityLogEvent.get(Event.APPROVE_SELECTED_SETTINGS)
+        ActivityLogEvent.get(Event.GOAL_BALANCE_CALCULATED)
+        ActivityLogEvent.get(Event.GOAL_DEPOSIT_EXECUTED)
+
+        url = '/api/v1/goals/{}/activity'.format(Fixture1.goal1().id)
+        self.client.force_authenticate(user=Fixture1.client1().user)
+        feed = self.client.get(url).data
+        items = []
+        response = self.client.get(url, {'limit': 3})
+        while True:
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            items.extend(response.data['results'])
+            if response.data['next'] is None:
+                break
+            response = self.client.get(url, {'limit': 3, 'cursor': response.data['next']})
+        self.assertListEqual(items, feed)
+
+        # The range is of whole days.
+        response = self.client.get(url, {'sd': '2001-01-01', 'ed': '2001-01-01'})
+        self.assertListEqual(response.data, feed[2:])
+        response = self.client.get(url, {'cursor': 'nonsense'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_activity_balances_and_unlogged_transactions(self):
+        Fixture1.transaction_event1()
+        Fixture1.populate_balance1()
+        unlogged = Transaction.objects.create(reason=Transaction.REASON_DEPOSIT,
+                                              to_goal=Fixture1.goal1(),
+                                              amount=500,
+                                              status=Transaction.STATUS_EXECUTED,
+                                              executed=timezone.make_aware(datetime(2001, 1, 2)))
+        deposit = ActivityLogEvent.get(Event.GOAL_DEPOSIT_EXECUTED).activity_log.id
+
+        url = '/api/v1/goals/{}/activity'.format(Fixture1.goal1().id)
+        self.client.force_authenticate(user=Fixture1.client1().user)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        # The daily balances are listed without being set up first.
+        balance = ActivityLogEvent.objects.get(id=Event.GOAL_BALANCE_CALCULATED.value).activity_log.id
+        # The logged deposit is listed once, by its log, and the unlogged one by its transaction.
+        self.assertListEqual([(item['type'], item.get('amount')) for item in response.data],
+                             [(balance, None), (deposit, 3000.0), (balance, None), (deposit, unlogged.amount)])
+
+    def test_activity_pages_over_dst_end(self):
+        # Daylight saving in Sydney ended at 3am on 2016-04-03, so the local times from 2am to 3am happened twice.
+        goal = Fixture1.goal1()
+        logs = [Log.objects.create(user=Fixture1.client1_user(), action=Event.APPROVE_SELECTED_SETTINGS.name,
+                                   timestamp=datetime(2016, 4, 2, hour, minute, tzinfo=timezone.utc),
+                                   extra={}, obj=goal)
+                for hour, minute in ((15, 30), (15, 50), (16, 10), (16, 40))]
+        ActivityLogEvent.get(Event.APPROVE_SELECTED_SETTINGS)
+
+        url = '/api/v1/goals/{}/activity'.format(goal.id)
+        self.client.force_authenticate(user=Fixture1.client1().user)
+        times = []
+        response = self.client.get(url, {'limit': 1})
+        while True:
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            times.extend(item['time'] for item in response.data['results'])
+            if response.data['next'] is None:
+                break
+            response = self.client.get(url, {'limit': 1, 'cursor': response.data['next']})
+        # Every log once, in the order they happened, though the local times of the last two come before the first.
+        self.assertListEqual(times, [int((timezone.make_naive(log.timestamp) - datetime(1970, 1, 1)).total_seconds())
+                                     for log in logs])
+
     def test_performance_history_empty(self):
         url = '/api/v1/goals/{}/performance-history'.format(Fixture1.goal1().id)
         self.client.force_authenticate(user=Fixture1.client1().user)
@@ -155,7 +229,7 @@ class GoalTests(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.data, [])
 
-    def test_performance_history(self):
+    def setup_performance_history(self):
         goal = GoalFactory.create()
         prices = (
             (Fixture1.fund1(), '20160101', 10),
@@ -214,6 +288,8 @@ class GoalTests(APITestCase):
         )
         Fixture1.add_execution_distributions(distributions, execution_requests)
 
+    def test_performance_history(self):
+        self.setup_performance_history()
         url = '/api/v1/goals/{}/performance-history'.format(Fixture1.goal1().id)
         self.client.force_authenticate(user=Fixture1.client1().user)
         response = self.client.get(url)
@@ -226,6 +302,25 @@ class GoalTests(APITestCase):
         self.assertEqual(response.data[5], (16807, Decimal('0.060606')))
         self.assertEqual(response.data[6], (16808, 0))
 
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_performance_history_cached(self):
+        self.setup_performance_history()
+        goal = Fixture1.goal1()
+        cache.clear()
+        with mock.patch('main.finance.now', MagicMock(return_value=timezone.make_aware(datetime(2016, 1, 20)))):
+            first = performance_history(goal.id)
+        self.assertIsNotNone(cache.get('{}_{}'.format(redis.Keys.PERFORMANCE_HISTORY.value, goal.id)))
+        # A late price within the days that are recalculated, and one for a day after the first request.
+        Fixture1.set_prices(((Fixture1.fund1(), '20160118', 10.7), (Fixture1.fund2(), '20160123', 52.5)))
+        with mock.patch('main.finance.now', MagicMock(return_value=timezone.make_aware(datetime(2016, 1, 25)))):
+            extended = performance_history(goal.id)
+            cache.clear()
+            expected = performance_history(goal.id)
+        self.assertEqual(len(first), 19)
+        self.assertListEqual(extended, expected)
+        self.assertEqual(extended[:6], first[:6])
+        self.assertNotEqual(extended[16][1], 0)
+
     def test_put_settings_recurring_transactions(self):
         # Test PUT with good transaction data
         tx1 = RecurringTransactionFactory.create()
@@ -685,8 +780,8 @@ class GoalTests(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK,
                          msg='Goal positions endpoint returns ok for Goal with positions')
         self.assertEqual(len(response.data), 2)
-        self.assertDictEqual(response.data[0], {'ticker': fund.id, 'quantity': 15.0})  # Sum of the two fills
-        self.assertDictEqual(response.data[1], {'ticker': fund2.id, 'quantity': 1.0})
+        self.assertDictEqual(response.data[0], {'ticker': fund.id, 'quantity': 15.0, 'value': 31.5})  # Both fills
+        self.assertDictEqual(response.data[1], {'ticker': fund2.id, 'quantity': 1.0, 'value': 4.0})
 
     def test_archive_goal(self):
         client = Fixture1.client1()
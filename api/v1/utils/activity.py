@@ -1,13 +1,24 @@
+"""
+The activity feed of a goal or an account: its event logs, executed transactions and daily balances, in time order.
+
+Each of the three is read by its own query, ordered by (time, id), a chunk at a time carrying on from the last row
+read, and the three are merged as they are read. A page of the feed only reads as far into each as the page reaches,
+so a page of an account with years of activity costs about the same as one of an account with a few days of it.
+
+Items are ordered by their (time, source, id) key, with the time in UTC as the database orders it, and a page's cursor
+is the key of its last item.
+"""
 import decimal
-from datetime import datetime, time
+import heapq
+from datetime import datetime, time, timedelta
 from decimal import Decimal
+from itertools import islice
 
-import operator
 from django.contrib.contenttypes.models import ContentType
 from django.db.models.aggregates import Sum
 from django.db.models.query_utils import Q
 from django.utils import timezone
-from django.utils.timezone import now
+from pytz import utc
 from pinax.eventlog.models import Log
 from rest_framework import serializers
 from rest_framework.response import Response
@@ -16,8 +27,7 @@ from api.v1.serializers import QueryParamSerializer
 from client.models import ClientAccount
 from common.constants import DEC_2PL, EPOCH_TM
 from main.event import Event
-from main.models import ActivityLog, ActivityLogEvent, Goal, HistoricalBalance, \
-    Transaction
+from main.models import ActivityLog, ActivityLogEvent, Goal, HistoricalBalance, Transaction
 
 # Make unsafe float operations with decimal fail
 decimal.getcontext().traps[decimal.FloatOperation] = True
@@ -34,133 +44,267 @@ TX2E = {
     Transaction.REASON_TRANSFER: Event.GOAL_TRANSFER_EXECUTED,
 }
 
+# The sources of feed items, in the order items of the same time are listed.
+LOG = 0
+TRANSACTION = 1
+BALANCE = 2
 
-class ActivityQueryParamSerializer(QueryParamSerializer):
-    sd = serializers.DateField(required=False)
-    ed = serializers.DateField(required=False)
+# The items in a page when a cursor is given without a limit, and the most a limit may be.
+PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
 
+# The most rows read from one source in a query.
+CHUNK_SIZE = 500
 
-def get_transactions(sd, ed, goal_ids):
-    qs = (
-        Transaction.objects.all()
-        .filter(Q(to_goal__in=goal_ids) | Q(from_goal__in=goal_ids))
-        .exclude(executed=None)
-    )
+EPOCH_UTC = utc.localize(EPOCH_TM)
 
-    if sd is not None:
-        qs = qs.filter(executed__gte=sd)
-    if ed is not None:
-        qs = qs.filter(executed__lte=ed)
-
-    return {tx.id: tx for tx in qs}
-
-
-def parse_event_logs(request, logs, transactions, goal):
-    # Get the map from event 'action' code to ActivityLog id
-    eid2aid = dict(ActivityLog.objects.all().values_list('events__id', 'id'))
-    aid2args = dict(ActivityLog.objects.all().values_list('id', 'format_args'))
-
-    def _get_extra_data(aid, fields):
-        NA = object()
-
-        # Get any extra arguments for this activity type
-        args = aid2args.get(aid, None)
-        data = []
-        if args:
-            for locstr in map(str.strip, args.strip().splitlines()):
-                in_trans = False
-                item = fields
-                for branch in locstr.split('.'):
-                    if in_trans:
-                        item = getattr(item, branch, NA)
-                    else:
-                        item = item.get(branch, NA)
-                        if branch == 'transaction':
-                            in_trans = True
-                    if item == NA:
-                        item = '{} not available'.format(locstr)
-                        break
-                data.append(item)
-        return data
-
-    def _is_authorised(user, staff):
-        return not staff or user.is_advisor or user.is_authorised_representative
-
-    items = []
-    for log in logs:
-        e = Event[log.action]
-        # All log items have a type and time. If there is no ActivityLog type registered for the event, it means
-        # the operator may not have wanted it included, so skip it.
-        tp = eid2aid.get(e.value, None)
-        if tp is None:
-            continue
-
-        tm = int((timezone.make_naive(log.timestamp) - EPOCH_TM).total_seconds())
-        result = {
-            'type': tp,
-            'time': tm
-        }
-
-        # If we're looking at a goal transaction log, add the transaction to the available fields
-        if e in Transaction.EXECUTION_EVENTS:
-            txid = log.extra.get('txid', None)
-            if txid is None:
-                raise Exception("Transaction event log: {} has no txid.".format(log.id))
-            tx = transactions.pop(txid, None)
-            if tx is None:
-                raise Exception("Transaction matching event log: {} does not exist.".format(log.id))
-            log.extra['transaction'] = tx
-
-            # Transactions are Goal-level things and do not impact the account-level balance, so only add amount if it's
-            # the goal-level we're looking at.
-            if goal is not None:
-                result['amount'] = tx.amount if tx.to_goal is not None and tx.to_goal.id == goal.id else -tx.amount
-
-        data = _get_extra_data(tp, log.extra)
-        if data:
-            result['data'] = data
-
-        # Get Goal if necessary
-        if goal is None and isinstance(log.obj, Goal):
-            result['goal'] = log.object_id
-
-        # Add any memos to the event
-        memos = [memo[0] for memo in log.memos.values_list('comment', 'staff') if _is_authorised(request.user, memo[1])]
-        if memos:
-            result['memos'] = memos
-
-        items.append(result)
-
-    # Process any remaining transactions that have no log.
-    for tx in transactions.values():
-        aid = eid2aid.get(TX2E[tx.reason].value, None)
-
-        # if there is no aid, the transaction probably is still there
-        # as it wasn't processed as part of the event logs. I.e. The system is configured to NOT show that activity.
-        if aid is None:
-            continue
-
-        result = {
-            'type': aid,
-            'time': int((timezone.make_naive(tx.executed) - EPOCH_TM).total_seconds())
-        }
-
-        if goal is None:
-            # account level, so we need to work out the goal.
-            result['goal'] = tx.from_goal.id if tx.to_goal is None else tx.to_goal.id
-        else:
-            # goal-level, so add the amount, an Transactions are Goal-level things and do not impact the
-            # account-level balance.
-            result['amount'] = tx.amount if tx.to_goal is not None and tx.to_goal.id == goal.id else -tx.amount
 
-        # Set the data element.
-        data = _get_extra_data(aid, {'transaction': tx})
-        if data:
-            result['data'] = data
+def make_cursor(key):
+    """
+    :param key: The (aware time, source, id) key of a feed item.
+    :return: The cursor string of the feed after the item.
+    """
+    tm, source, item_id = key
+    return '{}.{}.{}'.format((tm - EPOCH_UTC) // timedelta(microseconds=1), source, item_id)
 
-        items.append(result)
 
-    return items
+def parse_cursor(cursor):
+    """
+    :return: The (UTC time, source, id) key the cursor string is for.
+    :raises ValueError: If it isn't a cursor.
+    """
+    micros, source, item_id = map(int, cursor.split('.'))
+    if source not in (LOG, TRANSACTION, BALANCE):
+        raise ValueError('Unknown source: {}'.format(source))
+    return EPOCH_UTC + timedelta(microseconds=micros), source, item_id
+
+
+class ActivityQueryParamSerializer(QueryParamSerializer):
+    sd = serializers.DateField(required=False)
+    ed = serializers.DateField(required=False)
+    cursor = serializers.CharField(required=False)
+    limit = serializers.IntegerField(required=False, min_value=1, max_value=MAX_PAGE_SIZE)
+
+    def validate_cursor(self, value):
+        try:
+            return parse_cursor(value)
+        except ValueError:
+            raise serializers.ValidationError('Not a valid activity cursor.')
+
+
+def _after(key, source, field, value):
+    """
+    :param key: The feed key to read on from, or None to read from the start.
+    :param value: The time of key, as a value of field.
+    :return: A Q for the rows of source, ordered by (field, id), that come after key in the feed.
+    """
+    if key is None:
+        return Q()
+    _, key_source, key_id = key
+    if source < key_source:
+        return Q(**{field + '__gt': value})
+    if source > key_source:
+        return Q(**{field + '__gte': value})
+    return Q(**{field + '__gt': value}) | Q(**{field: value, 'id__gt': key_id})
+
+
+def _chunks(qs, field, source, after, chunk_size):
+    """
+    Read the rows of qs ordered by (field, id), from after the feed key after, chunk_size rows at a time.
+    :return: Iterator of lists of rows.
+    """
+    q = _after(after, source, field, None if after is None else after[0])
+    while True:
+        rows = list(qs.filter(q).order_by(field, 'id')[:chunk_size])
+        if rows:
+            yield rows
+        if len(rows) < chunk_size:
+            return
+        last = rows[-1]
+        q = _after((None, source, last.id), source, field, getattr(last, field))
+
+
+def _time(tm):
+    """
+    :param tm: An aware time.
+    :return: The time given for a feed item: seconds from the epoch to the local wall clock time of tm.
+    """
+    return int((timezone.make_naive(tm) - EPOCH_TM).total_seconds())
+
+
+def _midnight(day):
+    """
+    :return: The aware UTC time of the start of the day in the current timezone.
+    """
+    local = timezone.get_current_timezone()
+    return local.normalize(local.localize(datetime.combine(day, time()), is_dst=False)).astimezone(utc)
+
+
+def _extra_data(paths, fields):
+    """
+    :param paths: The dotted paths of the extra arguments of an activity type.
+    :param fields: The fields to find them in. Paths are looked up as attributes past any 'transaction' field.
+    :return: The values at the paths
+    """
+    NA = object()
+    data = []
+    for locstr in paths:
+        in_trans = False
+        item = fields
+        for branch in locstr.split('.'):
+            if in_trans:
+                item = getattr(item, branch, NA)
+            else:
+                item = item.get(branch, NA)
+                if branch == 'transaction':
+                    in_trans = True
+            if item == NA:
+                item = '{} not available'.format(locstr)
+                break
+        data.append(item)
+    return data
+
+
+def _tx_amount(tx, goal):
+    # Transactions are Goal-level things and do not impact the account-level balance, so amounts are only given
+    # when looking at a goal.
+    return tx.amount if tx.to_goal_id == goal.id else -tx.amount
+
+
+def log_items(request, logs, types, goal, after=None, chunk_size=CHUNK_SIZE):
+    """
+    :param logs: The event logs of the feed.
+    :param types: ActivityLog.event_types()
+    :param goal: The goal the feed is for, or None for an account.
+    :param after: The feed key to start after.
+    :return: Iterator of (key, item) of the logs of events with an activity type, in feed order.
+    """
+    events, args = types
+    goal_ct = ContentType.objects.get_for_model(Goal).id
+    staff_memos = request.user.is_advisor or request.user.is_authorised_representative
+    logs = logs.filter(action__in=[e.name for e in Event if e.value in events]).prefetch_related('memos')
+
+    for chunk in _chunks(logs, 'timestamp', LOG, after, chunk_size):
+        txids = {int(log.extra['txid']) for log in chunk
+                 if Event[log.action] in Transaction.EXECUTION_EVENTS and log.extra.get('txid') is not None}
+        transactions = Transaction.objects.in_bulk(txids)
+        for log in chunk:
+            e = Event[log.action]
+            tm = log.timestamp.astimezone(utc)
+            aid = events[e.value]
+            result = {
+                'type': aid,
+                'time': _time(tm),
+            }
+
+            # If we're looking at a goal transaction log, add the transaction to the available fields
+            if e in Transaction.EXECUTION_EVENTS:
+                txid = log.extra.get('txid', None)
+                if txid is None:
+                    raise Exception("Transaction event log: {} has no txid.".format(log.id))
+                tx = transactions.get(int(txid))
+                if tx is None:
+                    raise Exception("Transaction matching event log: {} does not exist.".format(log.id))
+                log.extra['transaction'] = tx
+                if goal is not None:
+                    result['amount'] = _tx_amount(tx, goal)
+
+            data = _extra_data(args.get(aid, []), log.extra)
+            if data:
+                result['data'] = data
+
+            if goal is None and log.content_type_id == goal_ct:
+                result['goal'] = log.object_id
+
+            # Add any memos to the event
+            memos = [memo.comment for memo in log.memos.all() if staff_memos or not memo.staff]
+            if memos:
+                result['memos'] = memos
+
+            yield (tm, LOG, log.id), result
+
+
+def transaction_items(transactions, logs, types, goal, after=None, chunk_size=CHUNK_SIZE):
+    """
+    :param transactions: The executed transactions of the feed.
+    :param logs: The event logs of the feed. Transactions with a log of an activity type are listed by their log.
+    :return: Iterator of (key, item) of the transactions without logs, in feed order.
+    """
+    events, args = types
+    reasons = [reason for reason, e in TX2E.items() if e.value in events]
+    actions = [e.name for e in Transaction.EXECUTION_EVENTS if e.value in events]
+    logged = None
+    for chunk in _chunks(transactions.filter(reason__in=reasons), 'executed', TRANSACTION, after, chunk_size):
+        if logged is None:
+            logged = _logged_transactions(logs.filter(action__in=actions))
+        for tx in chunk:
+            if tx.id in logged:
+                continue
+            tm = tx.executed.astimezone(utc)
+            aid = events[TX2E[tx.reason].value]
+            result = {
+                'type': aid,
+                'time': _time(tm),
+            }
+            if goal is None:
+                # account level, so we need to work out the goal.
+                result['goal'] = tx.from_goal_id if tx.to_goal_id is None else tx.to_goal_id
+            else:
+                result['amount'] = _tx_amount(tx, goal)
+
+            data = _extra_data(args.get(aid, []), {'transaction': tx})
+            if data:
+                result['data'] = data
+
+            yield (tm, TRANSACTION, tx.id), result
+
+
+def _logged_transactions(logs):
+    """
+    :param logs: The transaction execution logs to look in.
+    :return: The set of ids of the transactions they are for.
+    """
+    # The transaction id is only held in the logs' JSON extra field, so it's read from the parsed field rather than
+    # matched in the database.
+    logged = set()
+    for extra in logs.values_list('extra', flat=True).iterator():
+        txid = extra.get('txid')
+        if txid is not None:
+            logged.add(int(txid))
+    return logged
+
+
+def balance_items(balances, types, after=None, chunk_size=CHUNK_SIZE):
+    """
+    :param balances: The HistoricalBalances of the feed's goals.
+    :return: Iterator of (key, item) of the total balance of the goals on each day, in feed order.
+    """
+    events, _ = types
+    aid = events.get(Event.GOAL_BALANCE_CALCULATED.value)
+    if aid is None:
+        aid = ActivityLogEvent.get(Event.GOAL_BALANCE_CALCULATED).activity_log_id
+    if after is None:
+        q = Q()
+    else:
+        day = timezone.localtime(after[0]).date()
+        if after[1] < BALANCE and _midnight(day) == after[0]:
+            # The day's balance comes after any other item at its midnight.
+            q = Q(date__gte=day)
+        else:
+            q = Q(date__gt=day)
+    balances = balances.order_by().values('date').annotate(sum=Sum('balance')).order_by('date')
+    while True:
+        rows = list(balances.filter(q)[:chunk_size])
+        for row in rows:
+            tm = _midnight(row['date'])
+            yield (tm, BALANCE, 0), {
+                'type': aid,
+                'time': _time(tm),
+                'balance': Decimal.from_float(row['sum']).quantize(DEC_2PL),
+            }
+        if len(rows) < chunk_size:
+            return
+        q = Q(date__gt=rows[-1]['date'])
 
 
 def get(request, obj):
@@ -171,7 +315,7 @@ def get(request, obj):
         el_filter = (Q(content_type=gct, object_id__in=goal_ids))
     elif isinstance(obj, ClientAccount):
         goal = None
-        goal_ids = obj.goals.values_list('id', flat=True)
+        goal_ids = list(obj.goals.values_list('id', flat=True))
         # Filter for only the events where the object is account or goal
         ctm = ContentType.objects.get_for_models(ClientAccount, Goal)
         el_filter = (Q(content_type=ctm[ClientAccount], object_id=obj.id) |
@@ -182,25 +326,37 @@ def get(request, obj):
     query_params = ActivityQueryParamSerializer.parse(request.query_params)
     sd = query_params.get('sd', None)
     ed = query_params.get('ed', None)
-
-    # Get the eventlog activity items
-    date_constraint = Q()
+    after = query_params.get('cursor', None)
+    limit = query_params.get('limit', PAGE_SIZE if after is not None else None)
+
+    # Both ends of the date range are whole days.
+    logs = Log.objects.filter(el_filter)
+    window = Q()
+    transactions = (Transaction.objects
+                    .filter(Q(to_goal__in=goal_ids) | Q(from_goal__in=goal_ids))
+                    .exclude(executed=None))
+    balances = HistoricalBalance.objects.filter(goal__in=goal_ids)
     if sd is not None:
-        date_constraint &= Q(date__gte=sd)
+        start = timezone.make_aware(datetime.combine(sd, time()))
+        window &= Q(timestamp__gte=start)
+        transactions = transactions.filter(executed__gte=start)
+        balances = balances.filter(date__gte=sd)
     if ed is not None:
-        date_constraint &= Q(date__lte=ed)
-    events = Log.objects.filter(el_filter & date_constraint).prefetch_related('memos')
-
-    # Get all the transactions for the period
-    transactions = get_transactions(sd, ed, goal_ids)
-    items = parse_event_logs(request, events, transactions, goal)
-
-    # Get the balances
-    tp = ActivityLogEvent.get(Event.GOAL_BALANCE_CALCULATED).activity_log.id
-    qs = HistoricalBalance.objects.filter(date_constraint, goal__in=goal_ids).values('date').annotate(sum=Sum('balance'))
-
-    # Join the two lists to one sorted on date
-    items.extend([{'type': tp,
-                   'time': int((datetime.combine(bal['date'], time()) - EPOCH_TM).total_seconds()),
-                   'balance': Decimal.from_float(bal['sum']).quantize(DEC_2PL)} for bal in qs])
-    return Response(sorted(items, key=operator.itemgetter("time")))
+        stop = timezone.make_aware(datetime.combine(ed + timedelta(1), time()))
+        window &= Q(timestamp__lt=stop)
+        transactions = transactions.filter(executed__lt=stop)
+        balances = balances.filter(date__lte=ed)
+
+    types = ActivityLog.event_types()
+    chunk_size = CHUNK_SIZE if limit is None else min(CHUNK_SIZE, limit + 1)
+    items = heapq.merge(log_items(request, logs.filter(window), types, goal, after, chunk_size),
+                        transaction_items(transactions, logs, types, goal, after, chunk_size),
+                        balance_items(balances, types, after, chunk_size))
+    if limit is None:
+        return Response([item for _, item in items])
+
+    page = list(islice(items, limit + 1))
+    return Response({
+        'results': [item for _, item in page[:limit]],
+        'next': make_cursor(page[limit - 1][0]) if len(page) > limit else None,
+    })
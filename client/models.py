@@ -17,7 +17,7 @@ from main import constants
 from main.abstract import NeedApprobation, NeedConfirmation, PersonalData
 from main.models import AccountGroup, Goal, Platform
 from .managers import ClientAccountQuerySet, ClientQuerySet
-from main.finance import mod_dietz_rate
+from main.finance import cached_mod_dietz_rates
 from retiresmartz.models import RetirementAdvice, RetirementPlan
 from pinax.eventlog.models import log
 from retiresmartz import advice_responses
@@ -93,11 +93,10 @@ class Client(NeedApprobation, NeedConfirmation, PersonalData):
             assets_worth += float(a.get_growth_valuation(to_date=today))
         # Sum personal type Betasmartz Accounts - the total balance for the account is
         # ClientAccount.cash_balance + Goal.total_balance for all goals for the account.
-        personal_accounts_worth = 0.0
-        for ca in self.primary_accounts.filter(account_type=constants.ACCOUNT_TYPE_PERSONAL):
-            personal_accounts_worth += ca.cash_balance
-            for goal in ca.all_goals.exclude(state=Goal.State.ARCHIVED.value):
-                personal_accounts_worth += goal.total_balance
+        personal_accounts = self.primary_accounts.filter(account_type=constants.ACCOUNT_TYPE_PERSONAL)
+        personal_accounts_worth = personal_accounts.aggregate(cash=Sum('cash_balance'))['cash'] or 0.0
+        goals = Goal.objects.filter(account__in=personal_accounts).exclude(state=Goal.State.ARCHIVED.value)
+        personal_accounts_worth += goals.balance()['total']
         return assets_worth + personal_accounts_worth
 
     @cached_property
@@ -401,44 +400,31 @@ class ClientAccount(models.Model):
 
     @property
     def total_balance(self):
-        balance = sum(goal.total_balance for goal in self.goals.all())
-        return balance + self.cash_balance
+        return self.goals.balance()['total'] + self.cash_balance
 
     @property
     def stock_balance(self):
-        b = 0
-        for goal in self.goals.all():
-            b += goal.stock_balance
-        return b
+        return self.goals.balance()['stocks']
 
     @property
     def bond_balance(self):
-        b = 0
-        for goal in self.goals.all():
-            b += goal.bond_balance
-        return b
+        return self.goals.balance()['bonds']
 
     @property
     def core_balance(self):
-        b = 0
-        for goal in self.goals.all():
-            b += goal.core_balance
-        return b
+        return self.goals.balance()['core']
 
     @property
     def satellite_balance(self):
-        b = 0
-        for goal in self.goals.all():
-            b += goal.satellite_balance
-        return b
+        return self.goals.balance()['satellite']
 
     @property
     def average_return(self):
-        return mod_dietz_rate(self.goals)
+        return cached_mod_dietz_rates('client_account', {self.id: self.goals})[self.id]
 
     @property
     def total_earnings(self):
-        return sum(g.total_earnings for g in self.goals)
+        return sum(g.total_earnings for g in self.goals.with_financials())
 
     @property
     def stocks_percentage(self):
@@ -3,19 +3,18 @@ from functools import partial
 from logging import DEBUG, INFO, WARN, ERROR
 from time import sleep
 
+from django.core.exceptions import ValidationError
 from django.db import transaction
 from client.models import ClientAccount
 from execution.broker.interactive_brokers.interactive_brokers import InteractiveBrokers
 from execution.broker.interactive_brokers.account_groups.create_account_groups import FAAccountProfile
 from main.models import MarketOrderRequest, ExecutionRequest, Execution, Ticker, MarketOrderRequestAPEX, \
-    ApexFill, ExecutionApexFill, ExecutionDistribution, Transaction, PositionLot, Sale, OrderETNA
+    ApexFill, ExecutionApexFill, ExecutionDistribution, GoalHolding, Transaction, PositionLot, Sale, OrderETNA
 import types
 from collections import defaultdict
-from django.db.models import Sum, F, Case, When, Value, FloatField
+from django.db.models import Sum, F
 import numpy as np
-from datetime import timedelta
-from django.utils import timezone
-from main.management.commands.rebalance import TAX_BRACKET_LESS1Y, TAX_BRACKET_MORE1Y
+from main.tax_lots import TaxLotIndex
 from execution.ETNA_api.send_orders import insert_order_ETNA
 
 
@@ -143,96 +142,139 @@ def mark_etna_order_as_complete(etna_order):
 def process_apex_fills():
     '''
     from existing apex fills create executions, execution distributions, transactions and positionLots - pro rata all fills
+    The fills, the execution requests they're shared between and the orders those belong to are all loaded up front,
+    and the rows that nothing else points at are written with bulk_create. Executions, transactions and distributions
+    are still created one at a time, as bulk_create doesn't give us their ids to point the other rows at.
     :return:
     '''
-    fills = ApexFill.objects\
-        .filter(etna_order__Status__in=OrderETNA.StatusChoice.complete_statuses())\
-        .annotate(ticker_id=F('etna_order__ticker__id'))\
-        .values('id', 'ticker_id', 'price', 'volume','executed')
+    complete_statuses = OrderETNA.StatusChoice.complete_statuses()
+    fills = list(ApexFill.objects
+                 .filter(etna_order__Status__in=complete_statuses)
+                 .annotate(ticker_id=F('etna_order__ticker__id'))
+                 .values('id', 'ticker_id', 'price', 'volume', 'executed'))
+    if not fills:
+        return
+
+    # The execution requests of every order sent in a complete ETNA order, for each ticker filled.
+    ers_by_ticker = defaultdict(list)
+    ers = ExecutionRequest.objects\
+        .filter(asset_id__in={fill['ticker_id'] for fill in fills},
+                order__morsAPEX__etna_order__Status__in=complete_statuses)\
+        .values_list('id', 'asset_id', 'volume', 'goal_id', 'order_id')
+    for er in ers:
+        ers_by_ticker[er[1]].append(er)
+
+    # The ETNA order each market order request was sent in.
+    mor_etna_orders = defaultdict(list)
+    for mor_id, etna_order_id in MarketOrderRequestAPEX.objects\
+            .filter(market_order_request_id__in={er[4] for ers in ers_by_ticker.values() for er in ers})\
+            .values_list('market_order_request_id', 'etna_order_id'):
+        mor_etna_orders[mor_id].append(etna_order_id)
+    for mor_id, etna_order_ids in mor_etna_orders.items():
+        if len(etna_order_ids) > 1:
+            raise OrderETNA.MultipleObjectsReturned("Market order request {} was sent in ETNA orders {}".format(
+                mor_id, etna_order_ids))
+
+    # Share each fill between the requests for its ticker in proportion to their volumes.
+    volumes = {ticker_id: np.array([er[2] for er in ers], dtype=float) for ticker_id, ers in ers_by_ticker.items()}
+    totals = {ticker_id: np.sum([er[2] for er in ers]) for ticker_id, ers in ers_by_ticker.items()}
 
     complete_mor_ids = set()
     complete_etna_order_ids = set()
+    apex_fills = []
+    lots = []
+    holdings = defaultdict(float)
     for fill in fills:
-        ers = ExecutionRequest.objects\
-            .filter(asset_id=fill['ticker_id'], order__morsAPEX__etna_order__Status__in=OrderETNA.StatusChoice.complete_statuses())
-        sum_ers = np.sum([er.volume for er in ers])
-
-        for er in ers:
-            pro_rata = er.volume/float(sum_ers)
-            volume = fill['volume'] * pro_rata
-
-            apex_fill = ApexFill.objects.get(id=fill['id'])
-            ticker = Ticker.objects.get(id=fill['ticker_id'])
-            mor = MarketOrderRequest.objects.get(execution_requests__id=er.id)
-            complete_mor_ids.add(mor.id)
-
-            etna_order = OrderETNA.objects.get(morsAPEX__market_order_request__execution_requests__id=er.id)
-            complete_etna_order_ids.add(etna_order.id)
-
-            execution = Execution.objects.create(asset=ticker, volume=volume, price=fill['price'],
-                                                 amount=volume*fill['price'], order=mor, executed=fill['executed'])
-            ExecutionApexFill.objects.create(apex_fill=apex_fill, execution=execution)
+        ers = ers_by_ticker.get(fill['ticker_id'], [])
+        if not ers:
+            continue
+        if totals[fill['ticker_id']] == 0:
+            raise ZeroDivisionError("Execution requests for ticker {} total no volume".format(fill['ticker_id']))
+        fill_volumes = fill['volume'] * (volumes[fill['ticker_id']] / float(totals[fill['ticker_id']]))
+
+        for er, volume in zip(ers, fill_volumes.tolist()):
+            er_id, ticker_id, _, goal_id, mor_id = er
+            if not mor_etna_orders[mor_id]:
+                raise OrderETNA.DoesNotExist("Market order request {} wasn't sent in an ETNA order".format(mor_id))
+            complete_mor_ids.add(mor_id)
+            complete_etna_order_ids.add(mor_etna_orders[mor_id][0])
+
+            execution = Execution.objects.create(asset_id=ticker_id, volume=volume, price=fill['price'],
+                                                 amount=volume*fill['price'], order_id=mor_id,
+                                                 executed=fill['executed'])
+            apex_fills.append(ExecutionApexFill(apex_fill_id=fill['id'], execution=execution))
             trans = Transaction.objects.create(reason=Transaction.REASON_ORDER,
                                                amount=volume*fill['price'],
-                                               to_goal=er.goal, executed=fill['executed'])
+                                               to_goal_id=goal_id, executed=fill['executed'])
             ed = ExecutionDistribution.objects.create(execution=execution, transaction=trans, volume=volume,
-                                                      execution_request=er)
+                                                      execution_request_id=er_id)
 
             if volume > 0:
-                PositionLot.objects.create(quantity=volume, execution_distribution=ed)
+                lots.append(PositionLot(quantity=volume, execution_distribution=ed))
+                holdings[(goal_id, ticker_id)] += volume
             else:
-                create_sale(ticker.id, volume, fill['price'], ed)
-
-    for mor_id in complete_mor_ids:
-        mor = MarketOrderRequest.objects.get(id=mor_id)
-        mor.state = MarketOrderRequest.State.COMPLETE.value
-        mor.save()
-
-    for etna_order_id in complete_etna_order_ids:
-        etna_order = OrderETNA.objects.get(id=etna_order_id)
-        etna_order.Status = OrderETNA.StatusChoice.Archived.value
-
-        sum_fills = ApexFill.objects.filter(etna_order_id=etna_order_id).aggregate(sum=Sum('volume'))
-        if sum_fills['sum'] == etna_order.Quantity:
-            etna_order.fill_info = OrderETNA.FillInfo.FILLED.value
-        elif sum_fills['sum'] == 0:
-            etna_order.fill_info = OrderETNA.FillInfo.UNFILLED.value
+                # The lots bought so far must be there to sell from.
+                PositionLot.objects.bulk_create(lots)
+                lots = []
+                create_sale(ticker_id, volume, fill['price'], ed)
+
+    ExecutionApexFill.objects.bulk_create(apex_fills)
+    PositionLot.objects.bulk_create(lots)
+    GoalHolding.adjust(holdings)
+
+    if MarketOrderRequest.objects.filter(id__in=complete_mor_ids, account__confirmed=False).exists():
+        raise ValidationError('Account is not verified.')
+    MarketOrderRequest.objects.filter(id__in=complete_mor_ids).update(state=MarketOrderRequest.State.COMPLETE.value)
+
+    sum_fills = dict(ApexFill.objects
+                     .filter(etna_order_id__in=complete_etna_order_ids)
+                     .order_by()
+                     .values('etna_order_id')
+                     .annotate(sum=Sum('volume'))
+                     .values_list('etna_order_id', 'sum'))
+    fill_infos = defaultdict(list)
+    for etna_order_id, quantity in OrderETNA.objects.filter(id__in=complete_etna_order_ids)\
+            .values_list('id', 'Quantity'):
+        filled = sum_fills.get(etna_order_id)
+        if filled == quantity:
+            fill_infos[OrderETNA.FillInfo.FILLED.value].append(etna_order_id)
+        elif filled == 0:
+            fill_infos[OrderETNA.FillInfo.UNFILLED.value].append(etna_order_id)
         else:
-            etna_order.fill_info = OrderETNA.FillInfo.PARTIALY_FILLED.value
-        etna_order.save()
-
-
-def create_sale(ticker_id, volume, current_price, execution_distribution):
-    # start selling PositionLots from 1st until quantity sold == volume
-    year_ago = timezone.now() - timedelta(days=366)
-    position_lots = PositionLot.objects \
-                    .filter(execution_distribution__execution__asset_id=ticker_id)\
-                    .filter(quantity__gt=0)\
-                    .annotate(price_entry=F('execution_distribution__execution__price'),
-                              executed=F('execution_distribution__execution__executed'),
-                              ticker_id=F('execution_distribution__execution__asset_id'))\
-                    .annotate(tax_bracket=Case(
-                      When(executed__gt=year_ago, then=Value(TAX_BRACKET_LESS1Y)),
-                      When(executed__lte=year_ago, then=Value(TAX_BRACKET_MORE1Y)),
-                      output_field=FloatField())) \
-                    .annotate(unit_tax_cost=(current_price - F('price_entry')) * F('tax_bracket')) \
-                    .order_by('unit_tax_cost')
-
-    left_to_sell = abs(volume)
-    for lot in position_lots:
-        if left_to_sell == 0:
-            break
-
-        new_quantity = max(lot.quantity - left_to_sell, 0)
-        left_to_sell -= lot.quantity - new_quantity
-        lot.quantity = new_quantity
-        lot.save()
-        if new_quantity == 0:
-            lot.delete()
-
-        Sale.objects.create(quantity=- (lot.quantity - new_quantity),
-                            sell_execution_distribution=execution_distribution,
-                            buy_execution_distribution=lot.execution_distribution)
+            fill_infos[OrderETNA.FillInfo.PARTIALY_FILLED.value].append(etna_order_id)
+    for fill_info, etna_order_ids in fill_infos.items():
+        OrderETNA.objects.filter(id__in=etna_order_ids).update(Status=OrderETNA.StatusChoice.Archived.value,
+                                                               fill_info=fill_info)
+
+
+def create_sale(ticker_id, volume, current_price, execution_distribution, tax_lots=None):
+    '''
+    Sell volume units of the ticker from the selling goal's position lots, those with the lowest unit tax cost at
+    current_price first. The lots sold out are deleted and the one partly sold updated with a query each, and the
+    sales are inserted together.
+    :param tax_lots: A TaxLotIndex with the goal's open lots of the ticker. They're loaded if not given.
+    '''
+    tx = execution_distribution.transaction
+    goal_id = tx.from_goal_id if tx.from_goal_id is not None else tx.to_goal_id
+    if tax_lots is None:
+        tax_lots = TaxLotIndex.load(goal_ids=[goal_id], ticker_ids=[ticker_id])
+    sold = tax_lots.sell(goal_id, ticker_id, abs(volume), current_price)
+    if not sold:
+        return
+
+    PositionLot.objects.filter(id__in=[lot['id'] for lot, _ in sold if lot['quantity'] == 0]).delete()
+    for lot, _ in sold:
+        if lot['quantity'] > 0:
+            PositionLot.objects.filter(id=lot['id']).update(quantity=lot['quantity'])
+    Sale.objects.bulk_create(Sale(quantity=-sold_quantity,
+                                  sell_execution_distribution=execution_distribution,
+                                  buy_execution_distribution_id=lot['execution_distribution_id'])
+                             for lot, sold_quantity in sold)
+
+    change = 0.0
+    for _, sold_quantity in sold:
+        change -= sold_quantity
+    GoalHolding.adjust({(goal_id, ticker_id): change})
 
 
 def example_usage_with_IB():
@@ -6,7 +6,7 @@ from api.v1.tests.factories import ExecutionRequestFactory, MarketOrderRequestFa
 from execution.end_of_day import *
 from execution.end_of_day import create_apex_orders, process_apex_fills, send_etna_order, \
     mark_etna_order_as_complete
-from main.models import ApexFill
+from main.models import ApexFill, GoalHolding, Sale, lot_holdings
 
 
 class BaseTest(TestCase):
@@ -151,3 +151,52 @@ class BaseTest(TestCase):
         process_apex_fills()
         order2 = OrderETNA.objects.get(id=order2_etna.id)
         self.assertTrue(order2.fill_info == OrderETNA.FillInfo.FILLED.value)
+
+        holding = GoalHolding.objects.get(goal=self.goal1, ticker=self.ticker1)
+        self.assertAlmostEqual(holding.quantity, 40)
+        self.assertAlmostEqual(Sale.objects.aggregate(sum=Sum('quantity'))['sum'], -60)
+
+    def test_holdings_match_lots(self):
+        # GoalHolding is only right if every path writing lots adjusts it, so buy, then sell, and compare.
+        for volume, price in ((50, 10), (-20, 12)):
+            mor = MarketOrderRequestFactory.create(account=self.account1)
+            ExecutionRequestFactory.create(goal=self.goal1, asset=self.ticker1, volume=volume, order=mor)
+            create_apex_orders()
+            order_etna = OrderETNA.objects.get(ticker=self.ticker1, Status=OrderETNA.StatusChoice.New.value)
+            send_etna_order(order_etna)
+            mark_etna_order_as_complete(order_etna)
+            ApexFillFactory.create(volume=volume, price=price, etna_order=order_etna)
+            process_apex_fills()
+
+            holdings = {(h.goal_id, h.ticker_id): h.quantity for h in GoalHolding.objects.filter(quantity__gt=0)}
+            lots = {(row['goal_id'], row['ticker_id']): row['quantity']
+                    for row in lot_holdings(PositionLot.objects.all()) if row['quantity'] > 0}
+            self.assertDictEqual(holdings, lots)
+        self.assertDictEqual(holdings, {(self.goal1.id, self.ticker1.id): 30})
+
+    def test_fills_shared_pro_rata(self):
+        mor1 = MarketOrderRequestFactory.create(account=self.account1)
+        ExecutionRequestFactory.create(goal=self.goal1, asset=self.ticker1, volume=30, order=mor1)
+        mor2 = MarketOrderRequestFactory.create(account=self.account2)
+        ExecutionRequestFactory.create(goal=self.goal2, asset=self.ticker1, volume=10, order=mor2)
+        create_apex_orders()
+
+        order_etna = OrderETNA.objects.get(ticker=self.ticker1)
+        send_etna_order(order_etna)
+        mark_etna_order_as_complete(order_etna)
+        ApexFillFactory.create(volume=20, price=10, etna_order=order_etna)
+        ApexFillFactory.create(volume=20, price=12, etna_order=order_etna)
+
+        process_apex_fills()
+
+        self.assertEqual(Execution.objects.count(), 4)
+        self.assertEqual(ExecutionApexFill.objects.count(), 4)
+        self.assertEqual(PositionLot.objects.count(), 4)
+        self.assertAlmostEqual(GoalHolding.objects.get(goal=self.goal1, ticker=self.ticker1).quantity, 30)
+        self.assertAlmostEqual(GoalHolding.objects.get(goal=self.goal2, ticker=self.ticker1).quantity, 10)
+        self.assertAlmostEqual(Transaction.objects.filter(to_goal=self.goal2).aggregate(sum=Sum('amount'))['sum'],
+                               5 * 10 + 5 * 12)
+        self.assertEqual(MarketOrderRequest.objects.filter(state=MarketOrderRequest.State.COMPLETE.value).count(), 2)
+        order_etna = OrderETNA.objects.get(id=order_etna.id)
+        self.assertEqual(order_etna.Status, OrderETNA.StatusChoice.Archived.value)
+        self.assertEqual(order_etna.fill_info, OrderETNA.FillInfo.FILLED.value)
@@ -37,6 +37,9 @@ CACHES = {
 
 STATIC_ROOT = "/collected_static"
 
+# Instrument data store shared by the workers in this container
+INSTRUMENT_STORE_DIR = os.environ.get('INSTRUMENT_STORE_DIR', '/tmp/instrument_store')
+
 # Mailgun on deployments
 # Mailgun Email settings if MAILGUN_API_KEY is in environ
 if os.environ.get('MAILGUN_API_KEY'):
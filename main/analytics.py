@@ -0,0 +1,182 @@
+"""
+Firm and advisor analytics for the dashboards: fees, assets under management, clients and households.
+
+Everything is worked out for a whole firm at once with grouped queries, so the number of queries doesn't grow with the
+number of advisors, clients, goals or fiscal years. Results are cached per firm. Any executed transaction or change in
+holdings invalidates the cached results of every firm by moving the cache generation on.
+"""
+import logging
+import uuid
+from datetime import datetime
+
+from django.core.cache import cache
+from django.db.models import Case, Count, FloatField, Sum, Value, When
+
+from main import redis
+
+logger = logging.getLogger('main.analytics')
+
+# How long the analytics of a firm are cached. Bounds how stale they get from price moves, which don't invalidate them.
+ANALYTICS_TIMEOUT = 60 * 60
+
+EMPTY_ADVISOR = {'fees_ytd': 0.0, 'total_fees': 0.0, 'total_balance': 0.0, 'clients': 0, 'households': 0}
+
+
+def get_firm_analytics(firm):
+    """
+    :param firm: The Firm to get the analytics for.
+    :return: The (possibly cached) result of calculate_firm_analytics for the firm.
+    """
+    key = '{}_{}_{}'.format(redis.Keys.FIRM_ANALYTICS.value, _generation(), firm.id)
+    analytics = cache.get(key)
+    if analytics is None:
+        analytics = calculate_firm_analytics(firm)
+        cache.set(key, analytics, timeout=ANALYTICS_TIMEOUT)
+    return analytics
+
+
+def get_advisor_analytics(advisor):
+    """
+    :return: The analytics of the advisor, from those of its firm.
+    """
+    return get_firm_analytics(advisor.firm)['advisors'].get(advisor.id, dict(EMPTY_ADVISOR))
+
+
+def invalidate_firm_analytics():
+    """
+    Drop the cached analytics of all firms.
+    """
+    cache.set(_generation_key(), uuid.uuid4().hex, timeout=None)
+
+
+def calculate_firm_analytics(firm):
+    """
+    :param firm: The Firm to calculate the analytics for.
+    :return: {'advisors': {advisor_id: figures}} plus the figures for the whole firm, where the figures are
+             'fees_ytd', 'total_fees', 'total_balance', 'clients' and 'households'. As for the Advisor and Firm
+             properties of the same names, fees are counted once for each of the advisor's goals they move between.
+    """
+    advisors = {}
+
+    def add(advisor_id, name, value):
+        if advisor_id is not None:
+            figures = advisors.setdefault(advisor_id, dict(EMPTY_ADVISOR))
+            figures[name] += value
+
+    for advisor_id, fees in advisor_fees(firm).items():
+        add(advisor_id, 'fees_ytd', fees['fees_ytd'])
+        add(advisor_id, 'total_fees', fees['total_fees'])
+    for advisor_id, balance in firm.advisor_balances().items():
+        add(advisor_id, 'total_balance', balance)
+    for advisor_id, count in advisor_clients(firm).items():
+        add(advisor_id, 'clients', count)
+    for advisor_id, count in advisor_households(firm).items():
+        add(advisor_id, 'households', count)
+
+    analytics = {name: sum(figures[name] for figures in advisors.values()) for name in EMPTY_ADVISOR}
+    analytics['advisors'] = advisors
+    return analytics
+
+
+def advisor_fees(firm):
+    """
+    Sum the executed fee transactions of each advisor's clients' active goals over the firm's fiscal years in two
+    queries, one for each side of the transactions.
+    :return: {advisor_id: {'fees_ytd': , 'total_fees': }}
+    """
+    from main.models import Goal, Transaction
+
+    years = list(firm.fiscal_years.all())
+    today = datetime.today()
+    current = [year for year in years if year.begin_date < today.date() < year.end_date][:1]
+
+    def amount_when(**conditions):
+        return Sum(Case(When(then='amount', **conditions), default=Value(0.0), output_field=FloatField()))
+
+    sums = {'year_{}'.format(ix): amount_when(executed__gte=year.begin_date, executed__lte=year.end_date)
+            for ix, year in enumerate(years)}
+    for year in current:
+        sums['ytd'] = amount_when(executed__gte=year.begin_date, executed__lte=today)
+
+    fees = {}
+    if not sums:
+        return fees
+    transactions = Transaction.objects.filter(status=Transaction.STATUS_EXECUTED, reason=Transaction.REASON_FEE)
+    for side in ('to_goal', 'from_goal'):
+        advisor = side + '__account__primary_owner__advisor'
+        rows = (transactions.filter(**{advisor + '__firm': firm})
+                .exclude(**{side + '__state': Goal.State.ARCHIVED.value})
+                .order_by()
+                .values(advisor)
+                .annotate(**sums))
+        for row in rows:
+            totals = fees.setdefault(row[advisor], {'fees_ytd': 0.0, 'total_fees': 0.0})
+            totals['fees_ytd'] += row.get('ytd') or 0.0
+            totals['total_fees'] += sum(row[name] or 0.0 for name in sums if name != 'ytd')
+    return fees
+
+
+def advisor_clients(firm):
+    """
+    :return: {advisor_id: number of (non prepopulated) clients}
+    """
+    from client.models import Client
+
+    rows = (Client.objects.filter(advisor__firm=firm, user__prepopulated=False)
+            .order_by()
+            .values('advisor')
+            .annotate(count=Count('id')))
+    return {row['advisor']: row['count'] for row in rows}
+
+
+def advisor_households(firm):
+    """
+    :return: {advisor_id: number of households with any active accounts the advisor is primary or secondary on}
+    """
+    from main.models import AccountGroup
+
+    active = (AccountGroup.objects
+              .filter(accounts_all__confirmed=True, accounts_all__primary_owner__user__prepopulated=False)
+              .values('id'))
+    households = {}
+    for advisor in ('advisor', 'secondary_advisors'):
+        rows = (AccountGroup.objects.filter(id__in=active, **{advisor + '__firm': firm})
+                .order_by()
+                .values(advisor)
+                .annotate(count=Count('id', distinct=True)))
+        for row in rows:
+            households[row[advisor]] = households.get(row[advisor], 0) + row['count']
+    return households
+
+
+def advisor_goals(firm, advisor=None):
+    """
+    :param advisor: Only get the goals of this advisor.
+    :return: {advisor_id: set of goal ids} of the goals in the active accounts of the households each advisor is
+             primary or secondary on. Advisor.average_return and the firm dashboard both rate these goals, as they
+             share the cached rate of each advisor.
+    """
+    from main.models import Goal
+
+    goals = Goal.objects.filter(account__confirmed=True, account__primary_owner__user__prepopulated=False)
+    members = {}
+    for lookup in ('account__account_group__advisor', 'account__account_group__secondary_advisors'):
+        advisor_goals = goals.filter(**{lookup + '__firm': firm})
+        if advisor is not None:
+            advisor_goals = advisor_goals.filter(**{lookup: advisor})
+        for goal_id, advisor_id in advisor_goals.values_list('id', lookup):
+            members.setdefault(advisor_id, set()).add(goal_id)
+    return members
+
+
+def _generation_key():
+    return '{}_generation'.format(redis.Keys.FIRM_ANALYTICS.value)
+
+
+def _generation():
+    generation = cache.get(_generation_key())
+    if generation is None:
+        cache.add(_generation_key(), uuid.uuid4().hex, timeout=None)
+        # Someone else may have added it first.
+        generation = cache.get(_generation_key()) or 'none'
+    return generation
@@ -0,0 +1,255 @@
+"""
+Builds the HistoricalBalance cache of each goal's closing balance for a day: its holdings at the day's prices plus its
+cash, both worked out from the executed Execution and Transaction records.
+
+A range of days is built in bulk. The holdings and cash at the start of the range come from one grouped query each, and
+every day after that adds its own executions and transactions to the day before. Days are written in batches of
+BATCH_DAYS, each in its own database transaction, so an interrupted backfill can pick up from the days still missing.
+"""
+import logging
+from datetime import datetime, time, timedelta
+
+import numpy as np
+import pandas as pd
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.models import F, IntegerField, Max, Sum
+from django.db.models.functions import Coalesce
+from django.utils.timezone import make_aware, make_naive
+
+logger = logging.getLogger('main.balance_history')
+
+# The most days built and written in one database transaction.
+BATCH_DAYS = 31
+
+# The most a stored balance may differ from a full build before verify_balances rewrites it.
+VERIFY_TOLERANCE = 0.01
+
+
+def calculate_balances(begin, end):
+    """
+    The closing balance of every goal with any executed transactions, that isn't archived, on each day from begin to
+    end. A goal has no balance before its first executed transaction.
+    :param begin: The first day to calculate.
+    :param end: The last day to calculate.
+    :return: [(goal_id, day, balance)]
+    """
+    from main.models import DailyPrice, ExecutionDistribution, Goal, Ticker, Transaction
+
+    days = pd.date_range(begin, end)
+    if not len(days):
+        return []
+    start = _day_start(begin)
+    stop = _day_start(end + timedelta(1))
+
+    # The cash of each goal: all it has received less all it has sent.
+    txs = Transaction.objects.filter(status=Transaction.STATUS_EXECUTED).order_by()
+    opening_cash = {}
+    for side, sign in (('to_goal', 1), ('from_goal', -1)):
+        for goal_id, amount in (txs.filter(executed__lt=start, **{side + '__isnull': False})
+                                .values(side).annotate(amount=Sum('amount')).values_list(side, 'amount')):
+            opening_cash[goal_id] = opening_cash.get(goal_id, 0.0) + sign * amount
+    cash_moves = []
+    for to_goal, from_goal, amount, executed in (txs.filter(executed__gte=start, executed__lt=stop)
+                                                 .values_list('to_goal', 'from_goal', 'amount', 'executed')):
+        day = _day_index(executed, begin)
+        if to_goal is not None:
+            cash_moves.append((to_goal, day, amount))
+        if from_goal is not None:
+            cash_moves.append((from_goal, day, -amount))
+
+    # The units of each ticker held by each goal.
+    distributions = (ExecutionDistribution.objects
+                     .filter(transaction__status=Transaction.STATUS_EXECUTED)
+                     .order_by()
+                     .annotate(goal_id=Coalesce('transaction__from_goal', 'transaction__to_goal',
+                                                output_field=IntegerField()),
+                               ticker_id=F('execution__asset')))
+    opening_units = (distributions.filter(execution__executed__lt=start)
+                     .values('goal_id', 'ticker_id')
+                     .annotate(volume=Sum('volume'))
+                     .values_list('goal_id', 'ticker_id', 'volume'))
+    opening_units = [(goal_id, ticker_id, 0, volume) for goal_id, ticker_id, volume in opening_units]
+    unit_moves = [(goal_id, ticker_id, _day_index(executed, begin), volume)
+                  for goal_id, ticker_id, volume, executed in
+                  (distributions.filter(execution__executed__gte=start, execution__executed__lt=stop)
+                   .values_list('goal_id', 'ticker_id', 'volume', 'execution__executed'))]
+
+    # Every goal starts on the first day it has any cash or units.
+    first_day = {goal_id: 0 for goal_id in opening_cash}
+    for goal_id, day, _ in cash_moves:
+        first_day[goal_id] = min(day, first_day.get(goal_id, day))
+    for goal_id, _, day, _ in opening_units + unit_moves:
+        first_day[goal_id] = min(day, first_day.get(goal_id, day))
+    archived = set(Goal.objects.filter(id__in=list(first_day), state=Goal.State.ARCHIVED.value)
+                   .values_list('id', flat=True))
+    goal_ids = sorted(goal_id for goal_id in first_day if goal_id is not None and goal_id not in archived)
+    if not goal_ids:
+        return []
+    goal_locs = {goal_id: ix for ix, goal_id in enumerate(goal_ids)}
+
+    cash = np.zeros((len(days), len(goal_ids)))
+    for goal_id, amount in opening_cash.items():
+        if goal_id in goal_locs:
+            cash[0, goal_locs[goal_id]] += amount
+    moves = [move for move in cash_moves if move[0] in goal_locs]
+    _add_moves(cash, [move[1] for move in moves], [goal_locs[move[0]] for move in moves], [move[2] for move in moves])
+    cash = np.cumsum(cash, axis=0)
+
+    moves = [move for move in opening_units + unit_moves if move[0] in goal_locs]
+    pairs = sorted({move[:2] for move in moves})
+    pair_locs = {pair: ix for ix, pair in enumerate(pairs)}
+    units = np.zeros((len(days), len(pairs)))
+    _add_moves(units, [move[2] for move in moves], [pair_locs[move[:2]] for move in moves],
+               [move[3] for move in moves])
+    units = np.cumsum(units, axis=0)
+
+    tickers = sorted({pair[1] for pair in pairs})
+    prices = _daily_prices(tickers, days, DailyPrice, ContentType.objects.get_for_model(Ticker).id)
+    unpriced = np.isnan(prices[-1]) if len(tickers) else np.zeros(0, dtype=bool)
+    if unpriced.any():
+        logger.warn("No prices up to {} for tickers {}. Valuing their holdings at 0.".format(
+            end, [tid for tid, missing in zip(tickers, unpriced) if missing]))
+    ticker_locs = {tid: ix for ix, tid in enumerate(tickers)}
+    values = np.nan_to_num(units * prices[:, [ticker_locs[pair[1]] for pair in pairs]])
+
+    balances = cash
+    if pairs:
+        np.add.at(balances.T, [goal_locs[pair[0]] for pair in pairs], values.T)
+    return [(goal_id, day.date(), float(balances[ix, gix]))
+            for gix, goal_id in enumerate(goal_ids)
+            for ix, day in enumerate(days) if ix >= first_day[goal_id]]
+
+
+def build_balances(begin, end, batch_days=BATCH_DAYS):
+    """
+    Calculate and write the balances of every goal for each day from begin to end, replacing any already there.
+    Each batch of days is written in its own transaction.
+    :return: The number of balances written.
+    """
+    from main.models import HistoricalBalance
+
+    written = 0
+    while begin <= end:
+        last = min(end, begin + timedelta(batch_days - 1))
+        balances = calculate_balances(begin, last)
+        with transaction.atomic():
+            HistoricalBalance.objects.filter(date__range=(begin, last)).delete()
+            HistoricalBalance.objects.bulk_create(
+                (HistoricalBalance(goal_id=goal_id, date=day, balance=balance) for goal_id, day, balance in balances),
+                batch_size=1000
+            )
+        logger.info("Wrote {} goal balances from {} to {}".format(len(balances), begin, last))
+        written += len(balances)
+        begin = last + timedelta(1)
+    return written
+
+
+def backfill_balances(begin, end, batch_days=BATCH_DAYS):
+    """
+    Build the balances for the days from begin to end that have none yet. Safe to run again after being interrupted.
+    :return: The number of balances written.
+    """
+    written = 0
+    for first, last in missing_ranges(begin, end):
+        written += build_balances(first, last, batch_days=batch_days)
+    return written
+
+
+def missing_ranges(begin, end):
+    """
+    :return: [(first, last)] of the runs of days from begin to end without any balances written.
+    """
+    from main.models import HistoricalBalance
+
+    done = set(HistoricalBalance.objects.filter(date__range=(begin, end))
+               .order_by().values_list('date', flat=True).distinct())
+    ranges = []
+    for day in pd.date_range(begin, end):
+        day = day.date()
+        if day in done:
+            continue
+        if ranges and ranges[-1][1] == day - timedelta(1):
+            ranges[-1] = (ranges[-1][0], day)
+        else:
+            ranges.append((day, day))
+    return ranges
+
+
+def first_balance_day():
+    """
+    :return: The day of the first executed transaction, from which there are balances to build. None if there are none.
+    """
+    from main.models import Transaction
+
+    first = (Transaction.objects.filter(status=Transaction.STATUS_EXECUTED, executed__isnull=False)
+             .order_by('executed').values_list('executed', flat=True).first())
+    return None if first is None else make_naive(first).date()
+
+
+def verify_balances(day=None):
+    """
+    Check the balances written for a day against a full build from all history, and rewrite the day if they differ.
+    :param day: The day to check. Defaults to the last day with balances.
+    :return: {goal_id: (stored, calculated)} of the balances that differed, with None for a missing balance.
+    """
+    from main.models import HistoricalBalance
+
+    if day is None:
+        day = HistoricalBalance.objects.aggregate(last=Max('date'))['last']
+        if day is None:
+            return {}
+    stored = dict(HistoricalBalance.objects.filter(date=day).values_list('goal', 'balance'))
+    calculated = {goal_id: balance for goal_id, _, balance in calculate_balances(day, day)}
+    differences = {}
+    for goal_id in set(stored) | set(calculated):
+        old, new = stored.get(goal_id), calculated.get(goal_id)
+        if old is None or new is None or abs(old - new) > VERIFY_TOLERANCE:
+            differences[goal_id] = (old, new)
+    if differences:
+        logger.warn("{} goal balances on {} didn't match a full build. Rewriting the day.".format(
+            len(differences), day))
+        build_balances(day, day)
+    return differences
+
+
+def _daily_prices(tickers, days, model, content_type_id):
+    """
+    :return: A days x tickers array of the last positive price of each ticker on or before each day. NaN before a
+             ticker's first price.
+    """
+    prices = np.full((len(days), len(tickers)), np.nan)
+    if not tickers:
+        return prices
+    locs = {tid: ix for ix, tid in enumerate(tickers)}
+    begin = days[0].date()
+    priced = model.objects.filter(instrument_content_type=content_type_id, instrument_object_id__in=tickers,
+                                  price__gt=0)
+    # The last price before the range opens it.
+    latest = (priced.filter(date__lt=begin).order_by()
+              .values('instrument_object_id').annotate(last=Max('date')))
+    opening = {row['instrument_object_id']: row['last'] for row in latest}
+    for tid, dt, price in (priced.filter(date__in=set(opening.values()), instrument_object_id__in=list(opening))
+                           .values_list('instrument_object_id', 'date', 'price')):
+        if opening[tid] == dt:
+            prices[0, locs[tid]] = price
+    rows = priced.filter(date__range=(begin, days[-1].date())).values_list('instrument_object_id', 'date', 'price')
+    for tid, dt, price in rows:
+        prices[(dt - begin).days, locs[tid]] = price
+    return pd.DataFrame(prices).fillna(method='ffill').values
+
+
+def _add_moves(totals, days, columns, amounts):
+    """
+    Add each amount to its day and column of totals, in order.
+    """
+    if amounts:
+        np.add.at(totals, (np.array(days, dtype=int), np.array(columns, dtype=int)), amounts)
+
+
+def _day_start(day):
+    return make_aware(datetime.combine(day, time()))
+
+
+def _day_index(executed, begin):
+    return (make_naive(executed).date() - begin).days
@@ -1,61 +1,327 @@
 from __future__ import unicode_literals
 
+import decimal
+import logging
+from datetime import datetime, time, timedelta
 from typing import Iterable
 
-from django.db.models import Q
-from django.utils.timezone import now
+import numpy as np
+import pandas as pd
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.db.models import Case, Count, FloatField, Max, Q, Sum, Value, When
+from django.utils.timezone import make_aware, make_naive, now
 
+from common.utils import dt2ed
 
-def mod_dietz_rate(goals: Iterable) -> float:
+from main import redis
+
+logger = logging.getLogger('main.finance')
+
+# Rates of return are cached for the day they were calculated on.
+RETURNS_CACHE_TIMEOUT = 60 * 60 * 24
+
+# The last days of a performance history are recalculated on every request, as their prices may still be loaded late.
+PERFORMANCE_REFRESH_DAYS = 5
+PERFORMANCE_CACHE_TIMEOUT = 60 * 60 * 24 * 7
+
+
+def _transaction_components():
+    """
+    :return: {name: (statuses, reasons)} of the transactions each figure of a goal summary is built from. reasons is
+             None for transactions of any reason.
+    """
     from main.models import Transaction
 
+    executed = [Transaction.STATUS_EXECUTED]
+    requested = [r for r, _ in Transaction.REASONS if r not in (Transaction.REASON_FEE, Transaction.REASON_DIVIDEND)]
+    return {
+        'pending': ([Transaction.STATUS_PENDING], None),
+        'requested': (executed, requested),
+        'dividends': (executed, [Transaction.REASON_DIVIDEND]),
+        'deposits': (executed, [Transaction.REASON_DEPOSIT]),
+        'withdrawals': (executed, [Transaction.REASON_WITHDRAWAL]),
+        'cash_flow': (executed, list(Transaction.CASH_FLOW_REASONS)),
+        'executions': (executed, [Transaction.REASON_EXECUTION]),
+        'fees': (executed, [Transaction.REASON_FEE]),
+    }
+
+
+def financials_aggregates():
+    """
+    :return: {name: aggregate} of the conditional sums of transaction amounts each goal summary is built from.
+    """
+    sums = {}
+    for name, (statuses, reasons) in _transaction_components().items():
+        q = Q(status__in=statuses) if reasons is None else Q(status__in=statuses, reason__in=reasons)
+        sums[name] = Sum(Case(When(q, then='amount'), default=Value(0.0), output_field=FloatField()))
+    return sums
+
+
+def goal_financials(goal_ids: Iterable) -> dict:
+    """
+    Sum the transactions of many goals in one query, grouped by the goals they flow between, and work out the
+    financial summary of each goal from the sums.
+    :param goal_ids: The ids of the goals to summarise.
+    :return: {goal_id: {figure: value}} with the figures of Goal.financials for every goal in goal_ids.
+    """
+    from main.models import Transaction
+
+    goal_ids = list(goal_ids)
+    components = _transaction_components()
+    incoming = {goal_id: dict.fromkeys(components, 0.0) for goal_id in goal_ids}
+    outgoing = {goal_id: dict.fromkeys(components, 0.0) for goal_id in goal_ids}
+    if goal_ids:
+        rows = (Transaction.objects
+                .filter(Q(to_goal__in=goal_ids) | Q(from_goal__in=goal_ids))
+                .order_by()
+                .values('to_goal', 'from_goal')
+                .annotate(**financials_aggregates()))
+        for row in rows:
+            for side, goal_id in ((incoming, row['to_goal']), (outgoing, row['from_goal'])):
+                if goal_id in side:
+                    for name in components:
+                        side[goal_id][name] += row[name] or 0.0
+
+    return {goal_id: _summarise(incoming[goal_id], outgoing[goal_id]) for goal_id in goal_ids}
+
+
+def _summarise(incoming, outgoing):
+    return {
+        'pending_incomings': incoming['pending'],
+        'pending_outgoings': outgoing['pending'],
+        'pending_amount': incoming['pending'] - outgoing['pending'],
+        'requested_incomings': incoming['requested'],
+        'requested_outgoings': -outgoing['requested'],
+        'total_dividends': incoming['dividends'] - outgoing['dividends'],
+        'total_deposits': incoming['deposits'],
+        'total_withdrawals': outgoing['withdrawals'],
+        'net_invested': incoming['cash_flow'] - outgoing['cash_flow'],
+        'net_executions': incoming['executions'] - outgoing['executions'],
+        'total_fees': incoming['fees'] - outgoing['fees'],
+    }
+
+
+def mod_dietz_rate(goals: Iterable) -> float:
+    """
+    :param goals: The goals to get the combined return of.
+    :return: The annualised Modified Dietz rate of return of the goals together, up to their current total_balance.
+    """
+    goals = list(goals)
     end_value = sum(g.total_balance for g in goals)
-    begin_value = 0
-    cash_flows = []
-    start_date = None
-    transactions = (
-        Transaction.objects.filter(
-            Q(from_goal__in=goals) | Q(to_goal__in=goals),
-            Q(reason=Transaction.REASON_WITHDRAWAL) |
-            Q(reason=Transaction.REASON_DEPOSIT),
-            status=Transaction.STATUS_EXECUTED
-        ).order_by('created'))
-    for tr in transactions:
-        amount = -tr.amount if tr.from_goal is not None else tr.amount
+    return mod_dietz_rates({None: goals}, end_values={None: end_value})[None]
+
+
+def cached_mod_dietz_rates(name: str, groups: dict) -> dict:
+    """
+    mod_dietz_rates, with each group's rate cached until the end of the day.
+    :param name: The kind of group, eg. 'advisor'. The group keys must identify the group within this name.
+    :param groups: As for mod_dietz_rates.
+    :return: As for mod_dietz_rates.
+    """
+    today = now().date()
+    keys = {key: '{}_{}_{}_{}'.format(redis.Keys.RETURNS.value, name, key, today.isoformat()) for key in groups}
+    cached = cache.get_many(list(keys.values()))
+    rates = {key: cached[keys[key]] for key in groups if keys[key] in cached}
+    missing = {key: goals for key, goals in groups.items() if key not in rates}
+    if missing:
+        calculated = mod_dietz_rates(missing)
+        cache.set_many({keys[key]: rate for key, rate in calculated.items()}, timeout=RETURNS_CACHE_TIMEOUT)
+        rates.update(calculated)
+    return rates
+
+
+def mod_dietz_rates(groups: dict, end_values: dict=None) -> dict:
+    """
+    The annualised Modified Dietz rate of return of many groups of goals at once. The deposit and withdrawal
+    transactions of all the goals are loaded in one query, and each group's cash flows are picked out and weighted as
+    whole arrays. The first transaction of a group opens it. A group with a zero end value is closed by its last
+    transaction instead of today.
+    :param groups: {key: iterable of goals or goal ids} The groups may overlap.
+    :param end_values: {key: the current value of the group} Defaults to the goals' GoalQuerySet.balances() totals.
+    :return: {key: rate} with a rate of 0 for groups without any transactions.
+    """
+    from main.models import Goal, Transaction
+
+    groups = {key: {getattr(goal, 'id', goal) for goal in goals} for key, goals in groups.items()}
+    keys = list(groups)
+    goal_ids = sorted(set().union(*groups.values()))
+    rows = list(Transaction.objects
+                .filter(Q(from_goal__in=goal_ids) | Q(to_goal__in=goal_ids),
+                        Q(reason=Transaction.REASON_WITHDRAWAL) | Q(reason=Transaction.REASON_DEPOSIT),
+                        status=Transaction.STATUS_EXECUTED)
+                .order_by('created', 'id')
+                .values_list('from_goal', 'to_goal', 'amount', 'created')) if goal_ids else []
+    if not rows:
+        return {key: 0 for key in keys}
+    if end_values is None:
+        balances = Goal.objects.filter(id__in=goal_ids).balances()
+        end_values = {key: sum(balances[goal_id]['total'] for goal_id in ids if goal_id in balances)
+                      for key, ids in groups.items()}
+
+    # Which transactions belong to each group. Goals outside all the groups map to the last, always False, column.
+    columns = {goal_id: ix for ix, goal_id in enumerate(goal_ids)}
+    membership = np.zeros((len(keys), len(goal_ids) + 1), dtype=bool)
+    for ix, key in enumerate(keys):
+        membership[ix, [columns[goal_id] for goal_id in groups[key]]] = True
+    from_cols = np.array([columns.get(row[0], -1) for row in rows], dtype=int)
+    to_cols = np.array([columns.get(row[1], -1) for row in rows], dtype=int)
+    flows = membership[:, from_cols] | membership[:, to_cols]
+
+    amounts = np.array([-row[2] if row[0] is not None else row[2] for row in rows], dtype=float)
+    days = np.array([row[3].date().toordinal() for row in rows], dtype=int)
+
+    # The first transaction of each group opens it, the rest are cash flows.
+    has_transactions = flows.any(axis=1)
+    first = flows.argmax(axis=1)
+    flows[np.arange(len(keys)), first] = False
+    last = flows.shape[1] - 1 - flows[:, ::-1].argmax(axis=1)
+
+    start = days[first]
+    closing = np.empty(len(keys), dtype=int)
+    ends = []
+    for ix, key in enumerate(keys):
+        end_value = end_values[key]
+        if not end_value and flows[ix].any():  # all goals have zero balance
+            # get closing date and balance from the last transaction,
+            # which is a withdrawal with a negative amount, and the balance must be positive
+            flows[ix, last[ix]] = False
+            end_value = abs(float(amounts[last[ix]]))
+            closing[ix] = days[last[ix]]
+        else:
+            closing[ix] = now().date().toordinal()
+        ends.append(end_value)
+
+    # Since we can have a group with start=end=today()
+    # It makes sense to show the return as if total_days=1
+    total_days = np.maximum(closing - start, 1)[:, None]
+    # Cumulative sums add in transaction order, like summing the cash flows one by one.
+    cash_flow_balance = np.cumsum(np.where(flows, amounts, 0.0), axis=1)[:, -1]
+    prorated_sum = np.cumsum(np.where(flows, amounts * (total_days - (days - start[:, None])) / total_days, 0.0),
+                             axis=1)[:, -1]
+
+    rates = {}
+    for ix, key in enumerate(keys):
+        if not has_transactions[ix]:
+            rates[key] = 0
+            continue
+        begin_value = float(amounts[first[ix]])
         try:
-            cash_flows.append((
-                (tr.created.date() - start_date).days,
-                amount,
-                tr.created.date()
-            ))
-        except TypeError:  # start_date is None
-            # use date of the first transaction as opening date
-            # and it's not a part of cashflow
-            start_date = tr.created.date()
-            begin_value = amount
-
-    if not transactions:
-        return 0
-
-    if not end_value and cash_flows:  # all goals have zero balance
-        # get closing date and balance from the last transaction
-        _, end_value, closing_date = cash_flows.pop()
-        # last transaction is withdrawal with negative amount,
-        # and balance must be positive
-        end_value = abs(end_value)
+            result = (ends[ix] - begin_value - float(cash_flow_balance[ix])) / (begin_value + float(prorated_sum[ix]))
+            rates[key] = pow(1 + result, 365.25 / int(total_days[ix, 0])) - 1
+        except (ZeroDivisionError, OverflowError):
+            logger.warning("Modified Dietz return of {} is undefined for its cash flows.".format(key))
+            rates[key] = 0
+    return rates
+
+
+def performance_history(goal_id) -> list:
+    """
+    The daily performance of a goal's holdings from its first execution until today. This is the movement of the market
+    prices given the volumes held each day, ignoring the prices the units were actually bought or sold for.
+
+    The history is cached up to PERFORMANCE_REFRESH_DAYS ago along with the prices and volumes held on that day, so a
+    request only calculates the days since then. Any new execution for the goal starts the history over.
+    :param goal_id: The id of the goal.
+    :return: [(epoch day, performance)] with the performance as a six place Decimal, and 0 for the first day.
+    """
+    from main.models import Transaction
+
+    txs = Transaction.objects.filter(Q(to_goal=goal_id) | Q(from_goal=goal_id), reason=Transaction.REASON_EXECUTION)
+    signature = txs.aggregate(count=Count('id'), last=Max('id'))
+    if not signature['count']:
+        return []
+    key = '{}_{}'.format(redis.Keys.PERFORMANCE_HISTORY.value, goal_id)
+    state = cache.get(key)
+    if state is not None and state['signature'] != signature:
+        state = None
+    end = make_naive(now()).date()
+    txs = txs.order_by('executed')
+
+    if state is None:
+        rows = list(txs.values_list('execution_distribution__execution__executed',
+                                    'execution_distribution__execution__asset__id',
+                                    'execution_distribution__volume'))
+        begin = make_naive(rows[0][0]).date()
+        tickers = sorted({row[1] for row in rows})
+        days = pd.date_range(begin, end)
+        prices = _daily_prices(tickers, days)
+        vols = np.zeros((len(days), len(tickers)))
+        points = [(dt2ed(days[0]), 0)]  # The first day has no performance as there wasn't a move
     else:
-        closing_date = now().date()
+        rows = list(txs.filter(execution_distribution__execution__executed__gte=make_aware(
+            datetime.combine(state['date'] + timedelta(1), time())))
+                    .values_list('execution_distribution__execution__executed',
+                                 'execution_distribution__execution__asset__id',
+                                 'execution_distribution__volume'))
+        tickers = state['tickers']
+        days = pd.date_range(state['date'], end)
+        # Start from the settled day of the cached history, and carry on from its prices and volumes.
+        prices = _daily_prices(tickers, days[1:], previous=state['prices'])
+        vols = np.zeros((len(days), len(tickers)))
+        vols[0] = state['vols']
+        points = state['points']
 
-    cash_flow_balance = sum(i[1] for i in cash_flows)
-    total_days = (closing_date - start_date).days
+    # Add up each day's executions in the order they were made, then the volumes held at the end of each day.
+    locs = {tid: ix for ix, tid in enumerate(tickers)}
+    rows = [((make_naive(row[0]).date() - days[0].date()).days, locs[row[1]], row[2]) for row in rows]
+    rows = [row for row in rows if row[0] < len(days)]
+    np.add.at(vols, ([row[0] for row in rows], [row[1] for row in rows]), [row[2] for row in rows])
+    vols = np.cumsum(vols, axis=0)
 
-    # Since we can have a goal with start=end=today()
-    # It makes sense to show the return as if total_days=1
-    if total_days == 0:
-        total_days = 1
-    prorated_sum = sum(cfi * (total_days - d) / total_days
-                       for d, cfi, _ in cash_flows)
-    result = (end_value - begin_value -
-              cash_flow_balance) / (begin_value + prorated_sum)
-    annualised_return = pow(1 + result, 365.25 / total_days) - 1
-    return annualised_return
+    # Cache up to the last day old enough to be settled, provided every ticker had a price by then. Before its first
+    # price, a ticker takes its first price.
+    settled = len(days) - 1 - PERFORMANCE_REFRESH_DAYS
+    settled = settled if settled > 0 and not np.isnan(prices[settled]).any() else None
+    prices = pd.DataFrame(prices).fillna(method='bfill').values
+
+    # Only the volumes we know for sure were exposed for a day's move count, so the least of it and the day before.
+    exposed = np.minimum(vols[1:], vols[:-1])
+    # Sum left to right, as the history has always been calculated.
+    impact = np.cumsum(exposed * (prices[1:] - prices[:-1]), axis=1)[:, -1]
+    value = np.cumsum(exposed * prices[:-1], axis=1)[:, -1]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        perfs = np.where(value == 0, 0, impact / value)
+    places = decimal.Decimal('1.000000')
+    points = points + [(dt2ed(day), decimal.Decimal.from_float(float(perf)).quantize(places))
+                       for day, perf in zip(days[1:], perfs)]
+
+    if settled is not None:
+        cache.set(key, {
+            'signature': signature,
+            'tickers': tickers,
+            'date': days[settled].date(),
+            'prices': prices[settled],
+            'vols': vols[settled],
+            'points': points[:len(points) - (len(days) - 1 - settled)],
+        }, timeout=PERFORMANCE_CACHE_TIMEOUT)
+    return points
+
+
+def _daily_prices(tickers, days, previous=None):
+    """
+    :param tickers: The ids of the tickers to get the prices of.
+    :param days: The consecutive days to get the prices for.
+    :param previous: The prices on the day before the first day, if they should be used to start from.
+    :return: A days x tickers array of prices, plus a first row of previous if given. A missing or non positive price
+             is taken from the day before, and is NaN until the first price of the ticker.
+    """
+    from main.models import DailyPrice, Ticker
+
+    rows = []
+    if len(days):
+        rows = (DailyPrice.objects
+                .filter(date__range=(days[0].date(), days[-1].date()),
+                        instrument_content_type=ContentType.objects.get_for_model(Ticker).id,
+                        instrument_object_id__in=tickers)
+                .values_list('date', 'instrument_object_id', 'price'))
+    locs = {tid: ix for ix, tid in enumerate(tickers)}
+    offset = 0 if previous is None else 1
+    prices = np.full((len(days) + offset, len(tickers)), np.nan)
+    if previous is not None:
+        prices[0] = previous
+    first = days[0].date() if len(days) else None
+    for dt, tid, price in rows:
+        if price > 0:
+            prices[(dt - first).days + offset, locs[tid]] = price
+    return pd.DataFrame(prices).fillna(method='ffill').values
@@ -0,0 +1,165 @@
+"""
+The cumulative inflation index, as a contiguous array of the cumulative factor for each month from the start of the
+Inflation figures, so any date is looked up by its month offset from the start.
+
+Each process keeps the index it loaded. Saving or deleting Inflation figures moves the index version on, which every
+process notices within VERSION_CHECK_SECONDS and loads the new index, from the cache if another process already has.
+"""
+import logging
+import uuid
+from time import time
+
+import numpy as np
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+
+from main import redis
+
+logger = logging.getLogger('main.inflation')
+
+# How long a process uses its index before checking whether the figures have changed.
+VERSION_CHECK_SECONDS = 60
+
+INDEX_CACHE_TIMEOUT = 60 * 60 * 24
+
+
+def month_number(year, month):
+    return year * 12 + month - 1
+
+
+class InflationIndex(object):
+    def __init__(self, first, factors, version=None):
+        """
+        :param first: The month number of the first factor, which is the month before the first figure.
+        :param factors: The cumulative inflation (1-based) at the end of each month from the first.
+        :param version: The version of the figures the index was built from.
+        """
+        self.first = first
+        self.factors = np.asarray(factors, dtype=float)
+        self.version = version
+
+    @classmethod
+    def from_figures(cls, figures, version=None):
+        """
+        :param figures: [(year, month, value)] of the monthly inflation figures, in order.
+        :raises Exception: If there are months missing from the figures.
+        """
+        if not figures:
+            return cls(0, [], version=version)
+        first = month_number(figures[0][0], figures[0][1])
+        last = month_number(figures[-1][0], figures[-1][1])
+        if last - first + 1 > len(figures):
+            raise Exception("Holes exist in the inflation forecast figures, cannot proceed.")
+        values = np.array([figure[2] for figure in figures], dtype=float)
+        return cls(first - 1, np.cumprod(np.concatenate(([1.0], 1 + values))), version=version)
+
+    def __len__(self):
+        return len(self.factors)
+
+    def cumulative(self, dates):
+        """
+        :param dates: A date, or a sequence of dates.
+        :return: The cumulative inflation at the end of each date's month, in the same shape as dates.
+        :raises ValidationError: If the figures don't cover every date.
+        """
+        scalar = not hasattr(dates, '__len__')
+        dates = [dates] if scalar else list(dates)
+        offsets = np.array([month_number(dt.year, dt.month) for dt in dates], dtype=int) - self.first
+        if len(offsets) and (offsets.min() < 0 or offsets.max() >= len(self.factors)):
+            raise ValidationError("Inflation figures don't cover entire period requested: {} - {}".format(
+                min(dates), max(dates)))
+        factors = self.factors[offsets]
+        return factors[0] if scalar else factors
+
+    def between(self, begin_dates, end_dates):
+        """
+        Calculates inflation between pairs of dates. (predicted if in future, actual for all past dates)
+        :param begin_dates: A date, or sequence of dates, to calculate the inflation from.
+        :param end_dates: A date, or sequence of dates, to calculate the inflation to. The same shape as begin_dates.
+        :return: The inflation between each pair. 0.05 = 5% inflation
+        """
+        if not hasattr(begin_dates, '__len__'):
+            if begin_dates > end_dates:
+                raise ValueError('End date must not be before begin date.')
+            if begin_dates == end_dates:
+                return 0
+            return self.cumulative(end_dates) / self.cumulative(begin_dates) - 1
+
+        begin_dates, end_dates = list(begin_dates), list(end_dates)
+        if any(begin > end for begin, end in zip(begin_dates, end_dates)):
+            raise ValueError('End date must not be before begin date.')
+        same = np.array([begin == end for begin, end in zip(begin_dates, end_dates)], dtype=bool)
+        return np.where(same, 0, self.cumulative(end_dates) / self.cumulative(begin_dates) - 1)
+
+    def as_dict(self):
+        """
+        :return: {(year, month): cumulative inflation} for each month of the index.
+        """
+        data = {}
+        for ix, factor in enumerate(self.factors):
+            year, month = divmod(self.first + ix, 12)
+            data[(year, month + 1)] = float(factor)
+        return data
+
+
+_index = None
+_checked = 0
+
+
+def get_index():
+    """
+    :return: The InflationIndex of the current figures. Loaded at most once per version in each process.
+    """
+    global _index, _checked
+    if _index is not None and time() - _checked < VERSION_CHECK_SECONDS:
+        return _index
+    version = _version()
+    if _index is None or _index.version != version:
+        _index = _load(version)
+    _checked = time()
+    return _index
+
+
+def invalidate_index():
+    """
+    Drop the index, in this process and every other, so the next lookup loads the current figures.
+    """
+    global _index
+    _index = None
+    cache.set(_version_key(), uuid.uuid4().hex, timeout=None)
+
+
+def warm_index():
+    """
+    Load the index for this process ahead of its first use, such as when a server process starts.
+    """
+    try:
+        get_index()
+    except Exception:
+        logger.exception("Couldn't load the inflation index. It will be loaded when first used.")
+
+
+def _load(version):
+    from main.models import Inflation
+
+    key = '{}_{}'.format(redis.Keys.INFLATION.value, version)
+    state = cache.get(key)
+    if state is not None:
+        return InflationIndex(state['first'], state['factors'], version=version)
+    index = InflationIndex.from_figures(list(Inflation.objects.all().values_list('year', 'month', 'value')),
+                                        version=version)
+    cache.set(key, {'first': index.first, 'factors': index.factors.tolist()}, timeout=INDEX_CACHE_TIMEOUT)
+    return index
+
+
+def _version_key():
+    return '{}_version'.format(redis.Keys.INFLATION.value)
+
+
+def _version():
+    version = cache.get(_version_key())
+    if version is None:
+        cache.add(_version_key(), uuid.uuid4().hex, timeout=None)
+        # Someone else may have added it first.
+        version = cache.get(_version_key()) or 'none'
+    return version
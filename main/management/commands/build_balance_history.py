@@ -0,0 +1,47 @@
+import logging
+from datetime import datetime
+
+from django.core.management.base import BaseCommand
+from django.utils.timezone import make_naive, now
+
+from main.balance_history import BATCH_DAYS, backfill_balances, build_balances, first_balance_day, verify_balances
+
+logger = logging.getLogger("build_balance_history")
+
+
+def parse_date(val):
+    return datetime.strptime(val, '%Y%m%d').date()
+
+
+class Command(BaseCommand):
+    help = "Writes each goal's closing balance to the HistoricalBalance table for any days that don't have them yet."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--begin', type=parse_date,
+                            help='Inclusive first date to build. (YYYYMMDD) '
+                                 'Defaults to the day of the first executed transaction.')
+        parser.add_argument('--end', type=parse_date,
+                            help='Inclusive last date to build. (YYYYMMDD) Defaults to today.')
+        parser.add_argument('--rebuild', action='store_true', default=False,
+                            help='Rebuild every day in the range, not just the days without balances.')
+        parser.add_argument('--verify', action='store_true', default=False,
+                            help='Check the last day built against a full build from all history, rewriting it if '
+                                 'they differ, rather than building anything else.')
+        parser.add_argument('--batch-days', type=int, default=BATCH_DAYS,
+                            help='Number of days to write in each database transaction.')
+
+    def handle(self, *args, **options):
+        if options['verify']:
+            differences = verify_balances()
+            for goal_id, (stored, calculated) in sorted(differences.items()):
+                logger.warn("Goal {} had balance {} rather than {}".format(goal_id, stored, calculated))
+            return
+
+        begin = options['begin'] or first_balance_day()
+        end = options['end'] or make_naive(now()).date()
+        if begin is None:
+            logger.info("There are no executed transactions, so no balances to build.")
+            return
+        build = build_balances if options['rebuild'] else backfill_balances
+        written = build(begin, end, batch_days=options['batch_days'])
+        logger.info("Wrote {} goal balances from {} to {}".format(written, begin, end))
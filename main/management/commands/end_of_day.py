@@ -16,6 +16,7 @@ Overnight Process
     - update the Position model and the Execution/ExecutionDistribution/Transaction models accordingly
 - Process any external transfers that were executed in or out from each account.
 - Write the days balance for each goal to the HistoricalBalance model. Calculate from yesterday's figure.
+  (manage.py build_balance_history)
 - Measure all metrics on goals
   - This calculates drift
 - For every account, build a map of goal.id -> experimental_settings, which will be populated for each goal that has a
@@ -54,5 +55,5 @@ Overnight Process
 
 '''
 Once a week, on the weekend, check the last HistoricalBalance record matched a full build from all history, and any
-reconciled amount from the broker
+reconciled amount from the broker (manage.py build_balance_history --verify)
 '''
\ No newline at end of file
@@ -10,6 +10,7 @@ from django.db import connection
 from django.utils.timezone import now
 
 from api.v1.tests.factories import InvestmentCycleObservationFactory, InvestmentCyclePredictionFactory
+from main.inflation import invalidate_index as invalidate_inflation_index
 from main.models import MarketIndex, DailyPrice, MarketCap, Ticker, InvestmentCycleObservation, \
     InvestmentCyclePrediction, Inflation
 
@@ -100,9 +101,8 @@ def populate_inflation(asof=now().date(), value=0.001):
     for i in range(1200):
         dt = asof + relativedelta(months=i)
         inflations.append(Inflation(year=dt.year, month=dt.month, value=value))
-    if hasattr(Inflation, '_cum_data'):
-        del Inflation._cum_data
     Inflation.objects.bulk_create(inflations)
+    invalidate_inflation_index()
 
 
 class Command(BaseCommand):
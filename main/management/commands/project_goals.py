@@ -0,0 +1,19 @@
+import logging
+
+from django.core.management.base import BaseCommand
+
+from main.models import Goal
+from main.projection import project_goals
+
+logger = logging.getLogger("project_goals")
+
+
+class Command(BaseCommand):
+    help = "Makes the day's Monte Carlo projection of every active goal with selected settings. Run nightly."
+
+    def handle(self, *args, **options):
+        goals = (Goal.objects.exclude(state=Goal.State.ARCHIVED.value)
+                 .filter(selected_settings__isnull=False)
+                 .select_related('selected_settings__portfolio'))
+        on_track = project_goals(goals)
+        logger.info("Projected {} goals. {} are on track.".format(len(on_track), sum(on_track.values())))
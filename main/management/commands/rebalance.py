@@ -4,20 +4,27 @@ Deciding when to rebalance:
    what the estimated cost of the rebalance is and how it compares to the ATCS.
 '''
 import logging
+import math
+import time
 
 import copy
 import numpy as np
 
 from portfolios.algorithms.markowitz import markowitz_optimizer_3
-from portfolios.providers.execution.abstract import Reason, ExecutionProviderAbstract
+from portfolios.providers.execution.abstract import Reason
 from portfolios.calculation import \
-    MIN_PORTFOLIO_PCT, calc_opt_inputs, create_portfolio_weights, INSTRUMENT_TABLE_EXPECTED_RETURN_LABEL
+    MIN_PORTFOLIO_PCT, calc_opt_inputs, create_portfolio_weights, get_instruments, \
+    INSTRUMENT_TABLE_EXPECTED_RETURN_LABEL
 
-from main.models import GoalMetric, PositionLot
+from main.models import ExecutionRequest, Goal, GoalMetric, MarketOrderRequest, PositionLot, Ticker, Transaction
 from collections import defaultdict
+from multiprocessing import Pool
+from django import db
+from django.core.management.base import BaseCommand
+from django.db import transaction
 from django.db.models import Sum, F, Case, When, Value, FloatField
 from django.utils import timezone
-from datetime import timedelta
+from datetime import datetime, timedelta
 from portfolios.management.commands.measure_goals import get_risk_score
 
 logger = logging.getLogger('rebalance')
@@ -26,6 +33,45 @@ TAX_BRACKET_LESS1Y = 0.3
 TAX_BRACKET_MORE1Y = 0.2
 MAX_WEIGHT_SUM = 1.0001
 
+# The most goals we load holdings for in one query.
+REBALANCE_PREFETCH_CHUNK_SIZE = 500
+
+# The number of goals whose orders are written in each database transaction.
+REBALANCE_WRITE_CHUNK_SIZE = 200
+
+# The (idata, data_provider, execution_provider) shared with each rebalance worker process when it starts.
+_worker_state = None
+
+
+class GoalRebalanceData(object):
+    """
+    The holdings of a goal that rebalancing needs, loaded in bulk for many goals by prefetch_rebalance_data.
+    While a goal has this attached, the rebalance functions use it rather than querying the database.
+    """
+    def __init__(self, positions, available_balance, lots):
+        # The same as goal.get_positions_all()
+        self.positions = positions
+        self.available_balance = available_balance
+        # Every lot with a positive quantity, as get_tax_lots returns them, plus the asset 'state'.
+        self.lots = lots
+
+
+def _prefetched(goal):
+    return getattr(goal, '_rebalance_data', None)
+
+
+def get_positions(goal):
+    """
+    :return: The goal's current positions, as goal.get_positions_all() returns them.
+    """
+    data = _prefetched(goal)
+    return goal.get_positions_all() if data is None else data.positions
+
+
+def get_available_balance(goal):
+    data = _prefetched(goal)
+    return goal.available_balance if data is None else data.available_balance
+
 def optimise_up(opt_inputs, min_weights):
     """
     Reoptimise the portfolio adding appropriate constraints so there can be no removals from assets.
@@ -58,7 +104,7 @@ def get_position_weights(goal):
     """
     res = []
     total = 0.0
-    for position in goal.get_positions_all():
+    for position in get_positions(goal):
         res.append((position['ticker_id'], position['quantity'] * position['price']))
         total += position.value
     return {tid: val/total for tid, val in res}
@@ -71,8 +117,8 @@ def get_held_weights(goal):
     :param goal:
     :return: dict from symbol to current weight in that goal.
     """
-    avail = goal.available_balance
-    return {pos['ticker_id']: (pos['quantity'] * pos['price'])/avail for pos in goal.get_positions_all()}
+    avail = get_available_balance(goal)
+    return {pos['ticker_id']: (pos['quantity'] * pos['price'])/avail for pos in get_positions(goal)}
 
 
 def metrics_changed(goal):
@@ -99,7 +145,7 @@ def build_positions(goal, weights, instruments):
     res = {}
     idloc = instruments.columns.get_loc('id')
     ploc = instruments.columns.get_loc('price')
-    avail = goal.available_balance
+    avail = get_available_balance(goal)
     for ix, weight in weights.items():
         if weight > MIN_PORTFOLIO_PCT:
             res[ix] = int(avail * weight / instruments.ix[ix, ploc])
@@ -123,38 +169,42 @@ def create_request(goal, new_positions, reason, execution_provider, data_provide
 
     order = execution_provider.create_market_order(account=goal.account)
     requests = []
+    for tid, volume in get_position_changes(get_positions(goal), new_positions):
+        ticker = data_provider.get_ticker(tid=tid)
+        request = execution_provider.create_execution_request(reason=reason,
+                                                              goal=goal,
+                                                              asset=ticker,
+                                                              volume=volume,
+                                                              order=order,
+                                                              limit_price=None)
+        requests.append(request)
+
+    return order, requests
+
+
+def get_position_changes(positions, new_positions):
+    """
+    :param positions: The current positions, as goal.get_positions_all() returns them.
+    :param new_positions: A dict from asset id to the new position
+    :return: A list of (asset id, volume) for each change needed. The volume is negative for a sell.
+    """
+    changes = []
     new_positions = copy.copy(new_positions)
 
     # Change any existing positions
-    positions = goal.get_positions_all()
     for position in positions:
-
         new_pos = new_positions.pop(position['ticker_id'], 0)
         if new_pos - position['quantity'] == 0:
             continue
-        ticker = data_provider.get_ticker(tid=position['ticker_id'])
-        request = execution_provider.create_execution_request(reason=reason,
-                                                              goal=goal,
-                                                              asset=ticker,
-                                                              volume=new_pos - position['quantity'],
-                                                              order=order,
-                                                              limit_price=None)
-        requests.append(request)
+        changes.append((position['ticker_id'], new_pos - position['quantity']))
 
     # Any remaining new positions.
     for tid, pos in new_positions.items():
         if pos == 0:
             continue
-        ticker = data_provider.get_ticker(tid=tid)
-        request = execution_provider.create_execution_request(reason=reason,
-                                                              goal=goal,
-                                                              asset=ticker,
-                                                              volume=pos,
-                                                              order=order,
-                                                              limit_price=None)
-        requests.append(request)
+        changes.append((tid, pos))
 
-    return order, requests
+    return changes
 
 
 def get_mix_drift(weights, constraints):
@@ -214,13 +264,18 @@ def perturbate_withdrawal(goal):
     # start getting rid of lots in - by 1 share and always check if we are already in 100% weight
     position_lots = get_tax_lots(goal)
     desired_lots = position_lots[:]
-    weights = get_weights(desired_lots, goal.available_balance)
+    available_balance = get_available_balance(goal)
+    weights = get_weights(desired_lots, available_balance)
 
     for lot in desired_lots:
-        while lot['quantity'] > 0 and sum(weights.values()) > MAX_WEIGHT_SUM:
-            lot['quantity'] -= 1
-            lot['quantity'] = max(lot['quantity'], 0)
-            weights = get_weights(desired_lots, goal.available_balance)
+        total = sum(weights.values())
+        if total > MAX_WEIGHT_SUM:
+            qty = lot['quantity']
+            unit_weight = lot['price'] / available_balance
+            rest = total - qty * unit_weight
+            units = _units_to_sell(qty, lambda u: rest + max(qty - u, 0) * unit_weight - MAX_WEIGHT_SUM)
+            lot['quantity'] = max(qty - units, 0)
+            weights = get_weights(desired_lots, available_balance)
         if sum(weights.values()) <= MAX_WEIGHT_SUM:
             return weights
 
@@ -231,9 +286,14 @@ def get_tax_lots(goal):
     :param goal
     :return:
     '''
+    data = _prefetched(goal)
+    if data is not None:
+        # Callers change the quantities, so give them their own copies.
+        return [{key: val for key, val in lot.items() if key != 'state'} for lot in data.lots]
+
     year_ago = timezone.now() - timedelta(days=366)
     position_lots = PositionLot.objects\
-                    .filter(execution_distribution__transaction__from_goal=goal)\
+                    .filter_by_goals([goal.id])\
                     .filter(quantity__gt=0)\
                     .annotate(price_entry=F('execution_distribution__execution__price'),
                               executed=F('execution_distribution__execution__executed'),
@@ -311,13 +371,13 @@ def perturbate_mix(goal, opt_inputs):
             _sell_due_to_drift(desired_lots, l['ticker_id'], goal, metric_tickers[metric.id], metric)
 
         try:
-            weights = optimise_up(opt_inputs, get_weights(desired_lots, goal.available_balance))
+            weights = optimise_up(opt_inputs, get_weights(desired_lots, get_available_balance(goal)))
         except:
             pass
         if weights is not None:
             return weights
 
-    return weights, get_weights(desired_lots, goal.available_balance)
+    return weights, get_weights(desired_lots, get_available_balance(goal))
 
 
 def get_weights(lots, available_balance):
@@ -344,7 +404,7 @@ def _get_measured_val(position_lots, metric_tickers, goal):
     amount_shares = float(np.sum(
         [pos['price'] * pos['quantity'] if pos['ticker_id'] in metric_tickers else 0 for pos in position_lots]
     ))
-    return amount_shares / goal.available_balance
+    return amount_shares / get_available_balance(goal)
 
 
 def _get_drift(measured_val, goal_metric):
@@ -364,9 +424,35 @@ def _get_drift(measured_val, goal_metric):
         return ((measured_val - configured_val) / goal_metric.configured_val) / goal_metric.rebalance_thr
 
 
+def _units_to_sell(quantity, excess):
+    """
+    Find the fewest whole units to sell from a lot to bring an excess down to zero or below, by bisection.
+    Selling more units than the lot holds leaves it empty.
+    :param quantity: The quantity held in the lot.
+    :param excess: Function from the number of units sold to the remaining excess. Must not increase with the units.
+    :return: The number of units to sell. If even selling the whole lot leaves an excess, the units to empty it.
+    """
+    hi = int(math.ceil(quantity)) if quantity > 0 else 0
+    if hi == 0 or excess(0) <= 0:
+        return 0
+    if excess(hi) > 0:
+        return hi
+    # excess(lo) > 0 and excess(hi) <= 0
+    lo = 0
+    while hi - lo > 1:
+        mid = (lo + hi) // 2
+        if excess(mid) > 0:
+            lo = mid
+        else:
+            hi = mid
+    return hi
+
+
 def _sell_due_to_drift(position_lots, asset_id, goal, metric_tickers, metric):
     """
     Changes positions lots to bring drift <= 0 for the given metric
+    The measured value falls linearly with each unit sold, so the units to sell from each lot are found by bisection on
+    the drift rather than selling a unit at a time.
     :param position_lots: list of tuples, where each tuple contains info for position lot ('id', 'price', 'quantity', 'executed', 'unit_tax_cost')
     :param asset_ids: list of asset ids which belong to given metric
     :param goal: Goal
@@ -381,16 +467,20 @@ def _sell_due_to_drift(position_lots, asset_id, goal, metric_tickers, metric):
     if drift <= 0:
         return
 
+    available_balance = get_available_balance(goal)
     for lot in position_lots:
         if not lot['ticker_id'] == asset_id:
             continue
 
-        while drift > 0 and lot['quantity'] > 0:
-            lot['quantity'] -= 1
-            lot['quantity'] = max(lot['quantity'], 0)
-
-            measured_val = _get_measured_val(position_lots, metric_tickers, goal)
-            drift = _get_drift(measured_val, metric)
+        # The value of the metric's holdings apart from this lot, and this lot's value per unit.
+        qty = lot['quantity']
+        unit_val = lot['price'] if lot['ticker_id'] in metric_tickers else 0.0
+        rest = float(np.sum([pos['price'] * pos['quantity'] for pos in position_lots
+                             if pos['ticker_id'] in metric_tickers and pos is not lot]))
+        units = _units_to_sell(qty, lambda u: _get_drift((rest + max(qty - u, 0) * unit_val) / available_balance,
+                                                         metric))
+        lot['quantity'] = max(qty - units, 0)
+        drift = _get_drift((rest + lot['quantity'] * unit_val) / available_balance, metric)
 
         if drift <= 0:
             break
@@ -417,14 +507,14 @@ def perturbate(goal, idata, data_provider, execution_provider):
     # Optimise the portfolio adding appropriate constraints so there can be no removals from assets.
     # This will use any available cash to rebalance if possible.
     held_weights = get_held_weights(goal)
-    tax_min_weights = execution_provider.get_asset_weights_held_less_than1y(goal, data_provider.get_current_date())
+    tax_min_weights = get_asset_weights_held_less_than1y(goal, data_provider.get_current_date(), execution_provider)
     min_weights = get_largest_min_weight_per_asset(held_weights=held_weights, tax_weights=tax_min_weights)
     opt_inputs = calc_opt_inputs(goal.active_settings, idata, data_provider, execution_provider)
     weights = optimise_up(opt_inputs, min_weights)
 
     if weights is None:
         # relax constraints and allow to sell tax winners
-        tax_min_weights = execution_provider.get_asset_weights_without_tax_winners(goal=goal)
+        tax_min_weights = get_asset_weights_without_tax_winners(goal, execution_provider)
         min_weights = get_largest_min_weight_per_asset(held_weights=held_weights, tax_weights=tax_min_weights)
         weights = optimise_up(opt_inputs, min_weights)
 
@@ -453,19 +543,48 @@ def perturbate(goal, idata, data_provider, execution_provider):
     return weights, reason
 
 
-def rebalance(goal, idata, data_provider, execution_provider):
+def get_asset_weights_held_less_than1y(goal, today, execution_provider):
     """
-    Rebalance Strategy:
+    The weights of the goal's active assets bought within the last year. Uses the prefetched lots if the goal has them.
+    """
+    data = _prefetched(goal)
+    if data is None:
+        return execution_provider.get_asset_weights_held_less_than1y(goal, today)
+    m1y = datetime.combine(today - timedelta(days=366), datetime.min.time())
+    weights = defaultdict(float)
+    for lot in data.lots:
+        executed = lot['executed']
+        cutoff = timezone.make_aware(m1y) if timezone.is_aware(executed) else m1y
+        if lot['state'] == Ticker.State.ACTIVE.value and executed > cutoff:
+            weights[lot['ticker_id']] += lot['quantity'] * lot['price'] / data.available_balance
+    return dict(weights)
+
+
+def get_asset_weights_without_tax_winners(goal, execution_provider):
+    """
+    The weights of the goal's active lots that have no tax gain. Uses the prefetched lots if the goal has them.
+    """
+    data = _prefetched(goal)
+    if data is None:
+        return execution_provider.get_asset_weights_without_tax_winners(goal=goal)
+    lots = [lot for lot in data.lots
+            if lot['state'] == Ticker.State.ACTIVE.value and lot['price'] - lot['price_entry'] < 0]
+    return get_weights(lots, data.available_balance)
+
+
+def get_rebalance_weights(goal, idata, data_provider, execution_provider):
+    """
+    Work out the weights to rebalance the goal to.
     :param goal: The goal to rebalance
     :param idata: The current instrument data
-    :return:
+    :return: (weights, reason)
     """
     # If our important metrics were changed, all attempts to perturbate the old holdings is avoided, and we simply
     # apply the new desired weights.
     optimal_weights = get_setting_weights(goal.approved_settings)
     if metrics_changed(goal):
         weights = optimal_weights
-        reason = execution_provider.get_execution_request(ExecutionProviderAbstract.Reason.METRIC_CHANGE.value)
+        reason = execution_provider.get_execution_request(Reason.METRIC_CHANGE.value)
     else:
         # The important metrics weren't changed, so try and perturbate.
         weights, reason = perturbate(goal, idata, data_provider=data_provider, execution_provider=execution_provider)
@@ -487,6 +606,17 @@ def rebalance(goal, idata, data_provider, execution_provider):
 
         #A goal is a portfolio? If the rebalance is being made by goal it could be inneficient from a cost perspective
 
+    return weights, reason
+
+
+def rebalance(goal, idata, data_provider, execution_provider):
+    """
+    Rebalance Strategy:
+    :param goal: The goal to rebalance
+    :param idata: The current instrument data
+    :return:
+    """
+    weights, reason = get_rebalance_weights(goal, idata, data_provider, execution_provider)
     _, instruments, _ = idata
     new_positions = build_positions(goal, weights, instruments)
     #idata[2] is a matrix containing latest instrument price
@@ -511,3 +641,226 @@ def archive_goal(goal):
     # TODO: Once we've received response from the market that the goal has no more positions,
     # TODO: complete the goal's archive process.
     # TODO: goal.complete_archive()
+
+
+def prefetch_rebalance_data(goals):
+    """
+    Load the positions, tax lots and available balance of many goals with a few queries, and attach them to the goals
+    so the rebalance functions don't query them goal by goal.
+    :param goals: List of Goal objects.
+    :return: A TaxLotIndex of the goals' open lots. The goals are also changed in place.
+    """
+    from main.tax_lots import TaxLotIndex
+
+    year_ago = timezone.now() - timedelta(days=366)
+    by_id = {goal.id: goal for goal in goals}
+    lots = defaultdict(list)
+    index_lots = []
+    outgoings = defaultdict(float)
+    ids = list(by_id.keys())
+    for start in range(0, len(ids), REBALANCE_PREFETCH_CHUNK_SIZE):
+        chunk = ids[start:start + REBALANCE_PREFETCH_CHUNK_SIZE]
+        rows = PositionLot.objects\
+            .filter_by_goals(chunk)\
+            .filter(quantity__gt=0)\
+            .annotate(price_entry=F('execution_distribution__execution__price'),
+                      executed=F('execution_distribution__execution__executed'),
+                      ticker_id=F('execution_distribution__execution__asset_id'),
+                      price=F('execution_distribution__execution__asset__unit_price'),
+                      state=F('execution_distribution__execution__asset__state'))\
+            .values('id', 'goal_id', 'price_entry', 'quantity', 'executed', 'ticker_id', 'price', 'state')
+        for lot in rows:
+            bracket = TAX_BRACKET_LESS1Y if lot['executed'] > year_ago else TAX_BRACKET_MORE1Y
+            lot['unit_tax_cost'] = (lot['price'] - lot['price_entry']) * bracket
+            # The index keys its lots by goal_id, which the goals' own lots drop.
+            index_lots.append(dict(lot))
+            lots[lot.pop('goal_id')].append(lot)
+
+        pending = Transaction.objects.filter(from_goal__in=chunk, status=Transaction.STATUS_PENDING)\
+            .values('from_goal').annotate(total=Sum('amount'))
+        for row in pending:
+            outgoings[row['from_goal']] = row['total']
+
+    for gid, goal in by_id.items():
+        goal_lots = sorted(lots[gid], key=lambda l: l['unit_tax_cost'])
+        positions = defaultdict(float)
+        prices = {}
+        for lot in goal_lots:
+            if lot['state'] == Ticker.State.ACTIVE.value:
+                positions[lot['ticker_id']] += lot['quantity']
+                prices[lot['ticker_id']] = lot['price']
+        positions = [{'ticker_id': tid, 'price': prices[tid], 'quantity': qty} for tid, qty in sorted(positions.items())]
+        total = goal.cash_balance + sum(pos['price'] * pos['quantity'] for pos in positions)
+        goal._rebalance_data = GoalRebalanceData(positions=positions,
+                                                 available_balance=total - outgoings[gid],
+                                                 lots=goal_lots)
+    return TaxLotIndex(index_lots, goal_ids=by_id)
+
+
+def _rebalance_goal(goal, idata, data_provider, execution_provider):
+    """
+    :return: (goal id, new positions, reason, error) for one goal. error is the exception if the goal couldn't be
+             rebalanced, otherwise None.
+    """
+    try:
+        weights, reason = get_rebalance_weights(goal, idata, data_provider, execution_provider)
+        _, instruments, _ = idata
+        return goal.id, build_positions(goal, weights, instruments), reason, None
+    except Exception as e:
+        logger.exception("Could not rebalance goal: {}".format(goal))
+        return goal.id, None, None, e
+
+
+def _init_rebalance_worker(idata, data_provider, execution_provider):
+    global _worker_state
+    # Database connections inherited from the parent process can't be used in the child.
+    for conn in db.connections.all():
+        conn.close()
+    _worker_state = idata, data_provider, execution_provider
+
+
+def _rebalance_goal_worker(goal):
+    idata, data_provider, execution_provider = _worker_state
+    return _rebalance_goal(goal, idata, data_provider, execution_provider)
+
+
+def write_rebalance_orders(goals, results, chunk_size=REBALANCE_WRITE_CHUNK_SIZE):
+    """
+    Write the market orders and execution requests for rebalanced goals. There is one order per account, holding the
+    requests for all its goals in the chunk. Each chunk of goals is written in its own transaction, with the execution
+    requests created in bulk.
+    :param goals: The rebalanced goals, with their prefetched rebalance data.
+    :param results: A dict from goal id to (new positions, reason)
+    :param chunk_size: The number of goals written per transaction.
+    :return: The list of MarketOrderRequests created.
+    """
+    orders = []
+    goals = [goal for goal in goals if goal.id in results]
+    for start in range(0, len(goals), chunk_size):
+        with transaction.atomic():
+            account_orders = {}
+            requests = []
+            for goal in goals[start:start + chunk_size]:
+                new_positions, reason = results[goal.id]
+                for tid, volume in get_position_changes(get_positions(goal), new_positions):
+                    order = account_orders.get(goal.account_id)
+                    if order is None:
+                        # bulk_create doesn't give us the ids back, and the requests need them, so save orders singly.
+                        order = MarketOrderRequest(account=goal.account)
+                        order.save()
+                        account_orders[goal.account_id] = order
+                    requests.append(ExecutionRequest(reason=reason,
+                                                     goal=goal,
+                                                     asset_id=tid,
+                                                     volume=volume,
+                                                     order=order))
+            ExecutionRequest.objects.bulk_create(requests)
+            orders.extend(account_orders.values())
+    return orders
+
+
+def rebalance_goals(goals, idata, data_provider, execution_provider, workers=1,
+                    chunk_size=REBALANCE_WRITE_CHUNK_SIZE):
+    """
+    Rebalance many goals at once, in three stages:
+     - prefetch: load the holdings of all the goals in bulk.
+     - optimise: work out the new positions for each goal, in a pool of worker processes if workers > 1.
+     - write: create the orders and execution requests in chunked transactions.
+    :param goals: Iterable of Goal objects. Select their settings and account related to save queries.
+    :param idata: The current instrument data
+    :param data_provider: Must be picklable, and usable from a worker process if workers > 1.
+    :param execution_provider: Must be picklable, and usable from a worker process if workers > 1. If it takes a
+                               shared TaxLotIndex, it's given one holding the lots of all the goals until the
+                               rebalance is done.
+    :param workers: The number of worker processes to optimise with.
+    :param chunk_size: The number of goals whose orders are written in each transaction.
+    :return: (orders, errors, timings)
+             - orders is the list of MarketOrderRequests created.
+             - errors is a dict from goal id to the exception raised rebalancing it.
+             - timings is a dict from stage name to the seconds it took.
+    """
+    timings = {}
+    start = time.time()
+    goals = list(goals)
+    tax_lots = prefetch_rebalance_data(goals)
+    timings['prefetch'] = time.time() - start
+
+    # Have the provider read the lots loaded for the whole batch, rather than loading each goal's lots itself.
+    shares_lots = hasattr(execution_provider, 'tax_lots')
+    if shares_lots:
+        previous_tax_lots = execution_provider.tax_lots
+        execution_provider.tax_lots = tax_lots
+    try:
+        start = time.time()
+        if workers > 1:
+            # Don't let the forked workers inherit our open database connections.
+            for conn in db.connections.all():
+                conn.close()
+            pool = Pool(processes=workers,
+                        initializer=_init_rebalance_worker,
+                        initargs=(idata, data_provider, execution_provider))
+            try:
+                outcomes = pool.map(_rebalance_goal_worker, goals)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            outcomes = [_rebalance_goal(goal, idata, data_provider, execution_provider) for goal in goals]
+        results = {}
+        errors = {}
+        for gid, new_positions, reason, error in outcomes:
+            if error is None:
+                results[gid] = new_positions, reason
+            else:
+                errors[gid] = error
+        timings['optimise'] = time.time() - start
+
+        start = time.time()
+        orders = write_rebalance_orders(goals, results, chunk_size=chunk_size)
+        timings['write'] = time.time() - start
+    finally:
+        # The lots change once the orders are executed, so the provider mustn't keep answering from this batch's index.
+        if shares_lots:
+            execution_provider.tax_lots = previous_tax_lots
+
+    logger.info("Rebalanced {} goals ({} failed) into {} orders. Stage timings: {}".format(
+        len(results), len(errors), len(orders),
+        ', '.join('{}: {:.2f}s'.format(stage, timings[stage]) for stage in ('prefetch', 'optimise', 'write'))))
+    return orders, errors, timings
+
+
+class Command(BaseCommand):
+    help = 'Rebalance all the active goals in the system that have automated rebalancing turned on.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers',
+                            type=int,
+                            default=1,
+                            help='Number of worker processes to optimise the goals with.')
+        parser.add_argument('--chunk-size',
+                            type=int,
+                            default=REBALANCE_WRITE_CHUNK_SIZE,
+                            help='Number of goals to write orders for in each database transaction.')
+
+    def handle(self, *args, **options):
+        from portfolios.providers.data.django import DataProviderDjango
+        from portfolios.providers.execution.django import ExecutionProviderDjango
+        data_provider = DataProviderDjango()
+        execution_provider = ExecutionProviderDjango()
+        goals = Goal.objects\
+            .filter(state=Goal.State.ACTIVE.value, active_settings__rebalance=True, account__confirmed=True,
+                    active_settings__isnull=False, approved_settings__isnull=False)\
+            .select_related('account', 'portfolio_set',
+                            'active_settings__metric_group', 'approved_settings__metric_group',
+                            'approved_settings__portfolio')\
+            .prefetch_related('active_settings__metric_group__metrics__feature',
+                              'approved_settings__metric_group__metrics__feature',
+                              'approved_settings__portfolio__items')
+        orders, errors, timings = rebalance_goals(goals,
+                                                  idata=get_instruments(data_provider),
+                                                  data_provider=data_provider,
+                                                  execution_provider=execution_provider,
+                                                  workers=options['workers'],
+                                                  chunk_size=options['chunk_size'])
+        for gid, e in errors.items():
+            logger.warn("Goal {} was not rebalanced: {}".format(gid, e))
@@ -1,14 +1,18 @@
 import logging
 
 from dateutil.relativedelta import relativedelta
-from django.db.models import F, QuerySet, Sum
+from django.db.models import Case, F, FloatField, IntegerField, QuerySet, Sum, Value, When
 from django.db.models.functions import Coalesce
 from django.db.models.loading import get_model
 from django.db.models.query_utils import Q
 from django.utils.timezone import now
 
+from main.finance import goal_financials
+
 logger = logging.getLogger('main.managers')
 
+EMPTY_BALANCE = {'total': 0.0, 'cash': 0.0, 'stocks': 0.0, 'bonds': 0.0, 'core': 0.0, 'satellite': 0.0}
+
 
 class AccountTypeQuerySet(QuerySet):
     def filter_by_user(self, user):
@@ -71,6 +75,65 @@ class RetirementPlanQuerySet(QuerySet):
 
 
 class GoalQuerySet(QuerySet):
+    def __init__(self, *args, **kwargs):
+        super(GoalQuerySet, self).__init__(*args, **kwargs)
+        self._with_financials = False
+
+    def _clone(self, *args, **kwargs):
+        clone = super(GoalQuerySet, self)._clone(*args, **kwargs)
+        clone._with_financials = self._with_financials
+        return clone
+
+    def _fetch_all(self):
+        fetched = self._result_cache is None
+        super(GoalQuerySet, self)._fetch_all()
+        if fetched and self._with_financials:
+            goals = [goal for goal in self._result_cache if hasattr(goal, 'pk')]
+            summaries = goal_financials(goal.pk for goal in goals)
+            for goal in goals:
+                goal._financials = summaries[goal.pk]
+
+    def with_financials(self):
+        """
+        Load the transaction based financial figures (Goal.financials) of all the goals with one grouped conditional
+        aggregate when the queryset is evaluated, rather than several queries per goal as each figure is read.
+        The sums aren't annotated onto the goal query itself, as joining both a goal's incoming and outgoing
+        transactions there would multiply its rows by the number of each.
+        """
+        clone = self._clone()
+        clone._with_financials = True
+        return clone
+
+    def balances(self, group_by='id'):
+        """
+        The current balances of the goals, cash plus their holdings at current unit prices, in two grouped queries.
+        :param group_by: The goal field lookup to total on. Eg. 'id' for each goal or 'account__primary_owner__advisor'
+        :return: {group_by value: {'total': , 'cash': , 'stocks': , 'bonds': , 'core': , 'satellite': }}
+        """
+        GoalHolding = get_model('main', 'GoalHolding')
+        # The goals are selected by id so any joins in this queryset don't count a goal more than once.
+        goals = self.model.objects.filter(id__in=self.values('id'))
+        balances = {}
+        for row in goals.order_by().values(group_by).annotate(cash=Sum('cash_balance')):
+            balances[row[group_by]] = dict(EMPTY_BALANCE, total=row['cash'] or 0.0, cash=row['cash'] or 0.0)
+        holding_group = 'goal' if group_by == 'id' else 'goal__' + group_by
+        holdings = GoalHolding.objects.filter(goal__in=self.values('id')).valuations(holding_group)
+        for key, values in holdings.items():
+            balance = balances.setdefault(key, dict(EMPTY_BALANCE))
+            for name, value in values.items():
+                balance[name] += value or 0.0
+        return balances
+
+    def balance(self):
+        """
+        :return: The balances of all the goals in the queryset together, as for balances()
+        """
+        total = dict(EMPTY_BALANCE)
+        for values in self.balances().values():
+            for name, value in values.items():
+                total[name] += value
+        return total
+
     def filter_by_firm(self, firm):
         """
         For now we only allow firms of the goal's account's primary owner's advisor
@@ -197,7 +260,57 @@ class GoalQuerySet(QuerySet):
         return qs
 
 
+class GoalHoldingQuerySet(QuerySet):
+    def filter_by_firm(self, firm):
+        return self.filter(goal__account__primary_owner__advisor__firm=firm)
+
+    def filter_by_advisor(self, advisor):
+        return self.filter(goal__account__primary_owner__advisor=advisor)
+
+    def filter_by_client(self, client):
+        return self.filter(goal__account__primary_owner=client)
+
+    def valuations(self, group_by='goal'):
+        """
+        Value the holdings against the current unit price of their active tickers in one grouped query.
+        :param group_by: The lookup from the holding to total on. Eg. 'goal' or 'goal__account__primary_owner__advisor'
+        :return: {group_by value: {'total': , 'stocks': , 'bonds': , 'core': , 'satellite': }}
+        """
+        InvestmentType = get_model('main', 'InvestmentType')
+        Ticker = get_model('main', 'Ticker')
+
+        value = F('quantity') * F('ticker__unit_price')
+
+        def value_where(**conditions):
+            return Sum(Case(When(then=value, **conditions), default=Value(0.0), output_field=FloatField()))
+
+        rows = (self.filter(ticker__state=Ticker.State.ACTIVE.value)
+                .order_by()
+                .values(group_by)
+                .annotate(total=Sum(value, output_field=FloatField()),
+                          stocks=value_where(ticker__asset_class__investment_type=InvestmentType.Standard.STOCKS.get()),
+                          bonds=value_where(ticker__asset_class__investment_type=InvestmentType.Standard.BONDS.get()),
+                          core=value_where(ticker__etf=True),
+                          satellite=value_where(ticker__etf=False)))
+        return {row.pop(group_by): row for row in rows}
+
+
 class PositionLotQuerySet(QuerySet):
+    def with_goal(self):
+        """
+        Annotate each lot with the goal_id of the goal it belongs to. Lots bought through the fills processing record
+        the goal on the transaction's to_goal, others on the from_goal.
+        """
+        return self.annotate(goal_id=Coalesce('execution_distribution__transaction__from_goal',
+                                              'execution_distribution__transaction__to_goal',
+                                              output_field=IntegerField()))
+
+    def filter_by_goals(self, goal_ids):
+        """
+        :return: The lots of the given goals, annotated with their goal_id as for with_goal().
+        """
+        return self.with_goal().filter(goal_id__in=list(goal_ids))
+
     def filter_by_firm(self, firm):
         return self.filter(Q(execution_distribution__transaction__from_goal__account__primary_owner__advisor__firm=firm) |
                            Q(execution_distribution__transaction__to_goal__account__primary_owner__advisor__firm=firm))
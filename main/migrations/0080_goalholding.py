@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import F, Sum
+from django.db.models.functions import Coalesce
+import django.db.models.deletion
+
+
+def populate_holdings(apps, schema_editor):
+    PositionLot = apps.get_model("main", "PositionLot")
+    GoalHolding = apps.get_model("main", "GoalHolding")
+    db_alias = schema_editor.connection.alias
+
+    rows = (PositionLot.objects.using(db_alias).order_by()
+            .annotate(goal_id=Coalesce('execution_distribution__transaction__from_goal',
+                                       'execution_distribution__transaction__to_goal',
+                                       output_field=models.IntegerField()),
+                      ticker_id=F('execution_distribution__execution__asset'))
+            .filter(goal_id__isnull=False)
+            .values('goal_id', 'ticker_id')
+            .annotate(quantity=Sum('quantity')))
+    GoalHolding.objects.using(db_alias).bulk_create(
+        GoalHolding(goal_id=row['goal_id'], ticker_id=row['ticker_id'], quantity=row['quantity']) for row in rows
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0079_auto_20161203_0331'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GoalHolding',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('quantity', models.FloatField(default=0.0)),
+                ('goal', models.ForeignKey(related_name='holdings', to='main.Goal',
+                                           on_delete=django.db.models.deletion.CASCADE)),
+                ('ticker', models.ForeignKey(related_name='holdings', to='main.Ticker',
+                                             on_delete=django.db.models.deletion.PROTECT)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='goalholding',
+            unique_together=set([('goal', 'ticker')]),
+        ),
+        migrations.RunPython(populate_holdings, migrations.RunPython.noop),
+    ]
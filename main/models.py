@@ -1,6 +1,6 @@
 import logging
 import uuid
-from datetime import datetime, date, timedelta
+from datetime import datetime
 from enum import Enum, unique
 
 import numpy as np
@@ -18,9 +18,8 @@ from django.core.validators import (MaxValueValidator, MinLengthValidator,
 from django.db import models, transaction
 from django.db.models import F, Sum
 from django.db.models.deletion import CASCADE, PROTECT, SET_NULL
-from django.db.models.functions import Coalesce
 from django.db.models.query_utils import Q
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 from django.template.loader import render_to_string
 from django.utils.functional import cached_property
@@ -34,10 +33,13 @@ from pinax.eventlog import models as el_models
 from address.models import Address
 from common.constants import GROUP_SUPPORT_STAFF
 from common.structures import ChoiceEnum
-from common.utils import months_between
 from main import redis
 from main.constants import ACCOUNT_TYPES_COUNTRY, ACCOUNT_UNKNOWN
-from main.finance import mod_dietz_rate
+from main.analytics import advisor_goals, get_advisor_analytics, get_firm_analytics, invalidate_firm_analytics
+from main.finance import cached_mod_dietz_rates, goal_financials, mod_dietz_rate
+from main.inflation import get_index as get_inflation_index, invalidate_index as invalidate_inflation_index
+from main.positions import goal_positions
+from main.projection import ON_TRACK_PROBABILITY, goal_cash_flows, goal_projection
 from main.managers import AccountTypeQuerySet
 from main.risk_profiler import validate_risk_score
 from portfolios.returns import get_price_returns
@@ -45,7 +47,7 @@ from . import constants
 from .abstract import FinancialInstrument, NeedApprobation, \
     NeedConfirmation, PersonalData, TransferPlan
 from .fields import ColorField
-from .managers import ExternalAssetQuerySet, GoalQuerySet, PositionLotQuerySet
+from .managers import ExternalAssetQuerySet, GoalHoldingQuerySet, GoalQuerySet, PositionLotQuerySet
 from .slug import unique_slugify
 import numpy as np
 from pinax.eventlog.models import log
@@ -468,10 +470,7 @@ class Firm(models.Model):
         YTD - from the start of the current fiscal year until now.
         """
         # filter transactions by the firm's current fiscal year
-        total_fees_ytd = 0
-        for advisor in self.advisors.all():
-            total_fees_ytd += advisor.fees_ytd
-        return total_fees_ytd
+        return get_firm_analytics(self)['fees_ytd']
 
     @property
     def total_fees(self):
@@ -480,10 +479,7 @@ class Firm(models.Model):
             Transaction - REASON_FEE
         Within the firm's set fiscal years.
         """
-        total = 0
-        for advisor in self.advisors.all():
-            total += advisor.total_fees
-        return total
+        return get_firm_analytics(self)['total_fees']
 
     @property
     def total_revenue(self):
@@ -507,10 +503,24 @@ class Firm(models.Model):
 
     @property
     def total_balance(self):
-        total = 0
-        for advisor in self.advisors.all():
-            total += advisor.total_balance
-        return total
+        return get_firm_analytics(self)['total_balance']
+
+    def advisor_balances(self):
+        """
+        The assets under management of each of the firm's advisors, as for Advisor.total_balance, in a few grouped
+        queries for the whole firm.
+        :return: {advisor_id: total balance} for the advisors with any client accounts.
+        """
+        from client.models import ClientAccount
+
+        accounts = ClientAccount.objects.filter(primary_owner__advisor__firm=self)
+        goals = Goal.objects.filter(account__in=accounts).exclude(state=Goal.State.ARCHIVED.value)
+        advisor = 'account__primary_owner__advisor'
+        balances = {key: values['total'] for key, values in goals.balances(advisor).items()}
+        for row in accounts.order_by().values('primary_owner__advisor').annotate(cash=Sum('cash_balance')):
+            key = row['primary_owner__advisor']
+            balances[key] = balances.get(key, 0.0) + (row['cash'] or 0.0)
+        return balances
 
     def get_clients(self):
         clients = []
@@ -520,7 +530,7 @@ class Firm(models.Model):
 
     @property
     def total_clients(self):
-        return len(self.get_clients())
+        return get_firm_analytics(self)['clients']
 
     @property
     def average_client_balance(self):
@@ -528,10 +538,7 @@ class Firm(models.Model):
 
     @property
     def total_account_groups(self):
-        total = 0
-        for advisor in self.advisors.all():
-            total += advisor.total_account_groups
-        return total
+        return get_firm_analytics(self)['households']
 
     @property
     def average_group_balance(self):
@@ -681,8 +688,9 @@ class Advisor(NeedApprobation, NeedConfirmation, PersonalData):
         from client.models import ClientAccount
 
         accounts = ClientAccount.objects.filter(primary_owner__advisor=self)
-
-        return sum(acc.total_balance for acc in accounts)
+        goals = Goal.objects.filter(account__in=accounts).exclude(state=Goal.State.ARCHIVED.value)
+        cash = accounts.aggregate(cash=Sum('cash_balance'))['cash'] or 0.0
+        return cash + goals.balance()['total']
 
     @property
     def primary_clients_size(self):
@@ -696,48 +704,21 @@ class Advisor(NeedApprobation, NeedConfirmation, PersonalData):
     @property
     def fees_ytd(self):
         """
+        The fees on the advisor's clients' goals from the start of the firm's current fiscal year until now.
         """
-        # get client accounts
-        # check transactions for client accounts from current fiscal year
-        # firm has fiscal years set, find current
-        from client.models import ClientAccount
-
-        fiscal_year = self.firm.get_current_fiscal_year()
-        total_fees = 0.0
-        if fiscal_year:
-            for ca in ClientAccount.objects.filter(primary_owner__advisor=self):
-                for goal in ca.goals:
-                    txs = Transaction.objects.filter(Q(to_goal=goal) | Q(from_goal=goal),
-                                                     status=Transaction.STATUS_EXECUTED,
-                                                     reason=Transaction.REASON_FEE,
-                                                     executed__gte=fiscal_year.begin_date,
-                                                     executed__lte=datetime.today())
-                    for tx in txs:
-                        total_fees += tx.amount
-        return total_fees
+        return get_advisor_analytics(self)['fees_ytd']
 
     @property
     def total_fees(self):
         """
+        The fees on the advisor's clients' goals within the firm's fiscal years.
         """
-        from client.models import ClientAccount
-        total_fees = 0.0
-        for ca in ClientAccount.objects.filter(primary_owner__advisor=self):
-            for year in self.firm.fiscal_years.all():
-                for goal in ca.goals:
-                    txs = Transaction.objects.filter(Q(to_goal=goal) | Q(from_goal=goal),
-                                                     status=Transaction.STATUS_EXECUTED,
-                                                     reason=Transaction.REASON_FEE,
-                                                     executed__gte=year.begin_date,
-                                                     executed__lte=year.end_date)
-                    for tx in txs:
-                        total_fees += tx.amount
-        return total_fees
+        return get_advisor_analytics(self)['total_fees']
 
     @property
     def average_return(self):
-        goals = Goal.objects.filter(account__in=self.client_accounts)
-        return mod_dietz_rate(goals)
+        goals = advisor_goals(self.firm, advisor=self).get(self.id, set())
+        return cached_mod_dietz_rates('advisor', {self.id: goals})[self.id]
 
     @property
     def total_account_groups(self):
@@ -811,12 +792,20 @@ class AccountGroup(models.Model):
 
     @property
     def total_balance(self):
-        return sum(a.total_balance for a in self.accounts.all())
+        cash = self.accounts.aggregate(cash=Sum('cash_balance'))['cash'] or 0.0
+        return cash + self.goals_balance()['total']
+
+    def goals_balance(self):
+        """
+        :return: The balance of all the group's active goals together, as for GoalQuerySet.balance()
+        """
+        goals = Goal.objects.filter(account__in=self.accounts).exclude(state=Goal.State.ARCHIVED.value)
+        return goals.balance()
 
     @property
     def average_return(self):
         goals = Goal.objects.filter(account__in=self.accounts.all())
-        return mod_dietz_rate(goals)
+        return cached_mod_dietz_rates('account_group', {self.id: goals})[self.id]
 
     @property
     def allocation(self):
@@ -824,19 +813,19 @@ class AccountGroup(models.Model):
 
     @property
     def stock_balance(self):
-        return sum(a.stock_balance for a in self.accounts.all())
+        return self.goals_balance()['stocks']
 
     @property
     def core_balance(self):
-        return sum(a.core_balance for a in self.accounts.all())
+        return self.goals_balance()['core']
 
     @property
     def satellite_balance(self):
-        return sum(a.satellite_balance for a in self.accounts.all())
+        return self.goals_balance()['satellite']
 
     @property
     def bond_balance(self):
-        return sum(a.bond_balance for a in self.accounts.all())
+        return self.goals_balance()['bonds']
 
     @property
     def stocks_percentage(self):
@@ -1003,7 +992,11 @@ class Ticker(FinancialInstrument):
         return "true" if self.ordering == 0 else "false"
 
     def shares(self, goal):
-        return self.value(goal) / self.unit_price
+        """
+        :return: The quantity of the ticker the goal holds.
+        """
+        position = self._position(goal)
+        return 0 if position is None else position['quantity']
 
     @property
     def is_stock(self):
@@ -1018,12 +1011,15 @@ class Ticker(FinancialInstrument):
         return not self.is_core
 
     def value(self, goal):
-        total_qty = PositionLot.objects.filter(execution_distribution__transaction__from_goal=goal).\
-            aggregate(Sum('quantity'))
-
-        v = total_qty * self.unit_price
+        """
+        :return: The current value of the ticker the goal holds.
+        """
+        position = self._position(goal)
+        return 0 if position is None else position['value']
 
-        return v
+    def _position(self, goal):
+        positions = goal_positions([goal.id], active_only=False).get(goal.id, [])
+        return next((position for position in positions if position['ticker_id'] == self.id), None)
 
     def get_returns(self, dates):
         """
@@ -1468,12 +1464,11 @@ class Goal(models.Model):
         return '[' + str(self.id) + '] ' + self.name + " : " + self.account.primary_owner.full_name
 
     def get_positions_all(self):
-        lots = PositionLot.objects.filter(quantity__gt=0, execution_distribution__transaction__from_goal=self,
-                                          execution_distribution__execution__asset__state=Ticker.State.ACTIVE.value).\
-            annotate(ticker_id=F('execution_distribution__execution__asset__id'),
-                     price=F('execution_distribution__execution__asset__unit_price'))\
-            .values('ticker_id', 'price').annotate(quantity=Sum('quantity'))
-        return lots
+        """
+        :return: [{'ticker_id': , 'price': , 'quantity': , 'value': }] of the goal's positions in active tickers, in
+                 ticker id order.
+        """
+        return goal_positions([self.id]).get(self.id, [])
 
     def save(self, force_insert=False, force_update=False, using=None,
              update_fields=None):
@@ -1568,56 +1563,43 @@ class Goal(models.Model):
     def pending_transactions(self):
         return Transaction.objects.filter((Q(to_goal=self) | Q(from_goal=self)) & Q(status=Transaction.STATUS_PENDING))
 
+    @property
+    def financials(self):
+        """
+        The transaction based financial figures of the goal, all worked out from one query.
+        Goals loaded from Goal.objects.with_financials() already have them, so they issue no queries at all.
+        :return: {figure: value} for pending_incomings, pending_outgoings, pending_amount, requested_incomings,
+                 requested_outgoings, total_dividends, total_deposits, total_withdrawals, net_invested,
+                 net_executions and total_fees.
+        """
+        financials = getattr(self, '_financials', None)
+        if financials is None:
+            financials = goal_financials([self.id])[self.id]
+        return financials
+
     @property
     def pending_amount(self):
-        pa = 0.0
-        for t in self.pending_transactions:
-            if self == t.from_goal:
-                pa -= t.amount
-            else:
-                pa += t.amount
-        return pa
+        return self.financials['pending_amount']
 
     @property
     def pending_incomings(self):
-        pd = 0.0
-        for d in Transaction.objects.filter(to_goal=self, status=Transaction.STATUS_PENDING):
-            pd += d.amount
-        return pd
+        return self.financials['pending_incomings']
 
     @property
     def pending_outgoings(self):
-        pw = 0.0
-        for w in Transaction.objects.filter(from_goal=self, status=Transaction.STATUS_PENDING):
-            pw += w.amount
-        return pw
+        return self.financials['pending_outgoings']
 
     @property
     def requested_incomings(self):
-        pd = 0.0
-        for d in Transaction.objects.filter(to_goal=self,
-                                            status=Transaction.STATUS_EXECUTED).exclude(reason__in=(Transaction.REASON_FEE,
-                                                                                                    Transaction.REASON_DIVIDEND)):
-            pd += d.amount
-        return pd
+        return self.financials['requested_incomings']
 
     @property
     def requested_outgoings(self):
-        pw = 0.0
-        for w in Transaction.objects.filter(from_goal=self,
-                                            status=Transaction.STATUS_EXECUTED).exclude(reason__in=(Transaction.REASON_FEE,
-                                                                                                    Transaction.REASON_DIVIDEND)):
-            pw -= w.amount
-        return pw
+        return self.financials['requested_outgoings']
 
     @property
     def total_dividends(self):
-        divs = 0.0
-        for t in Transaction.objects.filter(Q(status=Transaction.STATUS_EXECUTED) &
-                                            (Q(to_goal=self) | Q(from_goal=self)) &
-                                            (Q(reason=Transaction.REASON_DIVIDEND))):
-            divs += t.amount if self == t.to_goal else -t.amount
-        return divs
+        return self.financials['total_dividends']
 
     @property
     def market_changes(self):
@@ -1628,24 +1610,14 @@ class Goal(models.Model):
         """
         :return: The total amount of the deposits into the goal from the account cash. Excluding pending.
         """
-        inputs = 0.0
-        for t in Transaction.objects.filter(status=Transaction.STATUS_EXECUTED,
-                                            to_goal=self,
-                                            reason=Transaction.REASON_DEPOSIT):
-            inputs += t.amount
-        return inputs
+        return self.financials['total_deposits']
 
     @property
     def total_withdrawals(self):
         """
         :return: The total amount of the withdrawals from the goal to the account cash. Excluding pending.
         """
-        inputs = 0.0
-        for t in Transaction.objects.filter(status=Transaction.STATUS_EXECUTED,
-                                            to_goal=self,
-                                            reason=Transaction.REASON_WITHDRAWAL):
-            inputs += t.amount
-        return inputs
+        return self.financials['total_withdrawals']
 
     @property
     def net_invested(self):
@@ -1654,24 +1626,14 @@ class Goal(models.Model):
                  excluding any pending transactions or performance-based transactions.
 
         """
-        inputs = 0.0
-        for t in Transaction.objects.filter(Q(status=Transaction.STATUS_EXECUTED) &
-                                            (Q(to_goal=self) | Q(from_goal=self)) &
-                                            (Q(reason__in=Transaction.CASH_FLOW_REASONS))):
-            inputs += t.amount if self == t.to_goal else -t.amount
-        return inputs
+        return self.financials['net_invested']
 
     @property
     def net_executions(self):
         """
         :return: The net realised amount invested in funds(Sum Order type transactions)
         """
-        inputs = 0.0
-        for t in Transaction.objects.filter(Q(status=Transaction.STATUS_EXECUTED) &
-                                            (Q(to_goal=self) | Q(from_goal=self)) &
-                                            Q(reason=Transaction.REASON_EXECUTION)):
-            inputs += t.amount if self == t.to_goal else -t.amount
-        return inputs
+        return self.financials['net_executions']
 
     @property
     def life_time_return(self):
@@ -1687,12 +1649,7 @@ class Goal(models.Model):
 
     @property
     def total_fees(self):
-        fees = 0.0
-        for t in Transaction.objects.filter(Q(status=Transaction.STATUS_EXECUTED) &
-                                            (Q(to_goal=self) | Q(from_goal=self)) &
-                                            (Q(reason=Transaction.REASON_FEE))):
-            fees += t.amount if self == t.to_goal else -t.amount
-        return fees
+        return self.financials['total_fees']
 
     @property
     def recharacterized(self):
@@ -1708,19 +1665,21 @@ class Goal(models.Model):
 
     @property
     def investments(self):
+        fin = self.financials
         return {
-            'deposits': self.total_deposits,
-            'withdrawals': self.total_withdrawals,
-            'other': self.net_invested - self.total_deposits + self.total_withdrawals,
-            'net_pending': self.pending_amount,
+            'deposits': fin['total_deposits'],
+            'withdrawals': fin['total_withdrawals'],
+            'other': fin['net_invested'] - fin['total_deposits'] + fin['total_withdrawals'],
+            'net_pending': fin['pending_amount'],
         }
 
     @property
     def earnings(self):
+        fin = self.financials
         return {
-                'market_moves': self.total_earnings - self.total_dividends + self.total_fees,
-                'dividends': self.total_dividends,
-                'fees': self.total_fees,
+                'market_moves': self.total_balance - fin['net_invested'] - fin['total_dividends'] + fin['total_fees'],
+                'dividends': fin['total_dividends'],
+                'fees': fin['total_fees'],
                }
 
     @property
@@ -1770,25 +1729,15 @@ class Goal(models.Model):
             er = 1 + self.selected_settings.portfolio.er
             stdev = self.selected_settings.portfolio.stdev
 
-        # use naïve dates for calculations
-        current_time = now().replace(tzinfo=None)
         # Get the predicted cash-flow events until the provided future date
-        cf_events = [(current_time, self.total_balance)]
-        if hasattr(self.selected_settings, 'recurring_transactions'):
-            cf_events += RecurringTransaction.get_events(self.selected_settings.recurring_transactions,
-                                                         current_time,
-                                                         datetime.combine(future_dt, now().timetz()))
+        _, cf_events = goal_cash_flows(self, future_dt)
 
         # TODO: Add estimated fee events to this.
 
         # Calculate the predicted_balance based on cash flow events, er, stdev and z_mult
-        predicted = 0
-        for dt, val in cf_events:
-            tdelta = dt - current_time
-            y_delta = (tdelta.days + tdelta.seconds/86400.0)/365.25
-            predicted += val * (er ** y_delta + z_mult * stdev * (y_delta ** 0.5))
-
-        return predicted
+        y_delta = np.array([t for t, _ in cf_events])
+        values = np.array([val for _, val in cf_events], dtype=float)
+        return float(np.sum(values * (er ** y_delta + z_mult * stdev * np.sqrt(y_delta))))
 
     @cached_property
     def on_track(self):
@@ -1799,22 +1748,19 @@ class Goal(models.Model):
         if self.selected_settings.target is None or self.selected_settings.completion is None:
             return False
 
-        predicted_balance = self.balance_at(self.selected_settings.completion)
-        return predicted_balance >= self.selected_settings.target
+        return goal_projection(self)['success'] >= ON_TRACK_PROBABILITY
 
-    def _sum_holdings(self, qs):
-        total_holdings = qs.filter(execution_distribution__transaction__from_goal=self).\
-            annotate(cur_price=F('execution_distribution__execution__asset__unit_price')).\
-            aggregate(total_value=Coalesce(Sum(F('cur_price') * F('quantity')), 0))
-
-        result = total_holdings['total_value']
-        return result
+    def _holdings_value(self, name):
+        """
+        :param name: The valuation to get, as for GoalHoldingQuerySet.valuations()
+        :return: The value of the goal's holdings of active tickers at current unit prices.
+        """
+        valuation = GoalHolding.objects.filter(goal=self).valuations().get(self.id, {})
+        return valuation.get(name) or 0.0
 
     @property
     def total_balance(self):
-        b = self.cash_balance
-        b += self._sum_holdings(PositionLot.objects.filter(execution_distribution__execution__asset__state=Ticker.State.ACTIVE.value))
-        return b
+        return self.cash_balance + self._holdings_value('total')
 
     @property
     def current_balance(self):
@@ -1825,33 +1771,19 @@ class Goal(models.Model):
 
     @property
     def stock_balance(self):
-        stocks = InvestmentType.Standard.STOCKS.get()
-        return self._sum_holdings(
-            PositionLot.objects.filter(execution_distribution__execution__asset__asset_class__investment_type=stocks,
-                                       execution_distribution__execution__asset__state=Ticker.State.ACTIVE.value)
-        )
+        return self._holdings_value('stocks')
 
     @property
     def bond_balance(self):
-        bonds = InvestmentType.Standard.BONDS.get()
-        return self._sum_holdings(
-            PositionLot.objects.filter(execution_distribution__execution__asset__asset_class__investment_type=bonds,
-                                       execution_distribution__execution__asset__state=Ticker.State.ACTIVE.value)
-        )
+        return self._holdings_value('bonds')
 
     @property
     def core_balance(self):
-        return self._sum_holdings(
-            PositionLot.objects.filter(execution_distribution__execution__asset__etf=True,
-                                       execution_distribution__execution__asset__state=Ticker.State.ACTIVE.value)
-        )
+        return self._holdings_value('core')
 
     @property
     def satellite_balance(self):
-        return self._sum_holdings(
-            PositionLot.objects.filter(execution_distribution__execution__asset_etf=False,
-                                       execution_distribution__execution__asset__state=Ticker.State.ACTIVE.value)
-        )
+        return self._holdings_value('satellite')
 
     @property
     def total_return(self):
@@ -2386,6 +2318,63 @@ class Sale(models.Model):
     quantity = models.FloatField(null=True, blank=True, default=None)
 
 
+class GoalHolding(models.Model):
+    """
+    The number of units of a ticker a goal holds, being the sum of the quantities of the goal's position lots in it.
+    It is kept up to date as lots are bought and sold, so the holdings of many goals can be valued in one grouped
+    query instead of joining through the lots, distributions, transactions and executions of each goal.
+    """
+    goal = models.ForeignKey(Goal, related_name='holdings', on_delete=CASCADE)
+    ticker = models.ForeignKey(Ticker, related_name='holdings', on_delete=PROTECT)
+    quantity = models.FloatField(default=0.0)
+
+    objects = GoalHoldingQuerySet.as_manager()
+
+    class Meta:
+        unique_together = ('goal', 'ticker')
+
+    def __str__(self):
+        return "{}|{}|{}".format(self.goal_id, self.ticker_id, self.quantity)
+
+    @classmethod
+    def adjust(cls, changes):
+        """
+        Apply changes in the quantities held.
+        :param changes: {(goal_id, ticker_id): change in quantity}
+        """
+        for (goal_id, ticker_id), change in changes.items():
+            if change == 0:
+                continue
+            updated = cls.objects.filter(goal_id=goal_id, ticker_id=ticker_id).update(quantity=F('quantity') + change)
+            if not updated:
+                cls.objects.create(goal_id=goal_id, ticker_id=ticker_id, quantity=change)
+        invalidate_firm_analytics()
+
+    @classmethod
+    @transaction.atomic
+    def rebuild(cls):
+        """
+        Recalculate all the holdings from the position lots.
+        """
+        cls.objects.all().delete()
+        cls.objects.bulk_create(cls(goal_id=row['goal_id'], ticker_id=row['ticker_id'], quantity=row['quantity'])
+                                for row in lot_holdings(PositionLot.objects.all()))
+        invalidate_firm_analytics()
+
+
+def lot_holdings(lots):
+    """
+    :param lots: PositionLot queryset
+    :return: The total quantity of the lots per goal and ticker, as dicts of goal_id, ticker_id and quantity.
+    """
+    return (lots.order_by()
+            .with_goal()
+            .annotate(ticker_id=F('execution_distribution__execution__asset'))
+            .filter(goal_id__isnull=False)
+            .values('goal_id', 'ticker_id')
+            .annotate(quantity=Sum('quantity')))
+
+
 class SymbolReturnHistory(models.Model):
     return_number = models.FloatField(default=0)
     symbol = models.CharField(max_length=20)
@@ -2599,6 +2588,12 @@ class Transaction(models.Model):
         return '{}|{}|{}|{}|{}'.format(self.id, self.created, self.reason, self.status, self.amount)
 
 
+@receiver(post_save, sender=Transaction)
+def invalidate_analytics_on_execution(sender, instance, **kwargs):
+    if instance.status == Transaction.STATUS_EXECUTED:
+        invalidate_firm_analytics()
+
+
 class EventMemo(models.Model):
     event = models.ForeignKey(el_models.Log,
                               related_name="memos",
@@ -2620,6 +2615,22 @@ class ActivityLog(models.Model):
                                              "Eg. 'request.amount'")
     # Also has field 'events' from ActivityLogEvent
 
+    @classmethod
+    def event_types(cls):
+        """
+        :return: ({event id: ActivityLog id}, {ActivityLog id: [format arg paths]}) for the events with an activity
+                 type. Cached until an ActivityLog or ActivityLogEvent is saved or deleted.
+        """
+        types = cache.get(redis.Keys.ACTIVITY_TYPES.value)
+        if types is None:
+            events = dict(ActivityLogEvent.objects.values_list('id', 'activity_log'))
+            args = {aid: [path.strip() for path in format_args.strip().splitlines()]
+                    for aid, format_args in cls.objects.exclude(format_args=None).values_list('id', 'format_args')
+                    if format_args}
+            types = (events, args)
+            cache.set(redis.Keys.ACTIVITY_TYPES.value, types, timeout=None)
+        return types
+
 
 class ActivityLogEvent(models.Model):
     # Import event here so we have it within our activitylogevent.
@@ -2668,6 +2679,14 @@ class ActivityLogEvent(models.Model):
         return ActivityLogEvent.objects.create(id=event.value, activity_log=alog)
 
 
+@receiver(post_save, sender=ActivityLog)
+@receiver(post_delete, sender=ActivityLog)
+@receiver(post_save, sender=ActivityLogEvent)
+@receiver(post_delete, sender=ActivityLogEvent)
+def activity_types_changed(sender, **kwargs):
+    cache.delete(redis.Keys.ACTIVITY_TYPES.value)
+
+
 class Inflation(models.Model):
     year = models.PositiveIntegerField(help_text="The year the inflation value is for. "
                                                  "If after recorded, it is a forecast, otherwise it's an observation.")
@@ -2685,47 +2704,23 @@ class Inflation(models.Model):
         """
         :return: A dictionary from (year, month) => cumulative total inflation (1-based) from beginning of records till that time
         """
-        data = getattr(cls, '_cum_data', None)
-        if not data:
-            data = cache.get(redis.Keys.INFLATION)
-        if not data:
-            data = {}
-            vals = list(cls.objects.all().values_list('year', 'month', 'value'))
-            if vals:
-                f_d = date(vals[0][0], vals[0][1], 1)
-                l_d = date(vals[-1][0], vals[-1][1], 1)
-                if (months_between(f_d, l_d) + 1) > len(vals):
-                    raise Exception("Holes exist in the inflation forecast figures, cannot proceed.")
-                isum = 1
-                # Add the entry for the start of the series.
-                data[((f_d - timedelta(days=1)).month, (f_d - timedelta(days=1)).year)] = isum
-                for val in vals:
-                    isum *= 1 + val[2]
-                    data[(val[0], val[1])] = isum
-                cache.set(redis.Keys.INFLATION, data, timeout=60 * 60 * 24)
-        cls._cum_data = data
-        return data
+        return get_inflation_index().as_dict()
 
     @classmethod
     def between(cls, begin_date: datetime.date, end_date: datetime.date) -> float:
         """
         Calculates inflation between two dates. (predicted if in future, actual for all past dates)
-        :param start: The start date from when to calculate the inflation
-        :param start: The date until when to calculate the inflation
+        :param begin_date: The start date from when to calculate the inflation
+        :param end_date: The date until when to calculate the inflation
         :return: float value for the inflation. 0.05 = 5% inflation
         """
-
-        if begin_date > end_date:
-            raise ValueError('End date must not be before begin date.')
-        if begin_date == end_date:
-            return 0
-        data = cls.cumulative()
-        first = data.get((begin_date.year, begin_date.month), None)
-        last = data.get((end_date.year, end_date.month), None)
-        if first is None or last is None:
-            raise ValidationError("Inflation figures don't cover entire period requested: {} - {}".format(begin_date,
-                                                                                                          end_date))
-        return (last / first) - 1
+        return get_inflation_index().between(begin_date, end_date)
 
     def __str__(self):
         return '{0.month}/{0.year}: {0.value}'.format(self)
+
+
+@receiver(post_save, sender=Inflation)
+@receiver(post_delete, sender=Inflation)
+def inflation_changed(sender, **kwargs):
+    invalidate_inflation_index()
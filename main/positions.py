@@ -0,0 +1,45 @@
+"""
+The positions of goals: the quantity and current value of each ticker they hold, from their GoalHoldings.
+
+The positions of any number of goals come from one query, rather than a query for each goal and ticker.
+"""
+from collections import defaultdict
+
+
+def goal_positions(goal_ids, active_only=True):
+    """
+    :param goal_ids: The ids of the goals to get the positions of.
+    :param active_only: Only count tickers in the active state.
+    :return: {goal_id: [{'ticker_id': , 'price': , 'quantity': , 'value': }]} with each goal's positions in ticker id
+             order, valued at current unit prices. Goals without any positions are left out.
+    """
+    from main.models import GoalHolding, Ticker
+
+    holdings = GoalHolding.objects.filter(goal_id__in=list(goal_ids), quantity__gt=0)
+    if active_only:
+        holdings = holdings.filter(ticker__state=Ticker.State.ACTIVE.value)
+    rows = holdings\
+        .order_by('goal_id', 'ticker_id')\
+        .values_list('goal_id', 'ticker_id', 'ticker__unit_price', 'quantity')
+
+    positions = defaultdict(list)
+    for goal_id, ticker_id, price, quantity in rows:
+        positions[goal_id].append({'ticker_id': ticker_id, 'price': price, 'quantity': quantity,
+                                   'value': price * quantity})
+    return dict(positions)
+
+
+def asset_class_positions(goal):
+    """
+    The goal's positions in every ticker of the asset classes of its portfolio set, with the classes and tickers
+    loaded together.
+    :return: [(asset class, [(ticker, position)])] where position is as for goal_positions, or None for the tickers
+             the goal doesn't hold.
+    """
+    held = {position['ticker_id']: position
+            for position in goal_positions([goal.id], active_only=False).get(goal.id, [])}
+    asset_classes = goal.portfolio_set.asset_classes\
+        .select_related('investment_type')\
+        .prefetch_related('tickers')
+    return [(asset_class, [(ticker, held.get(ticker.id)) for ticker in asset_class.tickers.all()])
+            for asset_class in asset_classes]
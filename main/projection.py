@@ -0,0 +1,179 @@
+"""
+Monte Carlo projections of goal balances.
+
+Many paths of portfolio returns are simulated at once as a matrix, and each of the goal's cash flows, from its current
+balance and the recurring transactions of its selected settings, grows along every path from the time it happens. The
+returns are lognormal with a median annual growth of 1 + er, as Goal.balance_at assumes, and an annual standard
+deviation of the log return of stdev. The random stream is seeded, so the same inputs always give the same projection.
+"""
+import logging
+from datetime import datetime
+
+import numpy as np
+from django.core.cache import cache
+from django.utils.timezone import now
+
+from common.utils import dt2ed
+from main import redis
+
+logger = logging.getLogger('main.projection')
+
+# The number of return paths simulated.
+PATHS = 1000
+
+# The seed of the random stream the paths are drawn from.
+SEED = 2016
+
+# The most path steps simulated in one block, which bounds the memory used however many paths or cash flows there are.
+MAX_CELLS = 2 ** 20
+
+# The percentiles of the simulated balances the projection gives.
+PERCENTILES = (5, 25, 50, 75, 95)
+
+# The number of dates from now to the goal's completion the projection gives balances for.
+HORIZONS = 50
+
+# A goal is on track if at least this proportion of its paths meet its target by its completion.
+ON_TRACK_PROBABILITY = 0.5
+
+# Projections are made once a day, unless their goal's cash flows, portfolio or target change.
+PROJECTION_CACHE_TIMEOUT = 60 * 60 * 24
+
+
+def simulate_balances(events, er, stdev, horizons, paths=PATHS, seed=SEED):
+    """
+    :param events: [(years from now, amount)] of the cash flows into (positive) or out of (negative) the goal,
+                   including its current balance at 0.
+    :param er: The expected annual return. 0.05 = 5%
+    :param stdev: The annual standard deviation of the return.
+    :param horizons: The years from now to get the balances at.
+    :return: A paths x horizons array of the simulated balances.
+    """
+    event_times = np.maximum(np.array([t for t, _ in events], dtype=float), 0)
+    horizons = np.asarray(horizons, dtype=float)
+    times = np.union1d(np.union1d(event_times, horizons), [0.0])
+    flows = np.zeros(len(times))
+    if len(events):
+        np.add.at(flows, np.searchsorted(times, event_times), [amount for _, amount in events])
+    steps = np.diff(times)
+    drift = np.log1p(er) * steps
+    vol = stdev * np.sqrt(steps)
+    locs = np.searchsorted(times, horizons)
+
+    # The normals are drawn a row at a time, so the paths are the same however they're split into blocks.
+    state = np.random.RandomState(seed)
+    balances = np.empty((paths, len(horizons)))
+    block = max(1, MAX_CELLS // len(times))
+    for first in range(0, paths, block):
+        n = min(block, paths - first)
+        growth = np.zeros((n, len(times)))
+        growth[:, 1:] = np.cumsum(drift + vol * state.standard_normal((n, len(steps))), axis=1)
+        # Every flow to each time grown from when it happened to then.
+        values = np.exp(growth) * np.cumsum(flows * np.exp(-growth), axis=1)
+        balances[first:first + n] = values[:, locs]
+    return balances
+
+
+def summarise(balances, target=None):
+    """
+    :param balances: A paths x horizons array of simulated balances.
+    :param target: The balance to reach by the last horizon, if any.
+    :return: {'percentiles': {percentile: [balance at each horizon]}, 'success': the proportion of paths that reach
+             the target, or None if there isn't one}
+    """
+    bands = np.percentile(balances, PERCENTILES, axis=0) if len(balances) else np.zeros((len(PERCENTILES), 0))
+    success = None
+    if target is not None and balances.shape[1]:
+        success = float(np.mean(balances[:, -1] >= target))
+    return {'percentiles': {p: band.tolist() for p, band in zip(PERCENTILES, bands)}, 'success': success}
+
+
+def years_between(begin, end):
+    """
+    :return: The years from begin to end, as Goal.balance_at counts them.
+    """
+    tdelta = end - begin
+    return (tdelta.days + tdelta.seconds / 86400.0) / 365.25
+
+
+def goal_cash_flows(goal, until):
+    """
+    :param until: The date to get the cash flows up to.
+    :return: (the time now, [(years from now, amount)]) of the goal's current balance and the recurring transactions
+             of its selected settings until the given date.
+    """
+    current_time, events = goal_cash_flow_dates(goal, until)
+    return current_time, [(years_between(current_time, dt), amount) for dt, amount in events]
+
+
+def goal_cash_flow_dates(goal, until):
+    """
+    :param until: The date to get the cash flows up to.
+    :return: (the time now, [(naive datetime, amount)]) of the goal's current balance, now, and the recurring
+             transactions of its selected settings until the given date.
+    """
+    from main.models import RecurringTransaction
+
+    # use naïve dates for calculations
+    current_time = now().replace(tzinfo=None)
+    events = [(current_time, goal.total_balance)]
+    if hasattr(goal.selected_settings, 'recurring_transactions'):
+        events += RecurringTransaction.get_events(goal.selected_settings.recurring_transactions,
+                                                  current_time,
+                                                  datetime.combine(until, now().timetz()))
+    return current_time, events
+
+
+def portfolio_moments(settings):
+    """
+    :return: (er, stdev) of the settings' portfolio, or 0 for both if it doesn't have one yet.
+    """
+    if not hasattr(settings, 'portfolio'):
+        return 0.0, 0.0
+    return settings.portfolio.er, settings.portfolio.stdev
+
+
+def goal_projection(goal, paths=PATHS, seed=SEED):
+    """
+    Project the goal's balance from now to its completion with its selected settings. The projection is cached, and
+    made again the next day or when the inputs change.
+    :return: {'dates': [epoch day of each horizon], 'percentiles': , 'success': } as for summarise, with the success
+             of reaching the settings' target on the completion date. None if the goal has no selected settings.
+    """
+    settings = goal.selected_settings
+    if settings is None:
+        return None
+    completion = settings.completion
+    current_time, dated_events = goal_cash_flow_dates(goal, completion)
+    er, stdev = portfolio_moments(settings)
+    end = datetime.combine(completion, current_time.time())
+    years = np.linspace(0, max(years_between(current_time, end), 0), HORIZONS)
+
+    # Keyed on the dates of the events rather than their years from now, which change by the hour.
+    signature = (current_time.date(), settings.id, settings.target, completion, er, stdev, paths, seed,
+                 tuple((dt.date(), amount) for dt, amount in dated_events))
+    key = '{}_{}'.format(redis.Keys.GOAL_PROJECTION.value, goal.id)
+    cached = cache.get(key)
+    if cached is not None and cached['signature'] == signature:
+        return cached['projection']
+
+    events = [(years_between(current_time, dt), amount) for dt, amount in dated_events]
+    balances = simulate_balances(events, er, stdev, years, paths=paths, seed=seed)
+    projection = summarise(balances, settings.target)
+    dates = [current_time + (end - current_time) * (ix / max(HORIZONS - 1, 1)) for ix in range(HORIZONS)]
+    projection['dates'] = [dt2ed(dt) for dt in dates]
+    cache.set(key, {'signature': signature, 'projection': projection}, timeout=PROJECTION_CACHE_TIMEOUT)
+    return projection
+
+
+def project_goals(goals):
+    """
+    Make the projection of each goal, so they are ready for the day.
+    :return: {goal_id: whether the goal is on track}
+    """
+    on_track = {}
+    for goal in goals:
+        projection = goal_projection(goal)
+        if projection is not None:
+            on_track[goal.id] = projection['success'] is not None and projection['success'] >= ON_TRACK_PROBABILITY
+    return on_track
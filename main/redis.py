@@ -5,3 +5,9 @@ from enum import Enum, unique
 class Keys(Enum):
     INSTRUMENT_DATA = 'instrument_data'
     INFLATION = 'inflation'
+    CYCLE_MOMENTS = 'cycle_moments'
+    FIRM_ANALYTICS = 'firm_analytics'
+    RETURNS = 'returns'
+    PERFORMANCE_HISTORY = 'performance_history'
+    GOAL_PROJECTION = 'goal_projection'
+    ACTIVITY_TYPES = 'activity_types'
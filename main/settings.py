@@ -156,6 +156,10 @@ SHOW_HIJACKUSER_IN_ADMIN = False
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 MEDIA_URL = '/media/'
 
+# Directory for the memory mapped instrument data store shared by all workers on a host.
+# When not set, the instrument data is kept in the Django cache instead.
+INSTRUMENT_STORE_DIR = None
+
 
 DEFAULT_FROM_EMAIL = os.environ.get('DEFAULT_FROM_EMAIL', "no-reply@mailgun.betasmartz.com")
 SUPPORT_EMAIL = "support@betasmartz.com"
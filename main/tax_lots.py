@@ -0,0 +1,122 @@
+"""
+An in memory index of the open position lots of some goals, by (goal, ticker). It orders each goal's lots of a ticker
+by their unit tax cost at any price, so the lots to sell can be picked without querying for them sale by sale, and the
+lots picked can then be written back together.
+"""
+from collections import defaultdict
+from datetime import timedelta
+
+import numpy as np
+from django.db.models import F
+from django.utils import timezone
+
+from main.management.commands.rebalance import TAX_BRACKET_LESS1Y, TAX_BRACKET_MORE1Y
+
+
+class TaxLotIndex(object):
+    def __init__(self, lots, now=None, goal_ids=None):
+        """
+        :param lots: Iterable of lot dicts, as load() reads them.
+        :param now: The time the lots are costed at. Lots bought in the year to then are in the higher tax bracket.
+        :param goal_ids: The goals whose open lots are all in lots, or None if every goal's are.
+        """
+        self.year_ago = (now or timezone.now()) - timedelta(days=366)
+        self.goal_ids = None if goal_ids is None else set(goal_ids)
+        self._lots = defaultdict(list)
+        for lot in lots:
+            self._lots[(lot['goal_id'], lot['ticker_id'])].append(lot)
+
+    @classmethod
+    def load(cls, goal_ids=None, ticker_ids=None, now=None):
+        """
+        Load the open lots of the given goals and tickers in one query.
+        :param goal_ids: The goals to load the lots of, or None for all.
+        :param ticker_ids: The tickers to load the lots of, or None for all.
+        :return: A TaxLotIndex
+        """
+        from main.models import PositionLot
+
+        lots = PositionLot.objects\
+            .filter(quantity__gt=0)\
+            .with_goal()\
+            .annotate(ticker_id=F('execution_distribution__execution__asset_id'),
+                      price_entry=F('execution_distribution__execution__price'),
+                      executed=F('execution_distribution__execution__executed'),
+                      price=F('execution_distribution__execution__asset__unit_price'),
+                      state=F('execution_distribution__execution__asset__state'))
+        if goal_ids is not None:
+            lots = lots.filter(goal_id__in=list(goal_ids))
+        if ticker_ids is not None:
+            lots = lots.filter(execution_distribution__execution__asset_id__in=list(ticker_ids))
+        return cls(lots.order_by('id').values('id', 'goal_id', 'ticker_id', 'quantity', 'price_entry', 'executed',
+                                              'price', 'state', 'execution_distribution_id'),
+                   now=now,
+                   # Only some of the goals' lots are loaded when the tickers are limited.
+                   goal_ids=goal_ids if ticker_ids is None else ())
+
+    def has_goal(self, goal_id):
+        """
+        :return: True if the index holds all the goal's open lots.
+        """
+        return self.goal_ids is None or goal_id in self.goal_ids
+
+    def unit_tax_cost(self, lot, price=None):
+        """
+        :param price: The price to sell at. Defaults to the ticker's current unit price.
+        :return: The tax per unit of selling the lot at price.
+        """
+        bracket = TAX_BRACKET_LESS1Y if lot['executed'] > self.year_ago else TAX_BRACKET_MORE1Y
+        return ((lot['price'] if price is None else price) - lot['price_entry']) * bracket
+
+    def lots(self, goal_id, ticker_id=None, price=None):
+        """
+        :param ticker_id: The ticker to get the lots of, or None for all the goal's lots.
+        :param price: The price to cost the lots at. Defaults to each ticker's current unit price.
+        :return: The goal's open lots, ordered by increasing unit tax cost. Lots of equal cost stay in id order.
+        """
+        if ticker_id is None:
+            lots = sorted((lot for (gid, _), lots in self._lots.items() if gid == goal_id for lot in lots),
+                          key=lambda lot: lot['id'])
+        else:
+            lots = self._lots.get((goal_id, ticker_id), [])
+        lots = [lot for lot in lots if lot['quantity'] > 0]
+        costs = np.array([self.unit_tax_cost(lot, price) for lot in lots])
+        return [lots[ix] for ix in np.argsort(costs, kind='mergesort')]
+
+    def sell(self, goal_id, ticker_id, quantity, price):
+        """
+        Take quantity units of the ticker out of the goal's lots, cheapest in tax at price first.
+        :return: [(lot, quantity sold from it)] The lots' quantities are reduced by what was sold from them.
+        """
+        left_to_sell = quantity
+        sold = []
+        for lot in self.lots(goal_id, ticker_id, price):
+            if left_to_sell == 0:
+                break
+            new_quantity = max(lot['quantity'] - left_to_sell, 0)
+            sold_quantity = lot['quantity'] - new_quantity
+            left_to_sell -= sold_quantity
+            lot['quantity'] = new_quantity
+            sold.append((lot, sold_quantity))
+        return sold
+
+    def active_lots(self, goal_id):
+        """
+        :return: The goal's open lots of active tickers, ordered by increasing unit tax cost at current prices.
+        """
+        from main.models import Ticker
+
+        return [lot for lot in self.lots(goal_id) if lot['state'] == Ticker.State.ACTIVE.value]
+
+    def values_bought_since(self, goal_id, since):
+        """
+        :param since: Only lots bought after this time count. A naive time is taken to be in the current timezone.
+        :return: {ticker_id: current value} of the goal's open lots of active tickers bought since the given time.
+        """
+        values = defaultdict(float)
+        for lot in self.active_lots(goal_id):
+            cutoff = timezone.make_aware(since) if timezone.is_aware(lot['executed']) and timezone.is_naive(since) \
+                else since
+            if lot['executed'] > cutoff:
+                values[lot['ticker_id']] += lot['quantity'] * lot['price']
+        return dict(values)
@@ -14,7 +14,7 @@ from client.models import Client, ClientAccount, IBAccount, RiskProfileAnswer, \
 from main.constants import ACCOUNT_TYPE_PERSONAL
 from main.event import Event
 from main.models import Advisor, AssetClass, DailyPrice, Execution, \
-    ExecutionDistribution, ExternalAsset, Firm, Goal, \
+    ExecutionDistribution, ExternalAsset, Firm, Goal, GoalHolding, \
     GoalMetricGroup, GoalSetting, GoalType, HistoricalBalance, MarketIndex, \
     PortfolioSet, Region, Ticker, User, ExternalInstrument, \
     Transaction, MarketOrderRequest
@@ -805,6 +805,7 @@ class Fixture1:
                                                            volume=quantity,
                                                            execution_request=er)
         position_lot = PositionLotFactory.create(quantity=quantity, execution_distribution=distribution)
+        GoalHolding.adjust({(goal.id, ticker.id): quantity})
 
         return_values = list()
         return_values.extend((mor, execution, transaction, distribution, position_lot))
@@ -0,0 +1,47 @@
+from datetime import date, datetime
+
+from django.test import TestCase
+from django.utils import timezone
+
+from api.v1.tests.factories import GoalFactory, TickerFactory
+from main.balance_history import backfill_balances, build_balances, calculate_balances, missing_ranges, \
+    verify_balances
+from main.models import HistoricalBalance, Transaction
+from main.tests.fixture import Fixture1
+
+
+class BalanceHistoryTest(TestCase):
+    def setUp(self):
+        self.goal = GoalFactory.create()
+        self.ticker = TickerFactory.create()
+        Transaction.objects.create(reason=Transaction.REASON_DEPOSIT, to_goal=self.goal, amount=1000,
+                                   status=Transaction.STATUS_EXECUTED,
+                                   executed=timezone.make_aware(datetime(2016, 1, 1, 12)))
+        Fixture1.create_execution_details(self.goal, self.ticker, 10, 50, timezone.make_aware(datetime(2016, 1, 2, 12)))
+        Fixture1.set_prices(((self.ticker, '20160102', 50), (self.ticker, '20160103', 55)))
+
+    def balances(self):
+        return list(HistoricalBalance.objects.filter(goal=self.goal).order_by('date').values_list('date', 'balance'))
+
+    def test_calculate_balances(self):
+        expected = [(self.goal.id, date(2016, 1, 1), 1000), (self.goal.id, date(2016, 1, 2), 1000),
+                    (self.goal.id, date(2016, 1, 3), 1050), (self.goal.id, date(2016, 1, 4), 1050)]
+        self.assertListEqual(calculate_balances(date(2015, 12, 31), date(2016, 1, 4)), expected)
+        # Opening from before the range gives the same balances.
+        self.assertListEqual(calculate_balances(date(2016, 1, 3), date(2016, 1, 4)), expected[2:])
+
+    def test_backfill_balances(self):
+        build_balances(date(2016, 1, 2), date(2016, 1, 2))
+        self.assertListEqual(missing_ranges(date(2016, 1, 1), date(2016, 1, 4)),
+                             [(date(2016, 1, 1), date(2016, 1, 1)), (date(2016, 1, 3), date(2016, 1, 4))])
+        self.assertEqual(backfill_balances(date(2016, 1, 1), date(2016, 1, 4), batch_days=1), 3)
+        self.assertListEqual(missing_ranges(date(2016, 1, 1), date(2016, 1, 4)), [])
+        self.assertListEqual(self.balances(), [(date(2016, 1, 1), 1000), (date(2016, 1, 2), 1000),
+                                               (date(2016, 1, 3), 1050), (date(2016, 1, 4), 1050)])
+
+    def test_verify_balances(self):
+        build_balances(date(2016, 1, 1), date(2016, 1, 4))
+        self.assertDictEqual(verify_balances(), {})
+        HistoricalBalance.objects.filter(goal=self.goal, date=date(2016, 1, 4)).update(balance=900)
+        self.assertDictEqual(verify_balances(), {self.goal.id: (900, 1050)})
+        self.assertEqual(HistoricalBalance.objects.get(goal=self.goal, date=date(2016, 1, 4)).balance, 1050)
@@ -8,7 +8,8 @@ from django.utils import timezone
 
 from api.v1.tests.factories import TickerFactory, GoalFactory, TransactionFactory, ExecutionDistributionFactory, \
     PositionLotFactory, ContentTypeFactory, AssetClassFactory
-from main.models import Goal, Transaction, MarketOrderRequest, Execution, InvestmentType
+from main.finance import mod_dietz_rate, mod_dietz_rates
+from main.models import Goal, GoalHolding, PositionLot, Transaction, MarketOrderRequest, Execution, InvestmentType
 from main.tests.fixture import Fixture1
 
 
@@ -62,6 +63,97 @@ class GoalTests(TestCase):
         self.assertTrue(weight_bonds == 0)
         self.assertTrue(weight_core == 100)
 
+    def test_financials(self):
+        goal = GoalFactory.create()
+        other = GoalFactory.create(account=goal.account)
+        executed = Transaction.STATUS_EXECUTED
+        TransactionFactory.create(to_goal=goal, amount=1000, status=executed)
+        TransactionFactory.create(to_goal=goal, amount=50)
+        TransactionFactory.create(to_goal=None, from_goal=goal, amount=200, status=executed,
+                                  reason=Transaction.REASON_WITHDRAWAL)
+        TransactionFactory.create(to_goal=None, from_goal=goal, amount=30, reason=Transaction.REASON_WITHDRAWAL)
+        TransactionFactory.create(to_goal=other, from_goal=goal, amount=100, status=executed,
+                                  reason=Transaction.REASON_TRANSFER)
+        TransactionFactory.create(to_goal=goal, amount=12, status=executed, reason=Transaction.REASON_DIVIDEND)
+        TransactionFactory.create(to_goal=None, from_goal=goal, amount=7, status=executed,
+                                  reason=Transaction.REASON_FEE)
+        TransactionFactory.create(to_goal=None, from_goal=goal, amount=400, status=executed,
+                                  reason=Transaction.REASON_EXECUTION)
+
+        expected = {
+            'pending_incomings': 50,
+            'pending_outgoings': 30,
+            'pending_amount': 20,
+            'requested_incomings': 1000,
+            'requested_outgoings': -700,
+            'total_dividends': 12,
+            'total_deposits': 1000,
+            'total_withdrawals': 200,
+            'net_invested': 700,
+            'net_executions': -400,
+            'total_fees': -7,
+        }
+        with self.assertNumQueries(1):
+            self.assertEqual(goal.financials, expected)
+
+        # The goals, then the transaction sums of all of them.
+        with self.assertNumQueries(2):
+            goals = {g.id: g for g in Goal.objects.filter(account=goal.account).with_financials()}
+        with self.assertNumQueries(0):
+            self.assertEqual(goals[goal.id].financials, expected)
+            self.assertEqual(goals[goal.id].investments['other'], -100)
+            self.assertEqual(goals[other.id].net_invested, 100)
+            self.assertEqual(goals[other.id].pending_amount, 0)
+
+    def test_balances(self):
+        stocks = AssetClassFactory.create(investment_type=InvestmentType.Standard.STOCKS.get())
+        bonds = AssetClassFactory.create(investment_type=InvestmentType.Standard.BONDS.get())
+        fund1 = TickerFactory.create(asset_class=stocks, unit_price=3, etf=True)
+        fund2 = TickerFactory.create(asset_class=bonds, unit_price=7, etf=False)
+        goal1 = GoalFactory.create()
+        goal2 = GoalFactory.create(account=goal1.account)
+        Fixture1.create_execution_details(goal1, fund1, 10, 2, date(2014, 6, 1))
+        Fixture1.create_execution_details(goal1, fund2, 4, 2, date(2014, 6, 1))
+        Fixture1.create_execution_details(goal2, fund2, 5, 2, date(2014, 6, 1))
+
+        goals = Goal.objects.filter(account=goal1.account)
+        balances = goals.balances()
+        for goal in (goal1, goal2):
+            self.assertAlmostEqual(balances[goal.id]['total'], goal.total_balance)
+            self.assertAlmostEqual(balances[goal.id]['stocks'], goal.stock_balance)
+            self.assertAlmostEqual(balances[goal.id]['bonds'], goal.bond_balance)
+            self.assertAlmostEqual(balances[goal.id]['core'], goal.core_balance)
+        self.assertAlmostEqual(balances[goal1.id]['satellite'], 28)
+
+        total = goals.balance()
+        self.assertAlmostEqual(total['total'], goal1.total_balance + goal2.total_balance)
+        self.assertAlmostEqual(goals.balances('account')[goal1.account.id]['total'], total['total'])
+        self.assertAlmostEqual(goal1.account.total_balance, total['total'] + goal1.account.cash_balance)
+
+        holdings = list(GoalHolding.objects.order_by('goal', 'ticker').values_list('goal', 'ticker', 'quantity'))
+        GoalHolding.rebuild()
+        self.assertListEqual(list(GoalHolding.objects.order_by('goal', 'ticker')
+                                  .values_list('goal', 'ticker', 'quantity')), holdings)
+
+    def test_fill_lot_balances(self):
+        # Lots bought by fills are attributed through the transaction's to_goal, not its from_goal.
+        fund = TickerFactory.create(unit_price=3)
+        goal = GoalFactory.create()
+        execution = Fixture1.create_execution_details(goal, fund, 10, 2, date(2014, 6, 1))[1]
+        transaction = TransactionFactory.create(reason=Transaction.REASON_ORDER, to_goal=goal, from_goal=None,
+                                                amount=8, executed=timezone.now())
+        distribution = ExecutionDistributionFactory.create(execution=execution, transaction=transaction, volume=4)
+        PositionLotFactory.create(quantity=4, execution_distribution=distribution)
+        GoalHolding.adjust({(goal.id, fund.id): 4})
+
+        self.assertEqual(PositionLot.objects.filter_by_goals([goal.id]).count(), 2)
+        self.assertAlmostEqual(goal.total_balance, goal.cash_balance + 42)
+        self.assertAlmostEqual(goal.total_balance, Goal.objects.filter(id=goal.id).balances()[goal.id]['total'])
+        self.assertListEqual([(p['ticker_id'], p['quantity']) for p in goal.get_positions_all()], [(fund.id, 14)])
+
+        GoalHolding.rebuild()
+        self.assertAlmostEqual(GoalHolding.objects.get(goal=goal, ticker=fund).quantity, 14)
+
 
 class GoalTotalReturnTest(TestCase):
     # FIXME this doesn't work because of using Fixture1
@@ -114,6 +206,24 @@ class GoalTotalReturnTest(TestCase):
         with mock.patch.object(timezone, 'now', self.mocked_date(days)):
             return self.goal.total_balance
 
+    def test_batch_rates(self):
+        self.goal_opening(1000)
+        self.goal_transaction(200, 8 * 30)
+        with mock.patch.object(timezone, 'now', self.mocked_date(30)):
+            goal2 = Fixture1.goal2()
+            Transaction.objects.create(reason=Transaction.REASON_DEPOSIT, to_goal=goal2, amount=500,
+                                       status=Transaction.STATUS_EXECUTED, executed=timezone.now())
+        self.goal.cash_balance = 1100
+        self.goal.save()
+        goal2.cash_balance = 450
+        goal2.save()
+        with mock.patch('main.finance.now', self.mocked_date(548)):
+            rates = mod_dietz_rates({'one': [self.goal], 'two': [goal2], 'both': [self.goal, goal2], 'none': []})
+            self.assertEqual(rates['one'], mod_dietz_rate([self.goal]))
+            self.assertEqual(rates['two'], mod_dietz_rate([goal2]))
+            self.assertEqual(rates['both'], mod_dietz_rate([self.goal, goal2]))
+            self.assertEqual(rates['none'], 0)
+
     def test_zero_balance(self):
         goal = Fixture1.goal1()
         self.load_fixture('main/tests/fixtures/transactions.json')
@@ -0,0 +1,48 @@
+import datetime
+
+from django.core.exceptions import ValidationError
+from django.test import TestCase
+
+from main.inflation import InflationIndex, get_index, invalidate_index
+from main.models import Inflation
+
+
+class InflationIndexTest(TestCase):
+    def setUp(self):
+        Inflation.objects.bulk_create([Inflation(year=2015, month=month, value=0.01) for month in range(11, 13)] +
+                                      [Inflation(year=2016, month=month, value=0.02) for month in range(1, 13)])
+        invalidate_index()
+
+    def test_cumulative(self):
+        data = Inflation.cumulative()
+        # The series starts from the month before the first figure.
+        self.assertEqual(data[(2015, 10)], 1)
+        self.assertAlmostEqual(data[(2015, 12)], 1.01 ** 2)
+        self.assertAlmostEqual(data[(2016, 12)], 1.01 ** 2 * 1.02 ** 12)
+
+    def test_between(self):
+        begin, end = datetime.date(2015, 12, 15), datetime.date(2016, 3, 1)
+        self.assertAlmostEqual(Inflation.between(begin, end), 1.02 ** 3 - 1)
+        self.assertEqual(Inflation.between(begin, begin), 0)
+        with self.assertRaises(ValueError):
+            Inflation.between(end, begin)
+        with self.assertRaises(ValidationError):
+            Inflation.between(begin, datetime.date(2017, 1, 1))
+
+        rates = get_index().between([begin, begin, end], [end, begin, end])
+        self.assertAlmostEqual(rates[0], 1.02 ** 3 - 1)
+        self.assertListEqual(list(rates[1:]), [0, 0])
+
+    def test_saving_figures_invalidates(self):
+        index = get_index()
+        self.assertIs(get_index(), index)
+        Inflation.objects.create(year=2017, month=1, value=0.03)
+        self.assertAlmostEqual(Inflation.between(datetime.date(2016, 12, 1), datetime.date(2017, 1, 1)), 0.03)
+        Inflation.objects.filter(year=2017).delete()
+        Inflation.objects.get(year=2016, month=12).delete()
+        with self.assertRaises(ValidationError):
+            Inflation.between(datetime.date(2016, 11, 1), datetime.date(2016, 12, 1))
+
+    def test_holes(self):
+        with self.assertRaises(Exception):
+            InflationIndex.from_figures([(2016, 1, 0.01), (2016, 3, 0.01)])
@@ -1,9 +1,11 @@
 # -*- coding: utf-8 -*-
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from api.v1.tests.factories import FirmFactory, FiscalYearFactory, \
     AdvisorFactory, ClientFactory, ClientAccountFactory, TransactionFactory, \
-    GoalFactory, AccountTypeRiskProfileGroupFactory
+    GoalFactory, AccountTypeRiskProfileGroupFactory, AccountGroupFactory
 from datetime import datetime, date
+from main.analytics import advisor_goals, get_firm_analytics
+from main.finance import cached_mod_dietz_rates, mod_dietz_rates
 from main.models import Transaction
 from main import constants
 from dateutil.relativedelta import relativedelta
@@ -78,3 +80,46 @@ class FirmModelTests(TestCase):
         # one charge for to_goal, one charge for from_goal
         expected_total_fees = self.fee2.amount + (self.fee1.amount * 2)
         self.assertEqual(self.firm.total_fees, expected_total_fees)
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_analytics(self):
+        analytics = get_firm_analytics(self.firm)
+        advisor1 = analytics['advisors'][self.advisor.id]
+        advisor2 = analytics['advisors'][self.advisor2.id]
+        self.assertAlmostEqual(advisor1['total_fees'], self.fee1.amount * 2)
+        self.assertAlmostEqual(advisor2['total_fees'], self.fee2.amount)
+        self.assertAlmostEqual(advisor1['total_balance'], self.client_account.cash_balance +
+                               self.goal1.cash_balance + self.goal2.cash_balance)
+        self.assertAlmostEqual(advisor2['total_balance'], self.client_account2.cash_balance + self.goal3.cash_balance)
+        self.assertEqual(advisor1['clients'], 1)
+        self.assertEqual(advisor1['households'], len(self.advisor.households))
+        self.assertAlmostEqual(analytics['total_balance'], advisor1['total_balance'] + advisor2['total_balance'])
+        self.assertEqual(self.firm.total_clients, 2)
+
+        # Cached until a transaction executes.
+        fee = TransactionFactory.create(reason=Transaction.REASON_FEE, to_goal=self.goal3, amount=100,
+                                        executed=self.older_fiscal_year.begin_date + relativedelta(months=2))
+        self.assertAlmostEqual(self.advisor2.total_fees, self.fee2.amount)
+        fee.status = Transaction.STATUS_EXECUTED
+        fee.save()
+        self.assertAlmostEqual(self.advisor2.total_fees, self.fee2.amount + fee.amount)
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_average_return(self):
+        group = AccountGroupFactory.create(advisor=self.advisor)
+        self.client_account.account_group = group
+        self.client_account.save()
+        unconfirmed = ClientAccountFactory.create(primary_owner=self.betasmartz_client, confirmed=False,
+                                                  account_group=group)
+        hidden = GoalFactory.create(account=unconfirmed)
+        for goal, amount in ((self.goal1, 1000), (hidden, 5000)):
+            TransactionFactory.create(reason=Transaction.REASON_DEPOSIT, status=Transaction.STATUS_EXECUTED,
+                                      to_goal=goal, amount=amount, executed=self.today - relativedelta(months=6))
+
+        goals = advisor_goals(self.firm)
+        self.assertSetEqual(goals[self.advisor.id], {self.goal1.id, self.goal2.id})
+        self.assertDictEqual(advisor_goals(self.firm, advisor=self.advisor), {self.advisor.id: goals[self.advisor.id]})
+        expected = mod_dietz_rates({self.advisor.id: goals[self.advisor.id]})[self.advisor.id]
+        # The dashboard fills the cache the advisor reads, so they must rate the same goals.
+        self.assertAlmostEqual(cached_mod_dietz_rates('advisor', goals)[self.advisor.id], expected)
+        self.assertAlmostEqual(self.advisor.average_return, expected)
@@ -0,0 +1,43 @@
+from datetime import date
+
+from django.test import TestCase
+
+from api.v1.tests.factories import GoalFactory, TickerFactory
+from main.models import Ticker
+from main.positions import asset_class_positions, goal_positions
+from main.tests.fixture import Fixture1
+
+
+class PositionsTest(TestCase):
+    def setUp(self):
+        self.fund = TickerFactory.create(unit_price=2.1)
+        self.fund2 = TickerFactory.create(unit_price=4, asset_class=self.fund.asset_class)
+        self.closed = TickerFactory.create(unit_price=3, state=Ticker.State.CLOSED.value)
+        self.goal = GoalFactory.create()
+        self.other_goal = GoalFactory.create()
+        Fixture1.create_execution_details(self.goal, self.fund, 10, 2, date(2014, 6, 1))
+        Fixture1.create_execution_details(self.goal, self.fund, 5, 2, date(2014, 6, 1))
+        Fixture1.create_execution_details(self.goal, self.closed, 2, 2, date(2014, 6, 1))
+        Fixture1.create_execution_details(self.other_goal, self.fund2, 1, 2, date(2014, 6, 1))
+
+    def test_goal_positions(self):
+        with self.assertNumQueries(1):
+            positions = goal_positions([self.goal.id, self.other_goal.id])
+        self.assertDictEqual(positions, {
+            self.goal.id: [{'ticker_id': self.fund.id, 'price': 2.1, 'quantity': 15, 'value': 31.5}],
+            self.other_goal.id: [{'ticker_id': self.fund2.id, 'price': 4, 'quantity': 1, 'value': 4}],
+        })
+        positions = goal_positions([self.goal.id], active_only=False)[self.goal.id]
+        self.assertListEqual([(p['ticker_id'], p['quantity']) for p in positions],
+                             [(self.fund.id, 15), (self.closed.id, 2)])
+        self.assertListEqual(self.goal.get_positions_all(), goal_positions([self.goal.id])[self.goal.id])
+
+    def test_asset_class_positions(self):
+        self.goal.portfolio_set.asset_classes.add(self.fund.asset_class)
+        with self.assertNumQueries(3):
+            classes = asset_class_positions(self.goal)
+        self.assertEqual(len(classes), 1)
+        asset_class, tickers = classes[0]
+        self.assertEqual(asset_class, self.fund.asset_class)
+        self.assertDictEqual({ticker: position and position['value'] for ticker, position in tickers},
+                             {self.fund: 31.5, self.fund2: None})
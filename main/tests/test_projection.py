@@ -0,0 +1,78 @@
+from datetime import datetime, timedelta
+from unittest import mock
+
+import numpy as np
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from main import projection
+from main.models import Portfolio, RecurringTransaction
+from main.projection import HORIZONS, PERCENTILES, goal_projection, simulate_balances
+from main.tests.fixture import Fixture1
+
+
+class ProjectionTest(TestCase):
+    def setUp(self):
+        # An opening balance, then monthly deposits for ten years.
+        self.events = [(0.0, 1000.0)] + [(m / 12, 100.0) for m in range(1, 121)]
+
+    def test_simulate_balances(self):
+        balances = simulate_balances(self.events, 0.05, 0.1, [0, 5, 10], paths=500)
+        self.assertEqual(balances.shape, (500, 3))
+        self.assertTrue(np.all(balances[:, 0] == 1000))
+        # The same seed gives the same paths, however many are simulated at once.
+        with mock.patch.object(projection, 'MAX_CELLS', 300):
+            self.assertTrue(np.array_equal(simulate_balances(self.events, 0.05, 0.1, [0, 5, 10], paths=500),
+                                           balances))
+        self.assertFalse(np.array_equal(simulate_balances(self.events, 0.05, 0.1, [0, 5, 10], paths=500, seed=1),
+                                        balances))
+
+    def test_no_volatility(self):
+        # Without any volatility, every path compounds at the expected return.
+        balances = simulate_balances(self.events, 0.05, 0.0, [10], paths=3)
+        expected = sum(amount * 1.05 ** (10 - t) for t, amount in self.events)
+        for balance in balances[:, 0]:
+            self.assertAlmostEqual(balance, expected, 6)
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_goal_projection(self):
+        goal = Fixture1.goal1()
+        goal.cash_balance = 10000
+        goal.save()
+        settings = goal.selected_settings
+        settings.completion = timezone.now().date() + timedelta(days=3650)
+        settings.target = 15000
+        settings.save()
+        Portfolio.objects.create(setting=settings, er=0.05, stdev=0.1)
+
+        result = goal_projection(goal)
+        self.assertEqual(len(result['dates']), HORIZONS)
+        self.assertListEqual(sorted(result['percentiles']), list(PERCENTILES))
+        finals = [result['percentiles'][p][-1] for p in PERCENTILES]
+        self.assertListEqual(finals, sorted(finals))
+        self.assertTrue(0 < result['success'] < 1)
+        # The median path grows at the expected return, which is a little over the target.
+        self.assertEqual(goal.on_track, result['success'] >= 0.5)
+        with mock.patch.object(projection, 'simulate_balances') as simulate:
+            self.assertEqual(goal_projection(goal), result)
+            self.assertFalse(simulate.called)
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_goal_projection_cached_for_the_day(self):
+        morning = datetime(2016, 6, 1, 9, 0, tzinfo=timezone.utc)
+        goal = Fixture1.goal1()
+        settings = goal.selected_settings
+        settings.completion = morning.date() + timedelta(days=3650)
+        settings.save()
+        RecurringTransaction.objects.create(setting=settings, begin_date=morning.date(), amount=100, growth=0,
+                                            schedule='RRULE:FREQ=MONTHLY;BYMONTHDAY=4')
+
+        with mock.patch.object(projection, 'now', mock.Mock(return_value=morning)):
+            result = goal_projection(goal)
+        # The deposits are hours nearer later in the day, but the projection isn't made again until the next day.
+        with mock.patch.object(projection, 'now', mock.Mock(return_value=morning + timedelta(hours=5))), \
+                mock.patch.object(projection, 'simulate_balances') as simulate:
+            self.assertEqual(goal_projection(goal), result)
+            self.assertFalse(simulate.called)
+        with mock.patch.object(projection, 'now', mock.Mock(return_value=morning + timedelta(days=1))):
+            self.assertNotEqual(goal_projection(goal)['dates'], result['dates'])
@@ -1,4 +1,5 @@
 from django import test
+from django.core.management import call_command
 
 from main.tests.fixture import Fixture1
 from django.utils import timezone
@@ -9,13 +10,15 @@ from main.models import Transaction, GoalMetric
 from portfolios.providers.execution.django import ExecutionProviderDjango
 from portfolios.providers.data.django import DataProviderDjango
 from main.management.commands.rebalance import perturbate_mix, process_risk, perturbate_withdrawal, perturbate_risk, \
-    get_weights, get_tax_lots, calc_opt_inputs
+    get_weights, get_tax_lots, calc_opt_inputs, get_available_balance, get_positions, prefetch_rebalance_data, \
+    write_rebalance_orders, rebalance_goals, _sell_due_to_drift
 
 from main.management.commands.populate_test_data import populate_prices, populate_cycle_obs, populate_cycle_prediction
+from types import SimpleNamespace
 from unittest.mock import MagicMock
 from unittest import mock
 
-from main.models import Ticker, GoalMetric, Portfolio, PortfolioSet
+from main.models import Ticker, GoalMetric, Portfolio, PortfolioSet, ExecutionRequest
 from portfolios.calculation import get_instruments
 from datetime import datetime, date
 
@@ -111,6 +114,82 @@ class RebalanceTest(test.TestCase):
         #weights = perturbate_risk(goal=self.goal)
         self.assertTrue(True)
 
+    def test_sell_due_to_drift(self):
+        goal = SimpleNamespace(available_balance=100000.0)
+        metric = MagicMock(configured_val=0.3, comparison=GoalMetric.METRIC_COMPARISON_MAXIMUM,
+                           rebalance_type=GoalMetric.REBALANCE_TYPE_ABSOLUTE, rebalance_thr=0.05)
+        lots = [{'ticker_id': 1, 'price': 10.0, 'quantity': 2000},
+                {'ticker_id': 2, 'price': 5.0, 'quantity': 6000},
+                {'ticker_id': 1, 'price': 10.0, 'quantity': 3000}]
+        # 80% is held in tickers 1 and 2, so 50000 of ticker 1 needs selling, which is both its lots.
+        _sell_due_to_drift(lots, 1, goal, {1, 2}, metric)
+        self.assertListEqual([lot['quantity'] for lot in lots], [0, 6000, 0])
+
+        lots[2]['quantity'] = 3000
+        lots[0]['quantity'] = 2000
+        metric.configured_val = 0.7
+        _sell_due_to_drift(lots, 1, goal, {1, 2}, metric)
+        self.assertListEqual([lot['quantity'] for lot in lots], [1000, 6000, 3000])
+
+    def test_prefetch_rebalance_data(self):
+        TransactionFactory.create(from_goal=self.goal, status=Transaction.STATUS_PENDING, amount=50)
+        expected_lots = [dict(lot) for lot in get_tax_lots(self.goal)]
+        expected_positions = sorted(self.goal.get_positions_all(), key=lambda p: p['ticker_id'])
+        expected_balance = self.goal.available_balance
+
+        index = prefetch_rebalance_data([self.goal])
+        self.assertTrue(index.has_goal(self.goal.id))
+        self.assertFalse(index.has_goal(self.goal.id + 1))
+        self.assertListEqual(sorted(lot['id'] for lot in index.lots(self.goal.id)),
+                             sorted(lot['id'] for lot in expected_lots))
+        self.assertAlmostEqual(get_available_balance(self.goal), expected_balance)
+        self.assertListEqual([(p['ticker_id'], p['quantity']) for p in get_positions(self.goal)],
+                             [(p['ticker_id'], p['quantity']) for p in expected_positions])
+        lots = get_tax_lots(self.goal)
+        self.assertListEqual([lot['id'] for lot in lots], [lot['id'] for lot in expected_lots])
+        self.assertListEqual([lot['unit_tax_cost'] for lot in lots], [lot['unit_tax_cost'] for lot in expected_lots])
+
+    def test_write_rebalance_orders(self):
+        prefetch_rebalance_data([self.goal])
+        # Sell all the SPY, buy 3 more TIP and keep the rest.
+        new_positions = {self.t2.id: 5, self.t3.id: 8, self.t4.id: 10}
+        orders = write_rebalance_orders([self.goal],
+                                        {self.goal.id: (new_positions, ExecutionRequest.Reason.DRIFT.value)})
+        self.assertEqual(len(orders), 1)
+        requests = ExecutionRequest.objects.filter(order=orders[0])
+        self.assertDictEqual({r.asset_id: r.volume for r in requests}, {self.t1.id: -5, self.t3.id: 3})
+
+    @mock.patch('main.management.commands.rebalance.get_rebalance_weights',
+                MagicMock(return_value=({}, ExecutionRequest.Reason.DRIFT.value)))
+    def test_rebalance_goals(self):
+        # With nothing to hold any more, everything is sold.
+        orders, errors, timings = rebalance_goals([self.goal], self.idata, self.data_provider,
+                                                  self.execution_provider)
+        self.assertDictEqual(errors, {})
+        self.assertSetEqual(set(timings), {'prefetch', 'optimise', 'write'})
+        # The batch's lots aren't used once the rebalance is done.
+        self.assertIsNone(self.execution_provider.tax_lots)
+        self.assertEqual(len(orders), 1)
+        requests = ExecutionRequest.objects.filter(order=orders[0])
+        self.assertDictEqual({r.asset_id: r.volume for r in requests},
+                             {self.t1.id: -5, self.t2.id: -5, self.t3.id: -5, self.t4.id: -10})
+
+    def test_rebalance_command(self):
+        self.goal.active_settings = self.goal.approved_settings
+        self.goal.save()
+        off = GoalFactory.create(approved_settings=GoalSettingFactory.create(),
+                                 active_settings=GoalSettingFactory.create(rebalance=False))
+        selected = []
+
+        def rebalance(goals, **kwargs):
+            selected.extend(goal.id for goal in goals)
+            return [], {}, {}
+
+        with mock.patch('main.management.commands.rebalance.rebalance_goals', rebalance):
+            call_command('rebalance')
+        self.assertIn(self.goal.id, selected)
+        self.assertNotIn(off.id, selected)
+
     @mock.patch.object(timezone, 'now', MagicMock(return_value=mocked_now))
     def setup_performance_history(self):
         populate_prices(400, asof=mocked_now)
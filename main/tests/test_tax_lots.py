@@ -0,0 +1,64 @@
+from datetime import datetime
+
+from django.test import TestCase
+from django.utils import timezone
+
+from api.v1.tests.factories import GoalFactory, TickerFactory
+from main.models import PositionLot
+from main.tax_lots import TaxLotIndex
+from main.tests.fixture import Fixture1
+from portfolios.providers.execution.django import ExecutionProviderDjango
+
+
+class TaxLotIndexTest(TestCase):
+    def setUp(self):
+        self.ticker = TickerFactory.create(unit_price=10)
+        self.goal = GoalFactory.create()
+        self.other_goal = GoalFactory.create()
+        self.now = timezone.make_aware(datetime(2016, 6, 1))
+        # An old lot bought low, a recent one bought low, and a recent one bought high.
+        self.old_lot = Fixture1.create_execution_details(self.goal, self.ticker, 10, 5,
+                                                         timezone.make_aware(datetime(2015, 1, 1)))[4]
+        self.new_lot = Fixture1.create_execution_details(self.goal, self.ticker, 10, 5,
+                                                         timezone.make_aware(datetime(2016, 1, 1)))[4]
+        self.high_lot = Fixture1.create_execution_details(self.goal, self.ticker, 10, 12,
+                                                          timezone.make_aware(datetime(2016, 2, 1)))[4]
+        self.other_lot = Fixture1.create_execution_details(self.other_goal, self.ticker, 10, 20,
+                                                           timezone.make_aware(datetime(2016, 2, 1)))[4]
+
+    def test_lots_ordered_by_tax_cost(self):
+        index = TaxLotIndex.load(goal_ids=[self.goal.id], now=self.now)
+        self.assertListEqual([lot['id'] for lot in index.lots(self.goal.id, self.ticker.id)],
+                             [self.high_lot.id, self.old_lot.id, self.new_lot.id])
+        # Below every entry price, the recent losses save the most tax.
+        self.assertListEqual([lot['id'] for lot in index.lots(self.goal.id, self.ticker.id, price=1)],
+                             [self.high_lot.id, self.new_lot.id, self.old_lot.id])
+
+    def test_sell(self):
+        index = TaxLotIndex.load(now=self.now)
+        sold = index.sell(self.goal.id, self.ticker.id, 15, 10)
+        self.assertListEqual([(lot['id'], quantity) for lot, quantity in sold],
+                             [(self.high_lot.id, 10), (self.old_lot.id, 5)])
+        self.assertListEqual([(lot['id'], lot['quantity']) for lot in index.lots(self.goal.id, self.ticker.id)],
+                             [(self.old_lot.id, 5), (self.new_lot.id, 10)])
+        # The other goal's lot wasn't touched, even though it costs the least tax.
+        self.assertEqual(index.lots(self.other_goal.id, self.ticker.id)[0]['quantity'], 10)
+        self.assertEqual(PositionLot.objects.get(id=self.high_lot.id).quantity, 10)
+
+    def test_values_bought_since(self):
+        index = TaxLotIndex.load(now=self.now)
+        values = index.values_bought_since(self.goal.id, timezone.make_aware(datetime(2015, 6, 1)))
+        self.assertDictEqual(values, {self.ticker.id: 200})
+
+    def test_has_goal(self):
+        self.assertTrue(TaxLotIndex.load().has_goal(self.other_goal.id))
+        self.assertTrue(TaxLotIndex.load(goal_ids=[self.goal.id]).has_goal(self.goal.id))
+        self.assertFalse(TaxLotIndex.load(goal_ids=[self.goal.id]).has_goal(self.other_goal.id))
+        # Limited to some tickers, the index can't stand in for any goal's lots.
+        self.assertFalse(TaxLotIndex.load(goal_ids=[self.goal.id], ticker_ids=[self.ticker.id]).has_goal(self.goal.id))
+
+    def test_provider_loads_goals_not_in_its_index(self):
+        provider = ExecutionProviderDjango(tax_lots=TaxLotIndex.load(goal_ids=[self.goal.id]))
+        self.assertIs(provider._tax_lots(self.goal), provider.tax_lots)
+        lots = provider._tax_lots(self.other_goal)
+        self.assertListEqual([lot['id'] for lot in lots.lots(self.other_goal.id)], [self.other_lot.id])
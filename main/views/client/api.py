@@ -15,6 +15,7 @@ from main.constants import PERFORMER_GROUP_STRATEGY
 from main.models import AssetClass, AssetFeature, Goal, Performer, \
     PortfolioSet, RecurringTransaction, SymbolReturnHistory, \
     Transaction
+from main.positions import asset_class_positions
 from main.views.base import ClientView
 from portfolios.calculation import calculate_portfolios
 from portfolios.exceptions import OptimizationException
@@ -242,8 +243,9 @@ class ClientAccountPositions(ClientView, TemplateView):
         target_portfolio = goal.target_portfolio
         allocations = target_portfolio["allocations"]
 
+        gtb = goal.total_balance
         positions = []
-        for asset in goal.portfolio_set.asset_classes.all():
+        for asset, tickers in asset_class_positions(goal):
             asset_total_value = 0
             new_p = dict()
 
@@ -255,8 +257,9 @@ class ClientAccountPositions(ClientView, TemplateView):
             }
 
             new_p["tickerPositions"] = []
-            for ticker in asset.tickers.all():
-                asset_total_value += ticker.value(goal)
+            for ticker, position in tickers:
+                shares, value = (0, 0) if position is None else (position['quantity'], position['value'])
+                asset_total_value += value
                 new_t = {
                     "ticker": {
                         "id": ticker.pk,
@@ -269,8 +272,8 @@ class ClientAccountPositions(ClientView, TemplateView):
                         "primary": ticker.primary
                     },
                     "position": {
-                        "shares": ticker.shares(goal),
-                        "value": ticker.value(goal)
+                        "shares": shares,
+                        "value": value
                     }
                 }
                 new_p["tickerPositions"].append(new_t)
@@ -283,8 +286,6 @@ class ClientAccountPositions(ClientView, TemplateView):
             else:
                 new_p["allocation"] = 0
 
-            gtb = goal.total_balance
-
             if gtb != 0:
                 real_allocation = asset_total_value / (1.0 * gtb)
                 new_p["drift"] = real_allocation - new_p["allocation"]
@@ -14,8 +14,10 @@ from operator import itemgetter
 from django.utils import timezone
 
 from client.models import Client
+from main.analytics import EMPTY_ADVISOR, advisor_goals, get_firm_analytics
 from main.constants import (INVITATION_ADVISOR, INVITATION_SUPERVISOR,
                             INVITATION_TYPE_DICT)
+from main.finance import cached_mod_dietz_rates
 from main.forms import BetaSmartzGenericUserSignupForm, EmailInvitationForm
 from main.models import (Advisor, EmailInvitation, Goal, GoalMetric, GoalType,
                          Supervisor, Transaction, User, PositionLot, Ticker)
@@ -407,6 +409,7 @@ class FirmAnalyticsMixin(object):
         data = []
         goal_types = GoalType.objects.all()
         today = datetime.today()
+        balances = qs_goals.balances()
         for goal_type in goal_types:
             total_max_age = 0
             total_max_value = 0
@@ -425,7 +428,7 @@ class FirmAnalyticsMixin(object):
                     target_balance = goal.selected_settings.target
                 else:
                     target_balance = 0
-                max_value = max(goal.total_balance, target_balance)
+                max_value = max(balances[goal.id]['total'], target_balance)
                 total_max_age = max(total_max_age, max_age)
                 total_max_value = max(total_max_value, max_value)
 
@@ -730,11 +733,14 @@ class FirmOverview(TemplateView, LegalView):
             sq = Q(user__first_name__icontains=self.search)
             pre_advisors = pre_advisors.filter(sq)
 
+        analytics = get_firm_analytics(self.firm)['advisors']
+        returns = cached_mod_dietz_rates('advisor', advisor_goals(self.firm))
         advisors = []
-        for advisor in set(pre_advisors.distinct().all()):
+        for advisor in set(pre_advisors.select_related('user').distinct().all()):
+            figures = analytics.get(advisor.pk, EMPTY_ADVISOR)
             advisors.append(
-                [advisor.pk, advisor, advisor.user.full_name, advisor.total_balance,
-                 advisor.average_return, advisor.total_fees, advisor.user.date_joined])
+                [advisor.pk, advisor, advisor.user.full_name, figures['total_balance'],
+                 returns.get(advisor.pk, 0), figures['total_fees'], advisor.user.date_joined])
 
         reverse = self.sort_dir != "asc"
 
@@ -14,3 +14,12 @@ os.environ.setdefault("DJANGO_SETTINGS_MODULE", "main.settings")
 from django.core.wsgi import get_wsgi_application
 
 application = get_wsgi_application()
+
+# Load the inflation index before the first request needs it. uwsgi loads the app once and forks the workers from it,
+# so the connection used to load it is closed rather than shared by the workers, which each open their own.
+from django.db import connections
+from main.inflation import warm_index
+
+warm_index()
+for connection in connections.all():
+    connection.close()
@@ -1,8 +1,21 @@
+import logging
+
 import numpy as np
 from cvxpy import Variable, Minimize, quad_form, sum_entries, Problem
 import cvxpy
 
-from portfolios.exceptions import OptimizationFailed
+from portfolios.algorithms.qp import markowitz_native
+from portfolios.exceptions import OptimizationFailed, QPNotSupported
+
+logger = logging.getLogger(__name__)
+
+# Solve with the NumPy active set solver, falling back to cvxpy for anything it can't handle.
+BACKEND_NATIVE = 'native'
+# Always solve with cvxpy and CVXOPT.
+BACKEND_CVXPY = 'cvxpy'
+
+# The backend markowitz_optimizer_3 uses when one isn't given.
+DEFAULT_BACKEND = BACKEND_NATIVE
 
 
 def markowitz_optimizer(mu, sigma, lam=1):
@@ -74,7 +87,7 @@ def markowitz_optimizer_2(mu, sigma, m, alpha, lam=1):
     return np.array(x.value).flatten()  # return optimal weights
 
 
-def markowitz_optimizer_3(xs, sigma, lam, mu, constraints):
+def markowitz_optimizer_3(xs, sigma, lam, mu, constraints, backend=None):
     """
     Optimise against a set of pre-constructed constraints
     :param xs: The variables to optimise
@@ -82,19 +95,50 @@ def markowitz_optimizer_3(xs, sigma, lam, mu, constraints):
     :param lam: Risk tolerance factor
     :param mu: 1xn numpy array of expected asset returns
     :param constraints: List of constrains to optimise with respect to.
+    :param backend: BACKEND_NATIVE or BACKEND_CVXPY. Defaults to DEFAULT_BACKEND
     :return: (weights, cost)
              - weights: The calculated weight vector of each asset
              - cost: The total cost of this portfolio.
                      Useful for ranking optimisation outputs
     """
-    # define Markowitz mean/variance objective function
-    objective = Minimize(quad_form(xs, sigma) - lam * mu * xs)
-    p = Problem(objective, constraints)  # create optimization problem
+    if (backend or DEFAULT_BACKEND) == BACKEND_NATIVE:
+        try:
+            return markowitz_native(xs, sigma, lam, mu, constraints)
+        except QPNotSupported as e:
+            logger.debug("Falling back to cvxpy: {}".format(e))
 
-    res = p.solve(solver=cvxpy.CVXOPT)  # solve problem
+    return solve_markowitz_problem(markowitz_problem(xs, sigma, lam, mu, constraints), xs)
+
+
+def markowitz_problem(xs, sigma, lam, mu, constraints):
+    """
+    Build the cvxpy problem for the Markowitz mean/variance objective without solving it.
+    lam and any constraint bounds may be cvxpy Parameters, so the same problem can be re-solved many times by
+    updating the parameter values rather than rebuilding the objective and constraints.
+    :param xs: The variables to optimise
+    :param sigma: nxn covariance matrix between asset return time series
+    :param lam: Risk tolerance factor, either a number or a cvxpy Parameter
+    :param mu: 1xn numpy array of expected asset returns
+    :param constraints: List of constrains to optimise with respect to.
+    :return: The cvxpy Problem
+    """
+    # define Markowitz mean/variance objective function.
+    # mu * xs is grouped first so lam can be a scalar Parameter as well as a number.
+    objective = Minimize(quad_form(xs, sigma) - lam * (mu * xs))
+    return Problem(objective, constraints)  # create optimization problem
+
+
+def solve_markowitz_problem(problem, xs):
+    """
+    Solve a problem built by markowitz_problem using the current values of any of its parameters.
+    :param problem: The cvxpy Problem to solve
+    :param xs: The variables of the problem
+    :return: (weights, cost) as for markowitz_optimizer_3
+    """
+    res = problem.solve(solver=cvxpy.CVXOPT)  # solve problem
     # If it was not solvable, fail
     if type(res) == str:
-        raise OptimizationFailed(res + '\nstatus:' + str(p.status))
+        raise OptimizationFailed(res + '\nstatus:' + str(problem.status))
 
     if xs.get_data()[0] == 1:
         weights = np.array([[xs.value]])
@@ -107,6 +151,27 @@ def markowitz_optimizer_3(xs, sigma, lam, mu, constraints):
         return weights, res
 
 
+def solve_markowitz(problem, xs, sigma, lam, mu, backend=None):
+    """
+    Solve a problem built by markowitz_problem, using the native backend where it can and falling back to cvxpy as
+    markowitz_optimizer_3 does. The cvxpy fallback re-solves the already built problem rather than building a new one.
+    :param problem: The cvxpy Problem from markowitz_problem(xs, sigma, lam, mu, constraints)
+    :param xs: The variables of the problem
+    :param sigma: The sigma the problem was built with
+    :param lam: The lam the problem was built with, either a number or a cvxpy Parameter
+    :param mu: The mu the problem was built with
+    :param backend: BACKEND_NATIVE or BACKEND_CVXPY. Defaults to DEFAULT_BACKEND
+    :return: (weights, cost) as for markowitz_optimizer_3
+    """
+    if (backend or DEFAULT_BACKEND) == BACKEND_NATIVE:
+        try:
+            return markowitz_native(xs, sigma, lam, mu, problem.constraints)
+        except QPNotSupported as e:
+            logger.debug("Falling back to cvxpy: {}".format(e))
+
+    return solve_markowitz_problem(problem, xs)
+
+
 def markowitz_cost(ws, sigma, lam, mu):
     """
     Calculate the markowitz cost of a particular portfolio configuration
@@ -0,0 +1,152 @@
+import numpy as np
+
+# The last this many choices are scored together as a batch of every combination, rather than branched on.
+ALIGNMENT_BATCH_BITS = 12
+
+# The most branch and bound nodes we visit before settling for the best combination found so far.
+# Problems up to about 22 assets finish well within this, so their result is exact.
+MAX_ALIGNMENT_NODES = 5000
+
+# Maximum local search improvement rounds.
+MAX_LOCAL_SEARCH_ROUNDS = 1000
+
+
+def min_cost_alignment(weights, indices, lows, highs, sigma, lam, mu, max_weight):
+    """
+    Choose for each asset in indices to round its weight down to the low or up to the high value, minimising the
+    Markowitz cost of the resulting portfolio while keeping the sum of the weights at or below max_weight.
+
+    The Markowitz cost is quadratic in the choices, so it is expanded once around the all rounded down portfolio.
+    Every combination can then be scored with a couple of small matrix products instead of a full cost calculation.
+    A local search gives a good starting combination, then a branch and bound over the choices, scoring the last
+    ALIGNMENT_BATCH_BITS choices as one batch at each leaf, improves on it. Branches are pruned when over budget or
+    when they can't beat the best combination found so far.
+
+    :param weights: A length n numpy array of the portfolio weights. The entries at indices are replaced.
+    :param indices: The positions of the weights to round.
+    :param lows: The rounded down weight for each index.
+    :param highs: The rounded up weight for each index.
+    :param sigma: nxn covariance matrix between asset return time series
+    :param lam: Risk tolerance factor
+    :param mu: A length n numpy array of expected asset returns
+    :param max_weight: The largest total weight allowed.
+    :return: The new length n weights array, or None if no combination fits within max_weight.
+    """
+    weights = np.array(weights, dtype=float)
+    indices = np.asarray(indices, dtype=int)
+    lows = np.asarray(lows, dtype=float)
+    deltas = np.asarray(highs, dtype=float) - lows
+    weights[indices] = lows
+    k = len(indices)
+    if k == 0:
+        return weights if np.sum(weights) <= max_weight else None
+
+    # cost(base + D.b) = cost(base) + c.b + b'Qb for the choice vector b of 0 (round down) or 1 (round up).
+    grad = 2 * sigma.dot(weights) - lam * mu
+    c = deltas * grad[indices]
+    Q = np.outer(deltas, deltas) * sigma[np.ix_(indices, indices)]
+    room = max_weight - np.sum(weights)
+
+    choice = _local_search_choice(c, Q, deltas, room)
+    if choice is None:
+        return None
+
+    # Branching on the choices with the largest linear effect first prunes the most.
+    order = np.argsort(-np.abs(c), kind='mergesort')
+    ordered = _branch_and_bound_choice(c[order], Q[np.ix_(order, order)], deltas[order], room, choice[order])
+    choice[order] = ordered
+
+    weights[indices] += deltas * choice
+    return weights
+
+
+def _branch_and_bound_choice(c, Q, deltas, room, incumbent):
+    """
+    Depth first branch and bound over the choices, starting from a known within budget combination.
+    The quadratic part of the cost is never negative as Q is positive semidefinite, so the cost of any completion of a
+    branch is at least its fixed cost plus the negative parts of the remaining linear terms.
+    :return: The best choice vector found.
+    """
+    k = len(c)
+    bits = min(k, ALIGNMENT_BATCH_BITS)
+    prefix = k - bits
+
+    # Every combination of the batched choices, with their own quadratic cost and budget use.
+    masks = np.arange(2 ** bits)
+    batch = ((masks[:, None] >> np.arange(bits)) & 1).astype(float)
+    batch_quad = (batch.dot(Q[prefix:, prefix:]) * batch).sum(axis=1)
+    batch_spend = batch.dot(deltas[prefix:])
+
+    best = [incumbent.dot(c) + incumbent.dot(Q).dot(incumbent), incumbent]
+    fixed = np.zeros(k)
+    nodes = [0]
+
+    def branch(j, cost, spend):
+        nodes[0] += 1
+        if spend > room or nodes[0] > MAX_ALIGNMENT_NODES:
+            return
+        # The linear cost of each remaining choice, given the choices fixed so far.
+        lin = c[j:] + 2 * Q[j:, :j].dot(fixed[:j])
+        if cost + np.minimum(lin, 0).sum() >= best[0]:
+            return
+        if j == prefix:
+            costs = cost + batch.dot(lin) + batch_quad
+            costs[spend + batch_spend > room] = np.inf
+            ix = np.argmin(costs)
+            if costs[ix] < best[0]:
+                choice = fixed.copy()
+                choice[prefix:] = batch[ix]
+                best[:] = [costs[ix], choice]
+            return
+        # Try the cheaper choice first.
+        for val in ((1, 0) if lin[0] + Q[j, j] < 0 else (0, 1)):
+            fixed[j] = val
+            branch(j + 1, cost + val * (lin[0] + Q[j, j]), spend + val * deltas[j])
+        fixed[j] = 0
+
+    branch(0, 0.0, 0.0)
+    return best[1]
+
+
+def _local_search_choice(c, Q, deltas, room):
+    """
+    Start by rounding up every weight where that alone lowers the cost, drop round ups until within budget, then
+    repeatedly apply the best improving single flip or up/down swap until none is left.
+    :return: The chosen vector or None if even rounding everything down is over budget.
+    """
+    if room < 0:
+        return None
+    diag = np.diag(Q)
+
+    def flip_gains(b):
+        # Change in cost from flipping each choice on its own.
+        s = 1 - 2 * b
+        return s * c + 2 * s * Q.dot(b) + diag, s
+
+    # Round up where the up move costs less than staying down, as long as there's room.
+    b = (c + diag < 0).astype(float)
+    while b.dot(deltas) > room:
+        gains, s = flip_gains(b)
+        ups = np.nonzero(b)[0]
+        b[ups[np.argmin(gains[ups])]] = 0
+
+    for _ in range(MAX_LOCAL_SEARCH_ROUNDS):
+        gains, s = flip_gains(b)
+        spare = room - b.dot(deltas)
+        single = np.where(s * deltas <= spare, gains, np.inf)
+        # Pair moves, flipping j and l together.
+        pair = gains[:, None] + gains[None, :] + 2 * np.outer(s, s) * Q
+        pair_fits = (s * deltas)[:, None] + (s * deltas)[None, :] <= spare
+        pair = np.where(pair_fits, pair, np.inf)
+        np.fill_diagonal(pair, np.inf)
+
+        j = np.argmin(single)
+        jl = np.unravel_index(np.argmin(pair), pair.shape)
+        if min(single[j], pair[jl]) >= -1e-15:
+            break
+        if single[j] <= pair[jl]:
+            b[j] = 1 - b[j]
+        else:
+            b[jl[0]] = 1 - b[jl[0]]
+            b[jl[1]] = 1 - b[jl[1]]
+    return b
@@ -0,0 +1,301 @@
+import numpy as np
+import scipy.sparse as sp
+from cvxpy.constraints import EqConstraint, LeqConstraint
+from cvxpy.lin_ops import lin_op as lo
+
+from portfolios.exceptions import QPNotSupported
+
+# The largest problem we solve natively. Above this the dense linear algebra stops being cheaper than cvxpy.
+MAX_NATIVE_VARIABLES = 100
+
+# Constraint violation we accept in a native solution.
+FEASIBILITY_TOLERANCE = 1e-8
+
+# Numerical zero used inside the active set iterations.
+_EPS = 1e-12
+
+# Coefficients of parameter free constraints, keyed on the constraint id. The constraint is kept in the entry so its id
+# can't be reused by another constraint while it's cached.
+_coefficient_cache = {}
+_MAX_CACHED_CONSTRAINTS = 1000
+
+# The LinOp types holding a constant or parameter value in their data.
+_CONSTANT_OPS = (lo.SCALAR_CONST, lo.DENSE_CONST, lo.SPARSE_CONST, lo.PARAM)
+
+
+def solve_qp(G, a, C_eq, b_eq, C_in, b_in, max_iter=None):
+    """
+    Minimise 1/2 x'Gx - a'x subject to C_eq x == b_eq and C_in x >= b_in.
+
+    Uses the dual active set method of Goldfarb and Idnani, which starts from the unconstrained minimum and adds the
+    most violated constraint on each step, so it needs no feasible starting point and detects infeasibility directly.
+    The factorisations are recomputed on every step rather than updated, which is fine for the small dense problems
+    we have.
+
+    :param G: nxn positive definite matrix
+    :param a: length n vector
+    :param C_eq: mxn matrix of equality constraint coefficients
+    :param b_eq: length m vector of equality constraint values
+    :param C_in: kxn matrix of inequality constraint coefficients
+    :param b_in: length k vector of inequality constraint lower bounds
+    :param max_iter: Maximum number of active set changes. Defaults to 10 times the number of constraints.
+    :raises QPNotSupported: If G is not positive definite, the equality constraints are linearly dependent, or we
+                            didn't converge.
+    :return: The optimal x, or None if the constraints are infeasible.
+    """
+    n = len(a)
+    try:
+        L = np.linalg.cholesky(G)
+    except np.linalg.LinAlgError:
+        raise QPNotSupported("Quadratic term is not positive definite")
+    Linv = np.linalg.inv(L)
+
+    meq = len(b_eq)
+    C = np.vstack([np.reshape(C_eq, (meq, n)), np.reshape(C_in, (len(b_in), n))])
+    b = np.concatenate([b_eq, b_in]).astype(float)
+    m = len(b)
+    scale = 1.0 + np.abs(b)
+    if max_iter is None:
+        max_iter = 10 * (m + 1)
+
+    # Unconstrained minimum
+    x = Linv.T.dot(Linv.dot(a))
+
+    # The active set as (constraint index, sign applied to the constraint), and their multipliers.
+    active = []
+    u = np.zeros(0)
+
+    for _ in range(max_iter):
+        in_active = set(ix for ix, _ in active)
+        s = C.dot(x) - b
+
+        # Pick the constraint to add. Equalities go in first, with whatever sign makes them violated.
+        p = None
+        for ix in range(meq):
+            if ix not in in_active:
+                p = ix
+                sign = -1.0 if s[ix] > 0 else 1.0
+                break
+        if p is None:
+            candidates = [ix for ix in range(meq, m) if ix not in in_active]
+            if candidates:
+                ix = min(candidates, key=lambda i: s[i] / scale[i])
+                if s[ix] < -FEASIBILITY_TOLERANCE * scale[ix]:
+                    p = ix
+                    sign = 1.0
+        if p is None:
+            return x
+
+        n_p = sign * C[p]
+        u_p = 0.0
+        while True:
+            q = len(active)
+            if q:
+                N = np.array([sg * C[ix] for ix, sg in active]).T
+                Q, R = np.linalg.qr(Linv.dot(N), mode='complete')
+                R = R[:q]
+                J = Linv.T.dot(Q)
+            else:
+                J = Linv.T
+            d = J.T.dot(n_p)
+            # Step direction in the primal, and the change in the active multipliers.
+            z = J[:, q:].dot(d[q:])
+            # Linearly dependent active constraints, such as repeated equalities, leave R singular.
+            if q and np.min(np.abs(np.diag(R))) <= _EPS * max(np.max(np.abs(R)), 1.0):
+                raise QPNotSupported("Active constraints are linearly dependent")
+            try:
+                r = np.linalg.solve(R, d[:q]) if q else np.zeros(0)
+            except np.linalg.LinAlgError:
+                raise QPNotSupported("Active constraints are linearly dependent")
+
+            # Largest step before an active inequality's multiplier goes negative.
+            t1 = np.inf
+            k = None
+            for j, (ix, _) in enumerate(active):
+                if ix >= meq and r[j] > _EPS:
+                    ratio = u[j] / r[j]
+                    if ratio < t1:
+                        t1 = ratio
+                        k = j
+
+            # Step to satisfy the new constraint.
+            zn = z.dot(n_p)
+            if zn <= _EPS and p < meq:
+                # An equality depending on the active ones, which the step can't satisfy or make active.
+                raise QPNotSupported("Equality constraints are linearly dependent")
+            s_p = n_p.dot(x) - sign * b[p]
+            t2 = -s_p / zn if zn > _EPS else np.inf
+
+            t = min(t1, t2)
+            if np.isinf(t):
+                return None
+            if np.isfinite(t2):
+                x = x + t * z
+            u = u - t * r
+            u_p += t
+
+            if t2 <= t1:
+                active.append((p, sign))
+                u = np.append(u, u_p)
+                break
+            # Drop the blocking constraint and try again for p.
+            del active[k]
+            u = np.delete(u, k)
+
+    raise QPNotSupported("Active set iterations did not converge")
+
+
+def linear_constraints(xs, constraints):
+    """
+    Extract the linear coefficients of cvxpy constraints on a single variable.
+    :param xs: The n length cvxpy variable the constraints are on.
+    :param constraints: List of cvxpy constraints
+    :raises QPNotSupported: If any constraint isn't an affine equality or inequality purely on xs.
+    :return: (C_eq, b_eq, C_in, b_in) such that the constraints are C_eq x == b_eq and C_in x >= b_in
+    """
+    n = xs.size[0]
+    eq_rows, eq_vals, in_rows, in_vals = [], [], [], []
+    for constraint in constraints:
+        if type(constraint) not in (EqConstraint, LeqConstraint):
+            raise QPNotSupported("Unsupported constraint type: {}".format(type(constraint)))
+        expr = constraint._expr
+        if not expr.is_affine() or any(v.id != xs.id for v in expr.variables()):
+            raise QPNotSupported("Constraint is not affine in the optimisation variables: {}".format(constraint))
+        A, c = _cached_coefficients(xs, n, constraint)
+        if type(constraint) is EqConstraint:
+            # A x + c == 0
+            eq_rows.append(A)
+            eq_vals.append(-c)
+        else:
+            # A x + c <= 0
+            in_rows.append(-A)
+            in_vals.append(c)
+
+    def stack(rows, vals):
+        if not rows:
+            return np.zeros((0, n)), np.zeros(0)
+        return np.vstack(rows), np.concatenate(vals)
+
+    return stack(eq_rows, eq_vals) + stack(in_rows, in_vals)
+
+
+def _cached_coefficients(xs, n, constraint):
+    entry = _coefficient_cache.get(id(constraint))
+    if entry is not None and entry[0] is constraint:
+        return entry[1]
+    res = _affine_coefficients(xs, n, constraint._expr)
+    # Parameter values can change between solves, so only cache constraints without them.
+    if not constraint._expr.parameters():
+        if len(_coefficient_cache) >= _MAX_CACHED_CONSTRAINTS:
+            _coefficient_cache.clear()
+        _coefficient_cache[id(constraint)] = (constraint, res)
+    return res
+
+
+def _affine_coefficients(xs, n, expr):
+    """
+    Build A and c such that expr == A x + c from the linear operator tree cvxpy canonicalises the expression to, the
+    same tree cvxpy builds its own constraint matrices from.
+    :return: (A, c)
+    """
+    return _lin_op_coefficients(xs, n, expr.canonical_form[0])
+
+
+def _lin_op_coefficients(xs, n, op):
+    """
+    :param op: A cvxpy LinOp affine in xs.
+    :raises QPNotSupported: If the tree uses an operator we don't build coefficients for.
+    :return: (A, c) such that the column major vectorised value of op is A x + c
+    """
+    rows = op.size[0] * op.size[1]
+    if op.type == lo.VARIABLE:
+        if op.data != xs.id:
+            raise QPNotSupported("Constraint is on another variable")
+        return np.eye(n), np.zeros(n)
+    if op.type in _CONSTANT_OPS:
+        return np.zeros((rows, n)), _constant_vector(op, rows)
+
+    args = [_lin_op_coefficients(xs, n, arg) for arg in op.args]
+    if op.type == lo.SUM:
+        return sum(A for A, _ in args), sum(c for _, c in args)
+    A, c = args[0]
+    if op.type == lo.NEG:
+        return -A, -c
+    if op.type == lo.RESHAPE:
+        return A, c
+    if op.type == lo.PROMOTE:
+        return np.repeat(A, rows, axis=0), np.repeat(c, rows)
+    if op.type == lo.SUM_ENTRIES:
+        return A.sum(axis=0, keepdims=True), c.sum(keepdims=True)
+    if op.type == lo.INDEX:
+        select = _vec_indices(op.args[0].size)[op.data].ravel(order='F')
+        return A[select], c[select]
+    if op.type == lo.TRANSPOSE:
+        select = _vec_indices(op.args[0].size).T.ravel(order='F')
+        return A[select], c[select]
+    if op.type in (lo.MUL, lo.RMUL, lo.MUL_ELEM, lo.DIV):
+        if op.data.type not in _CONSTANT_OPS:
+            raise QPNotSupported("Constraint multiplies by a non constant expression")
+        size = op.data.size
+        M = _constant_vector(op.data, size[0] * size[1])
+        if op.type == lo.DIV:
+            return A / M[0], c / M[0]
+        if op.type == lo.MUL_ELEM or len(M) == 1:
+            return M[:, None] * A, M * c
+        M = M.reshape(size, order='F')
+        arg_rows, arg_cols = op.args[0].size
+        # vec(M X) = (I kron M) vec(X) and vec(X M) = (M' kron I) vec(X)
+        T = np.kron(np.eye(arg_cols), M) if op.type == lo.MUL else np.kron(M.T, np.eye(arg_rows))
+        return T.dot(A), T.dot(c)
+    raise QPNotSupported("Unsupported linear operator in constraint: {}".format(op.type))
+
+
+def _constant_vector(op, rows):
+    """
+    :return: The column major vectorised value of a constant or parameter LinOp, promoted to rows entries if scalar.
+    """
+    value = op.data.value if op.type == lo.PARAM else op.data
+    if sp.issparse(value):
+        value = value.toarray()
+    value = np.asarray(value, dtype=float).ravel(order='F')
+    if len(value) == 1 and rows > 1:
+        value = np.repeat(value, rows)
+    return value
+
+
+def _vec_indices(size):
+    """
+    :return: Matrix of the given size holding the column major vector index of each entry.
+    """
+    return np.arange(size[0] * size[1]).reshape(size, order='F')
+
+
+def markowitz_native(xs, sigma, lam, mu, constraints):
+    """
+    Solve the Markowitz problem of markowitz_optimizer_3 without going through cvxpy's canonicalisation.
+    :raises QPNotSupported: If the problem isn't one we can solve natively.
+    :return: (weights, cost) as for markowitz_optimizer_3. All zero weights and an infinite cost if the constraints are
+             infeasible.
+    """
+    n = xs.size[0]
+    if n > MAX_NATIVE_VARIABLES:
+        raise QPNotSupported("Too many variables for the native solver: {}".format(n))
+    sigma = np.asarray(sigma, dtype=float)
+    mu = np.asarray(mu, dtype=float).ravel()
+    lam = float(getattr(lam, 'value', lam))
+
+    C_eq, b_eq, C_in, b_in = linear_constraints(xs, constraints)
+    # quad_form(xs, sigma) is x'Sx, so the Hessian is 2S
+    weights = solve_qp(2 * sigma, lam * mu, C_eq, b_eq, C_in, b_in)
+    if weights is None:
+        # Infeasible, which is reported as the cvxpy path does rather than solving again with cvxpy.
+        return np.zeros(n), np.inf
+
+    if C_eq.shape[0] and np.max(np.abs(C_eq.dot(weights) - b_eq) / (1 + np.abs(b_eq))) > FEASIBILITY_TOLERANCE:
+        raise QPNotSupported("Native solution does not meet the equality constraints")
+    if C_in.shape[0] and np.min((C_in.dot(weights) - b_in) / (1 + np.abs(b_in))) < -FEASIBILITY_TOLERANCE:
+        raise QPNotSupported("Native solution does not meet the inequality constraints")
+
+    xs.value = weights.reshape((n, 1))
+    cost = weights.dot(sigma).dot(weights) - lam * mu.dot(weights)
+    return weights, cost
@@ -1,14 +1,18 @@
+import hashlib
 import logging
 import math
-import sys
 from collections import defaultdict
+from multiprocessing import Pool
 import numpy as np
 import pandas as pd
 
-from cvxpy import Variable, sum_entries
+from cvxpy import Parameter, Variable, sum_entries
+from django import db
 from django.conf import settings as sys_settings
-from main.models import Ticker, MarketIndex
-from portfolios.algorithms.markowitz import markowitz_optimizer_3, markowitz_cost
+from main.models import GoalSetting, Ticker, MarketIndex
+from portfolios.algorithms.markowitz import markowitz_optimizer_3, markowitz_cost, markowitz_problem, \
+    solve_markowitz
+from portfolios.algorithms.orderable import min_cost_alignment
 from portfolios.markowitz_scale import risk_score_to_lambda
 from portfolios.prediction.investment_clock import InvestmentClock as Predictor
 from portfolios.providers.data.django import DataProviderDjango
@@ -36,6 +40,18 @@ MIN_PORTFOLIO_PCT = 0.03
 # Amount we suggest we boost a budget by to make all funds with an original allocation over this amount orderable.
 LMT_PORTFOLIO_PCT = 0.05
 
+# The maximum amount (in whole percent) we relax the model portfolio minimums by before giving up on a risk profile.
+MAX_MODEL_RELAXATION = 99
+
+# The parsed RISK_ALLOCATIONS_ASSET_CLASSES table. It never changes, so it's only parsed once per process.
+_risk_profile_data = None
+
+# (masks key, mask values, column positions, settings masks memo) for the global masks last used by get_settings_masks.
+_masks_memo = None
+
+# The (idata, data_provider, execution_provider) shared with each portfolio worker process when it starts.
+_worker_state = None
+
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.WARN)
 
@@ -116,11 +132,7 @@ def build_instruments(data_provider):
 
 
 def get_instruments(data_provider):
-    data = data_provider.get_instrument_cache()
-    if data is None:
-        data = build_instruments(data_provider)
-        data_provider.set_instrument_cache(data)
-    return data
+    return data_provider.get_or_build_instrument_cache(lambda: build_instruments(data_provider))
 
 
 def get_masks(instruments, data_provider):
@@ -129,40 +141,59 @@ def get_masks(instruments, data_provider):
     :param instruments: Information about the funds in the system.
     :param data_provider: The place to get the data about the asset features and portfolio sets available in the system.
     :return: The masks as a pandas dataframe indexed as the instruments input dataframe, columns for each mask id.
+             The dataframe is backed by a single boolean numpy matrix.
     """
-    masks = pd.DataFrame(False, index=instruments.index, columns=data_provider.get_asset_feature_values_ids())
-
-    # Add the portfolio set masks
-    psid_miloc = {}
-    portfolio_sets_ids = data_provider.get_portfolio_sets_ids()
-    for psid in portfolio_sets_ids:
-        mid = _PORTFOLIO_SET_MASK_PREFIX + str(psid)
-        masks[mid] = False
-        psid_miloc[psid] = masks.columns.get_loc(mid)
-
-    # Add the feature masks
-    fix = instruments.columns.get_loc(INSTRUMENT_TABLE_FEATURES_LABEL) + 1  # Plus 1 for the index entry in the tuple
-    psix = instruments.columns.get_loc(INSTRUMENT_TABLE_PORTFOLIOSETS_LABEL) + 1
-    for ix, row in enumerate(instruments.itertuples()):
-        for fid in row[fix]:
-            masks.iloc[ix, masks.columns.get_loc(fid)] = True
-        for psid in row[psix]:
-            masks.iloc[ix, psid_miloc[psid]] = True
-    return masks
+    columns = list(data_provider.get_asset_feature_values_ids())
+    columns += [_PORTFOLIO_SET_MASK_PREFIX + str(psid) for psid in data_provider.get_portfolio_sets_ids()]
+    col_ix = {mid: ix for ix, mid in enumerate(columns)}
+
+    # Gather the (row, column) of every set entry, then set them all at once.
+    rows = []
+    cols = []
+    features = instruments[INSTRUMENT_TABLE_FEATURES_LABEL].values
+    portfolio_sets = instruments[INSTRUMENT_TABLE_PORTFOLIOSETS_LABEL].values
+    for ix in range(len(instruments)):
+        for fid in features[ix]:
+            rows.append(ix)
+            cols.append(col_ix[fid])
+        for psid in portfolio_sets[ix]:
+            rows.append(ix)
+            cols.append(col_ix[_PORTFOLIO_SET_MASK_PREFIX + str(psid)])
+
+    values = np.zeros((len(instruments), len(columns)), dtype=bool)
+    values[np.array(rows, dtype=int), np.array(cols, dtype=int)] = True
+    return pd.DataFrame(values, index=instruments.index, columns=columns)
+
+
+def _masks_lookup(masks):
+    """
+    :return: (values, column positions, settings masks memo) for the given global masks. Only the memo of the most
+             recently used masks is kept. Masks are told apart by their columns and values rather than the object, as
+             every read of the instrument cache gives a new copy of the same masks.
+    """
+    global _masks_memo
+    values = np.asarray(masks.values, dtype=bool)
+    key = (tuple(masks.columns), values.shape, hashlib.sha1(np.packbits(values).tobytes()).hexdigest())
+    if _masks_memo is None or _masks_memo[0] != key:
+        _masks_memo = (key, values, {mid: ix for ix, mid in enumerate(masks.columns)}, {})
+    return _masks_memo[1:]
 
 
 def get_settings_masks(settings, masks):
     '''
     Removes any funds that do not fit within our metric constraints.
+    The result is memoised per portfolio set and set of metric features, so the returned lists are shared and must not
+    be modified.
     :param settings: The goal.active_settings we want to modify the global masks for
     :param masks: The global asset feature masks
     :return: (settings_symbol_ixs, cvx_masks)
         - settings_symbol_ixs: A list of ilocs into the masks index for the symbols used in this setting.
         - cvx_masks: A dict from mask name to list of indicies in the setting_symbols list that match this mask name.
     '''
-    removals = np.array([False] * len(masks))
+    values, col_ix, memo = _masks_lookup(masks)
 
     # logger.debug("Creating Settings masks from global masks: {}".format(masks))
+    removes = []
     fids = []
     metrics = settings.get_metrics_all()
 
@@ -171,18 +202,23 @@ def get_settings_masks(settings, masks):
             if math.isclose(metric.configured_val, 0.0):
                 # Saying a minimum percentage of 0% is superfluous.
                 if metric.comparison > 0:
-                    removals |= masks[metric.feature.id]
+                    removes.append(metric.feature.id)
                     logger.debug("Removing instruments for feature: {} ".format(metric.feature))
             elif math.isclose(metric.configured_val, 1.0) and metric.comparison == 2:
                 # Saying a maximum percentage of 100% is superfluous
                 pass
             else:
-                if metric.feature.id not in masks.columns:
+                if metric.feature.id not in col_ix:
                     raise Unsatisfiable("The are no funds that satisfy metric: {}".format(metric))
                 fids.append(metric.feature.id)
 
+    key = (settings.goal.portfolio_set.id, tuple(removes), tuple(fids))
+    res = memo.get(key)
+    if res is not None:
+        return res
+
     # Do the removals
-    settings_mask = np.logical_not(removals)
+    settings_mask = np.logical_not(values[:, [col_ix[fid] for fid in removes]].any(axis=1))
     if logger.isEnabledFor(logging.DEBUG):
         logger.debug("Mask for settings: {} after removals: {} ({} items)".format(settings, settings_mask, len(settings_mask.nonzero())))
 
@@ -190,18 +226,21 @@ def get_settings_masks(settings, masks):
         logger.debug("Fund positions: {}".format(settings_mask.nonzero()[0].tolist()))
 
     # Only use the instruments from the specified portfolio set.
-    settings_mask &= masks[_PORTFOLIO_SET_MASK_PREFIX + str(settings.goal.portfolio_set.id)]
+    settings_mask &= values[:, col_ix[_PORTFOLIO_SET_MASK_PREFIX + str(settings.goal.portfolio_set.id)]]
 
     if logger.isEnabledFor(logging.DEBUG):
         logger.debug("Usable positions according to our portfolio: {}".format(settings_mask.nonzero()[0].tolist()))
 
     # Convert a global feature masks mask into an index list suitable for the optimisation variables.
-    cvx_masks = {fid: masks.loc[settings_mask, fid].nonzero()[0].tolist() for fid in fids}
+    settings_values = values[settings_mask]
+    cvx_masks = {fid: settings_values[:, col_ix[fid]].nonzero()[0].tolist() for fid in fids}
 
     if logger.isEnabledFor(logging.DEBUG):
         logger.debug("CVX masks for settings: {}: {}".format(settings, cvx_masks))
 
-    return settings_mask.nonzero()[0].tolist(), cvx_masks
+    res = settings_mask.nonzero()[0].tolist(), cvx_masks
+    memo[key] = res
+    return res
 
 
 def get_core_constraints(nvars):
@@ -415,9 +454,11 @@ def update_expected_return(data, settings_instruments, id_to_ticker):
 
 
 def read_risk_profile_data():
-    #data = pd.read_csv(BASE_DIR + subdir, index_col=0)
-    data = pd.read_json(RISK_ALLOCATIONS_ASSET_CLASSES, convert_axes=False)
-    return data
+    global _risk_profile_data
+    if _risk_profile_data is None:
+        #data = pd.read_csv(BASE_DIR + subdir, index_col=0)
+        _risk_profile_data = pd.read_json(RISK_ALLOCATIONS_ASSET_CLASSES, convert_axes=False)
+    return _risk_profile_data
 
 
 def calculate_portfolio_old(settings, data_provider, execution_provider, idata=None):
@@ -437,8 +478,7 @@ def calculate_portfolio_old(settings, data_provider, execution_provider, idata=N
 
     odata = optimize_settings(settings, idata, data_provider, execution_provider)
     weights, cost, xs, lam, constraints, settings_instruments, settings_symbol_ixs, lcovars = odata
-    # Find the orderable weights. We don't align as it's too cpu intensive ATM.
-    # We do however need to do the 3% cutoff so we don't end up with tiny weights.
+    # Find the orderable weights, including the 3% cutoff so we don't end up with tiny weights.
     weights, cost = make_orderable(weights,
                                    cost,
                                    xs,
@@ -450,7 +490,7 @@ def calculate_portfolio_old(settings, data_provider, execution_provider, idata=N
                                    # We use the current balance (including pending deposits).
                                    settings.goal.current_balance,
                                    settings_instruments['price'],
-                                   align=False)
+                                   align=True)
 
     stats = get_portfolio_stats(settings_instruments, lcovars, weights)
     return stats
@@ -563,60 +603,195 @@ def calculate_portfolio(settings, data_provider, execution_provider, idata=None,
         raise Unsatisfiable("Could not find an appropriate allocation for Risk Profile: {}".format(risk_profile))
         #raise Unsatisfiable('instruments:'+ str(settings_instruments.index.tolist()) +'\nasset_classes:'+ str(settings_instruments[INSTRUMENT_TABLE_ASSET_CLASS_LABEL]) +'\nlen(settings):' + str(len(settings_symbol_ixs)) + '\nrisk_profile:' + str(risk_profile) + '\nac_weights' + str(ac_weights) + '\nticker_per_ac:'+str(ticker_per_ac))
 
-    # Find the orderable weights. We don't align as it's too cpu intensive ATM.
-    # We do however need to do the 3% cutoff so we don't end up with tiny weights.
-
-    '''try: sometimes it gives weird recommendations, so prefer to go without this
-        weights_orderable, cost_orderable = make_orderable(weights,
-                                            cost,
-                                            xs,
-                                            lcovars.values,
-                                            settings_instruments[INSTRUMENT_TABLE_EXPECTED_RETURN_LABEL].values,
-                                            lam,
-                                            constraints,
-                                            settings,
-                                            # We use the current balance (including pending deposits).
-                                            settings.goal.current_balance,
-                                            settings_instruments['price'],
-                                            align=False)
-        if weights_orderable.any():
-            weights = weights_orderable
-            cost = cost_orderable
-    except:
-        pass'''
+    # Find the orderable weights, including the 3% cutoff so we don't end up with tiny weights.
+    # We use the current balance (including pending deposits).
+    weights, cost = orderable_weights(weights, cost, xs, lcovars, mu, lam, constraints, settings,
+                                      settings.goal.current_balance, settings_instruments['price'].values)
 
     stats = get_portfolio_stats(settings_instruments, lcovars, weights)
     return stats
 
 
-def calculate_portfolios(setting, data_provider, execution_provider):
+def get_model_constraint_parameters(settings_instruments, xs):
+    """
+    Creates a model portfolio minimum constraint for every asset class in the settings instruments, with the minimum
+    as a cvxpy Parameter. This lets one problem be re-solved for every risk profile and relaxation by only updating
+    the parameter values (See set_model_constraint_parameters).
+    :param settings_instruments: The instruments table for the settings.
+    :param xs: The cvxpy variables we are optimising.
+    :return: (constraints, params)
+        - constraints: The list of constraints to add to the problem.
+        - params: A dict from asset class name to the Parameter holding the minimum weight for that asset class.
+    """
+    constraints = []
+    params = {}
+    acs = settings_instruments[INSTRUMENT_TABLE_ASSET_CLASS_LABEL]
+    for ac in sorted(set(acs.tolist())):
+        tickers = (acs == ac).nonzero()[0].tolist()
+        param = Parameter(sign='positive')
+        param.value = 0
+        constraints.append(sum_entries(xs[tickers]) >= param)
+        params[ac] = param
+    return constraints, params
+
+
+def set_model_constraint_parameters(params, ac_weights, decrease=0):
+    """
+    Sets the model portfolio minimums to those of a risk profile, relaxed by decrease percent.
+    A minimum that would be relaxed to zero or below is set to zero, which is the same as having no constraint, as the
+    weights are already non-negative. This matches the constraints get_model_constraints would generate.
+    :param params: The params returned from get_model_constraint_parameters
+    :param ac_weights: The asset class weights of the risk profile as returned from build_weights
+    :param decrease: The amount in whole percent to relax every minimum by.
+    """
+    for ac, param in params.items():
+        param.value = max(ac_weights.get(ac, 0) - decrease / 100.0, 0)
+
+
+def _solve_model_relaxed(problem, xs, sigma, lam, mu, params, ac_weights, start=0):
+    """
+    Finds the allocation for the smallest model portfolio relaxation that gives a feasible portfolio.
+    Relaxing only ever lowers the minimums, so feasibility is monotone in the relaxation. This lets us search outwards
+    from the relaxation that worked for the neighbouring risk score rather than stepping up from zero every time,
+    while still finding the same relaxation a linear search from zero would find.
+    :param problem: The problem from markowitz_problem containing the model constraints from params.
+    :param xs: The variables of the problem.
+    :param sigma: The sigma the problem was built with.
+    :param lam: The lam the problem was built with.
+    :param mu: The mu the problem was built with.
+    :param params: The params returned from get_model_constraint_parameters
+    :param ac_weights: The asset class weights of the risk profile
+    :param start: The relaxation to start searching from.
+    :return: (weights, cost, decrease) weights will be None if no relaxation gives a feasible portfolio.
+    """
+    # Relaxing past the largest model weight changes nothing, so that's as far as we need to search.
+    max_weight = max([w for ac, w in ac_weights.items() if ac in params] or [0])
+    limit = min(MAX_MODEL_RELAXATION, int(round(max_weight * 100)))
+    start = min(start, limit)
+    results = {}
+
+    def feasible(decrease):
+        if decrease not in results:
+            set_model_constraint_parameters(params, ac_weights, decrease)
+            results[decrease] = solve_markowitz(problem, xs, sigma, lam, mu)
+        return results[decrease][0].any()
+
+    if feasible(start):
+        # Gallop down to find an infeasible lower bound.
+        lo, hi, step = -1, start, 1
+        while hi > 0:
+            probe = max(hi - step, 0)
+            if feasible(probe):
+                hi = probe
+                step *= 2
+            else:
+                lo = probe
+                break
+    else:
+        # Gallop up to find a feasible upper bound.
+        lo, hi, step = start, None, 1
+        while lo < limit:
+            probe = min(lo + step, limit)
+            if feasible(probe):
+                hi = probe
+                break
+            lo = probe
+            step *= 2
+        if hi is None:
+            return None, None, start
+
+    # Bisect between the infeasible lower bound and the feasible upper bound.
+    while hi - lo > 1:
+        mid = (lo + hi) // 2
+        if feasible(mid):
+            hi = mid
+        else:
+            lo = mid
+
+    weights, cost = results[hi]
+    return weights, cost, hi
+
+
+def get_risk_scores():
+    """
+    :return: The 101 risk scores [0-1] in steps of 0.01 we calculate portfolios for.
+    """
+    return list(np.arange(0, 1.01, 0.01))
+
+
+def calculate_portfolios(setting, data_provider, execution_provider, idata=None, risk_scores=None):
     """
     Calculate a list of 101 portfolios ranging over risk score.
+    The portfolios are the same as calling calculate_portfolio for each risk score, but the settings masks,
+    constraints and cvxpy problem are only built once, with the model portfolio minimums as parameters that are
+    updated for each risk score. Each solve goes through the native backend, falling back to cvxpy. Each portfolio
+    is aligned to orderable quantities for the goal's current balance.
     :param setting: The settig we want to generate portfolios for.
     :param data_provider: Where to get the data
     :param execution_provider:
-    :raises Unsatisfiable: If no single satisfiable portfolio could be found.
+    :param idata: The global instrument data. Fetched from get_instruments if not provided.
+    :param risk_scores: Only calculate the portfolios for these risk scores. Defaults to get_risk_scores()
+    :raises Unsatisfiable: If no satisfiable portfolio could be found for any of the risk scores.
     :return: A list of 101 (risk_score, portfolio) tuples
             - risk_score [0-1] in steps of 0.01
             - portfolio is the same as the return value of calculate_portfolio.
-                portfolio will be None if no satisfiable portfolio could be found for this risk_score
     """
     logger.debug("Calculate Portfolios Requested")
+    if risk_scores is None:
+        risk_scores = get_risk_scores()
     try:
-        idata = get_instruments(data_provider)
+        if idata is None:
+            idata = get_instruments(data_provider)
+        covars, instruments, masks = idata
         if logger.isEnabledFor(logging.DEBUG):
             logger.debug("Got instruments")
 
+        settings_symbol_ixs, cvx_masks = get_settings_masks(settings=setting, masks=masks)
+        if len(settings_symbol_ixs) == 0:
+            raise Unsatisfiable("No assets available for settings: {} given it's constraints.".format(setting))
+
+        xs, constraints = get_core_constraints(len(settings_symbol_ixs))
+        lam, mconstraints = get_metric_constraints(settings=setting,
+                                                   cvx_masks=cvx_masks,
+                                                   xs=xs,
+                                                   overrides=None,
+                                                   data_provider=data_provider)
+        constraints += mconstraints
+
+        settings_instruments = instruments.iloc[settings_symbol_ixs]
+        lcovars = covars.iloc[settings_symbol_ixs, settings_symbol_ixs].values
+        mu = settings_instruments[INSTRUMENT_TABLE_EXPECTED_RETURN_LABEL].values
+
+        model_constraints, model_params = get_model_constraint_parameters(settings_instruments, xs)
+        # As in calculate_portfolio, the lambda comes from the setting, only the model portfolio varies by risk score.
+        lam_param = Parameter()
+        lam_param.value = lam
+        problem = markowitz_problem(xs, lcovars, lam_param, mu, constraints + model_constraints)
+
+        risk_profile_data = read_risk_profile_data()
+        budget = setting.goal.current_balance
+        prices = settings_instruments['price'].values
         portfolios = []
-        for risk_score in list(np.arange(0, 1.01, 0.01)):
-            stats = calculate_portfolio(settings=setting,
-                                        data_provider=data_provider,
-                                        execution_provider=execution_provider,
-                                        idata=idata,
-                                        risk_setting=risk_score)
+        decrease = 0
+        for risk_score in risk_scores:
+            risk_profile = int(risk_score * 100)
+            if risk_profile == 0:
+                risk_profile = 1
+            ac_weights = build_weights(risk_profile_data.ix[:, str(risk_profile)], settings_instruments)
+
+            # Neighbouring risk profiles usually need the same relaxation, so start from the last one.
+            weights, cost, decrease = _solve_model_relaxed(problem, xs, lcovars, lam_param, mu, model_params, ac_weights,
+                                                           start=decrease)
+            if weights is None:
+                raise Unsatisfiable("Could not find an appropriate allocation for Risk Profile: {}".format(risk_profile))
+
+            # The search leaves the parameters at whichever relaxation it tried last, so set the one it found.
+            set_model_constraint_parameters(model_params, ac_weights, decrease)
+            weights, cost = orderable_weights(weights, cost, xs, lcovars, mu, lam, constraints + model_constraints,
+                                              setting, budget, prices)
 
             # Convert to our statistics for our portfolio.
-            portfolios.append((risk_score, stats))
+            portfolios.append((risk_score, get_portfolio_stats(settings_instruments, lcovars, weights)))
     except:
         logger.exception("Problem calculating portfolio for setting: {}".format(setting))
         raise
@@ -624,6 +799,74 @@ def calculate_portfolios(setting, data_provider, execution_provider):
     return portfolios
 
 
+def _init_portfolio_worker(idata, data_provider, execution_provider):
+    global _worker_state
+    # Database connections inherited from the parent process can't be used in the child.
+    for conn in db.connections.all():
+        conn.close()
+    _worker_state = idata, data_provider, execution_provider
+
+
+def _calculate_portfolios_chunk(task):
+    setting_id, risk_scores = task
+    idata, data_provider, execution_provider = _worker_state
+    setting = GoalSetting.objects.get(id=setting_id)
+    try:
+        return calculate_portfolios(setting=setting,
+                                    data_provider=data_provider,
+                                    execution_provider=execution_provider,
+                                    idata=idata,
+                                    risk_scores=risk_scores), None
+    except Unsatisfiable as e:
+        return None, e
+
+
+def calculate_portfolios_parallel(settings, data_provider, execution_provider, workers, chunks=1):
+    """
+    Calculate the 101 risk score portfolios for many settings using a pool of worker processes.
+    The instrument data is built once here and handed to each worker when it starts, rather than with every task.
+    :param settings: The GoalSetting objects to calculate portfolios for.
+    :param data_provider: Where to get the data. Must be picklable, and usable from a worker process.
+    :param execution_provider: Must be picklable, and usable from a worker process.
+    :param workers: The number of worker processes to use.
+    :param chunks: The number of pieces to split the risk scores of each setting into. Use more than 1 when there are
+                   fewer settings than workers.
+    :return: A list of (setting, portfolios, error) in the same order as settings.
+             - portfolios is the return value of calculate_portfolios, or None if the setting was Unsatisfiable.
+             - error is the Unsatisfiable exception if one was raised for the setting, otherwise None.
+    """
+    settings = list(settings)
+    idata = get_instruments(data_provider)
+    score_chunks = [chunk.tolist() for chunk in np.array_split(get_risk_scores(), chunks) if len(chunk) > 0]
+    tasks = [(setting.id, scores) for setting in settings for scores in score_chunks]
+
+    # Don't let the forked workers inherit our open database connections.
+    for conn in db.connections.all():
+        conn.close()
+    pool = Pool(processes=workers,
+                initializer=_init_portfolio_worker,
+                initargs=(idata, data_provider, execution_provider))
+    try:
+        # map returns the results in task order, so the output is deterministic however the work was scheduled.
+        results = pool.map(_calculate_portfolios_chunk, tasks)
+    finally:
+        pool.close()
+        pool.join()
+
+    res = []
+    nchunks = len(score_chunks)
+    for ix, setting in enumerate(settings):
+        portfolios = []
+        error = None
+        for chunk, e in results[ix * nchunks:(ix + 1) * nchunks]:
+            if e is not None:
+                error = e
+                break
+            portfolios.extend(chunk)
+        res.append((setting, None if error else portfolios, error))
+    return res
+
+
 def calculate_portfolios_old(setting, data_provider, execution_provider):
     """
     Calculate a list of 101 portfolios ranging over risk score.
@@ -665,8 +908,7 @@ def calculate_portfolios_old(setting, data_provider, execution_provider):
                 if not weights.any():
                     raise Unsatisfiable("Could not find an appropriate allocation for Settings: {}".format(setting))
 
-                # Find the orderable weights. We don't align as it's too cpu intensive ATM.
-                # We do however need to do the 3% cutoff so we don't end up with tiny weights.
+                # Find the orderable weights, including the 3% cutoff so we don't end up with tiny weights.
                 weights, cost = make_orderable(weights,
                                                cost,
                                                xs,
@@ -678,7 +920,7 @@ def calculate_portfolios_old(setting, data_provider, execution_provider):
                                                # We use the current balance (including pending deposits).
                                                setting.goal.current_balance,
                                                setting_instruments['price'],
-                                               align=False)
+                                               align=True)
 
                 # Convert to our statistics for our portfolio.
                 portfolios.append((risk_score, get_portfolio_stats(setting_instruments,
@@ -771,6 +1013,21 @@ def get_portfolio_stats(instruments, covars, weights):
     return ret_weights, er, variance ** (1 / 2)
 
 
+def orderable_weights(weights, cost, xs, sigma, mu, lam, constraints, settings, budget, prices):
+    """
+    Align the weights to orderable quantities of each asset for the budget, as make_orderable does. If the budget can't
+    buy an orderable portfolio, such as before the goal is funded, the unaligned weights are kept.
+    :return: (weights, cost) as for make_orderable
+    """
+    if budget <= 0:
+        return weights, cost
+    try:
+        return make_orderable(weights, cost, xs, sigma, mu, lam, constraints, settings, budget, prices, align=True)
+    except Unsatisfiable as e:
+        logger.info("Keeping the unaligned portfolio for settings {}: {}".format(settings, e))
+        return weights, cost
+
+
 def make_orderable(weights, original_cost, xs, sigma, mu, lam, constraints, settings, budget, prices, align=True):
     """
     Turn the raw weights into orderable units
@@ -867,7 +1124,8 @@ def make_orderable(weights, original_cost, xs, sigma, mu, lam, constraints, sett
     # Find the minimum Markowitz cost off all the potential portfolio combinations that could be generated from a round
     # up and round down of each fund involved to orderable quantities.
     indicies = []
-    tweights = []
+    lows = []
+    highs = []
     aligned_weight = 0.0  # Weight of the already aligned component.
     for ix, weight in enumerate(weights):
         if inactive[ix]:
@@ -875,34 +1133,20 @@ def make_orderable(weights, original_cost, xs, sigma, mu, lam, constraints, sett
         if aligned(ix):
             aligned_weight += weight
         indicies.append(ix)
-        tweights.append(bordering(ix))
-
-    elems = len(indicies)
-    wts = np.expand_dims(weights, axis=0)
-    mcw = np.copy(wts)
-    if elems > 0:
-        rounds = 2 ** elems
-        min_cost = sys.float_info.max
-        # TODO: This could be done parallel
-        for mask in range(rounds):
-            # Set the weights for this round
-            for pos, tweight in enumerate(tweights):
-                wts[0, indicies[pos]] = tweight[(mask & (1 << pos)) > 0]
-            # Exclude this combination if the sum of the weights is over the 1 (The budget).
-            if (np.sum(wts) + aligned_weight) > 1.00001:
-                continue
-            new_cost = markowitz_cost(wts, sigma, lam, mu)
-            if new_cost < min_cost:
-                mcw = np.copy(wts)
-                min_cost = new_cost
-        wts = mcw
+        low, high = bordering(ix)
+        lows.append(low)
+        highs.append(high)
+
+    # Exclude any combination where the sum of the weights is over the 1 (The budget).
+    wts = min_cost_alignment(weights, indicies, lows, highs, sigma, lam, mu, 1.00001 - aligned_weight)
 
-    if not wts.any():
+    if wts is None or not wts.any():
         emsg = "Could not find an appropriate allocation given ordering constraints for settings: {} "
         raise Unsatisfiable(emsg.format(settings))
 
+    min_cost = markowitz_cost(np.expand_dims(wts, axis=0), sigma, lam, mu)
     logger.info('Ordering cost for settings {}: {}, pre-ordering val: {}'.format(settings.id,
                                                                                  min_cost - original_cost,
                                                                                  original_cost))
 
-    return wts[0], min_cost
+    return wts, min_cost
@@ -7,3 +7,10 @@ class OptimizationException(BaseException):
 
 class OptimizationFailed(Exception):
     pass
+
+
+class QPNotSupported(Exception):
+    """
+    The problem given to the native QP solver isn't one it can solve, and should be solved with cvxpy instead.
+    """
+    pass
@@ -0,0 +1,230 @@
+"""
+A versioned on disk store for the global instrument data (covars, instruments, masks).
+
+Each build is written as a new generation directory of NumPy .npy files plus a small JSON index, and the CURRENT file
+is then atomically switched to name it. Readers memory map the arrays read only, so every process on a host shares the
+same pages instead of each unpickling its own copy from the cache, and can tell whether their copy is stale by reading
+the generation number in CURRENT. Only one process at a time rebuilds the data, under a file lock. While a rebuild is
+running, other processes keep using the previous generation rather than all starting their own build.
+"""
+import fcntl
+import json
+import logging
+import os
+import shutil
+import time
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+CURRENT_FILE = 'CURRENT'
+LOCK_FILE = 'build.lock'
+INDEX_FILE = 'index.json'
+GENERATION_PREFIX = 'gen-'
+
+# How long a generation is used before we rebuild it. Matches the old instrument cache timeout.
+DEFAULT_MAX_AGE = 60 * 60 * 24
+
+# How many generations to keep on disk. Older ones may still be mapped by long running processes.
+KEEP_GENERATIONS = 2
+
+
+class InstrumentStore(object):
+    def __init__(self, path, max_age=DEFAULT_MAX_AGE):
+        self.path = path
+        self.max_age = max_age
+        # (generation, built time, data) of the last generation this process loaded.
+        self._loaded = None
+
+    def current_generation(self):
+        """
+        :return: The generation number of the current data on disk, or None if nothing has been built.
+        """
+        try:
+            with open(os.path.join(self.path, CURRENT_FILE)) as f:
+                return int(f.read().strip())
+        except (IOError, OSError, ValueError):
+            return None
+
+    def is_stale(self, data_generation):
+        """
+        :param data_generation: The generation of the data the caller holds.
+        :return: True if there is a newer generation on disk than the one given.
+        """
+        return self.current_generation() != data_generation
+
+    def load(self):
+        """
+        Get the current data, mapping it from disk if it's not the generation this process last loaded.
+        :return: (generation, built, (covars, instruments, masks)) or None if nothing has been built.
+        """
+        generation = self.current_generation()
+        if generation is None:
+            return None
+        if self._loaded is not None and self._loaded[0] == generation:
+            return self._loaded
+        try:
+            built, data = _read_generation(self._generation_path(generation))
+        except (IOError, OSError, ValueError):
+            logger.exception("Could not load instrument data generation {}".format(generation))
+            return None
+        self._loaded = generation, built, data
+        return self._loaded
+
+    def get(self):
+        """
+        :return: The current (covars, instruments, masks) or None if there is no data, or it is older than max_age.
+        """
+        loaded = self.load()
+        if loaded is None or self._expired(loaded[1]):
+            return None
+        return loaded[2]
+
+    def get_or_build(self, build):
+        """
+        Get the current data, building it if there is none or it has expired.
+        Only one process builds at a time. Others wait for it if they have no data, or carry on with the expired data.
+        :param build: Callable returning a fresh (covars, instruments, masks)
+        :return: (covars, instruments, masks)
+        """
+        loaded = self.load()
+        if loaded is not None and not self._expired(loaded[1]):
+            return loaded[2]
+
+        os.makedirs(self.path, exist_ok=True)
+        with open(os.path.join(self.path, LOCK_FILE), 'w') as lock:
+            try:
+                # Only wait for the builder if we have nothing to hand back in the meantime.
+                fcntl.flock(lock, fcntl.LOCK_EX if loaded is None else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except (IOError, OSError):
+                logger.info("Instrument data is being rebuilt by another process. Using generation {}.".format(
+                    loaded[0]))
+                return loaded[2]
+            try:
+                # Someone may have finished a build while we waited for the lock.
+                loaded = self.load()
+                if loaded is not None and not self._expired(loaded[1]):
+                    return loaded[2]
+                data = build()
+                self._write(data)
+                return data
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def save(self, data):
+        """
+        Write data as a new generation. Takes the builder lock so it can't race with get_or_build.
+        :param data: (covars, instruments, masks)
+        :return: The new generation number.
+        """
+        os.makedirs(self.path, exist_ok=True)
+        with open(os.path.join(self.path, LOCK_FILE), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                return self._write(data)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _expired(self, built):
+        return time.time() - built > self.max_age
+
+    def _generation_path(self, generation):
+        return os.path.join(self.path, '{}{}'.format(GENERATION_PREFIX, generation))
+
+    def _write(self, data):
+        """
+        Write the data as the next generation and make it current. Must be called with the builder lock held.
+        """
+        generation = (self.current_generation() or 0) + 1
+        final = self._generation_path(generation)
+        tmp = final + '.tmp'
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        _write_generation(tmp, data)
+        shutil.rmtree(final, ignore_errors=True)
+        os.rename(tmp, final)
+
+        current_tmp = os.path.join(self.path, CURRENT_FILE + '.tmp')
+        with open(current_tmp, 'w') as f:
+            f.write(str(generation))
+        os.replace(current_tmp, os.path.join(self.path, CURRENT_FILE))
+        logger.info("Wrote instrument data generation {}".format(generation))
+
+        for old in range(generation - KEEP_GENERATIONS, 0, -1):
+            path = self._generation_path(old)
+            if not os.path.exists(path):
+                break
+            shutil.rmtree(path, ignore_errors=True)
+        return generation
+
+
+def _write_generation(path, data):
+    covars, instruments, masks = data
+    np.save(os.path.join(path, 'covars.npy'), covars.values.astype(float))
+    np.save(os.path.join(path, 'masks.npy'), masks.values.astype(bool))
+
+    columns = []
+    for ix, col in enumerate(instruments.columns):
+        values = instruments[col].values
+        if values.dtype.kind in 'biuf':
+            fname = 'instruments-{}.npy'.format(ix)
+            np.save(os.path.join(path, fname), values)
+            columns.append({'name': col, 'file': fname})
+        else:
+            # Strings, so keep them in the index rather than pickling them into an npy.
+            columns.append({'name': col, 'values': values.tolist()})
+
+    index = {
+        'built': time.time(),
+        'covars_labels': _labels(covars.index),
+        'instruments_index': _labels(instruments.index),
+        'instruments_index_name': instruments.index.name,
+        'instruments_columns': columns,
+        'masks_columns': _labels(masks.columns),
+    }
+    with open(os.path.join(path, INDEX_FILE), 'w') as f:
+        json.dump(index, f)
+
+
+def _read_generation(path):
+    """
+    :return: (built, (covars, instruments, masks)) with the arrays memory mapped read only.
+    """
+    with open(os.path.join(path, INDEX_FILE)) as f:
+        index = json.load(f)
+
+    def mapped(fname):
+        return np.load(os.path.join(path, fname), mmap_mode='r')
+
+    covars = pd.DataFrame(mapped('covars.npy'), index=index['covars_labels'], columns=index['covars_labels'],
+                          copy=False)
+    symbols = pd.Index(index['instruments_index'], name=index['instruments_index_name'])
+    instruments = pd.DataFrame(index=symbols)
+    for col in index['instruments_columns']:
+        instruments[col['name']] = mapped(col['file']) if 'file' in col else col['values']
+    masks = pd.DataFrame(mapped('masks.npy'), index=symbols, columns=index['masks_columns'], copy=False)
+    return index['built'], (covars, instruments, masks)
+
+
+def _labels(index):
+    # numpy ints aren't JSON serialisable.
+    return [label.item() if hasattr(label, 'item') else label for label in index]
+
+
+_store = None
+
+
+def get_instrument_store():
+    """
+    :return: The process wide InstrumentStore, or None if settings.INSTRUMENT_STORE_DIR isn't configured.
+    """
+    global _store
+    path = getattr(settings, 'INSTRUMENT_STORE_DIR', None)
+    if not path:
+        return None
+    if _store is None or _store.path != path:
+        _store = InstrumentStore(path)
+    return _store
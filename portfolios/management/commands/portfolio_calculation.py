@@ -1,10 +1,11 @@
 import logging
+import math
 
 from django.core.management.base import BaseCommand
 
 from main.models import Goal
 from portfolios.calculation import Unsatisfiable, \
-    calculate_portfolios
+    calculate_portfolios, calculate_portfolios_parallel
 from portfolios.providers.data.django import DataProviderDjango
 from portfolios.providers.execution.django import ExecutionProviderDjango
 
@@ -15,15 +16,37 @@ logger = logging.getLogger('betasmartz.portfolio_calculation')
 class Command(BaseCommand):
     help = 'Calculate all the optimal portfolios for all the goals in the system.'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--workers',
+                            type=int,
+                            default=1,
+                            help='Number of worker processes to calculate the portfolios with.')
+
     def handle(self, *args, **options):
         # calculate portfolios
         data_provider = DataProviderDjango()
         exec_provider = ExecutionProviderDjango()
-        for goal in Goal.objects.all():
-            if goal.selected_settings is not None:
-                try:
-                    calculate_portfolios(setting=goal.selected_settings,
-                                         data_provider=data_provider,
-                                         execution_provider=exec_provider)
-                except Unsatisfiable as e:
+        workers = options['workers']
+        settings = [goal.selected_settings for goal in Goal.objects.select_related('selected_settings')
+                    if goal.selected_settings is not None]
+
+        if workers > 1:
+            # If there are fewer goals than workers, split the risk scores of each goal up to use them all.
+            chunks = max(1, int(math.ceil(workers / max(len(settings), 1))))
+            results = calculate_portfolios_parallel(settings,
+                                                    data_provider=data_provider,
+                                                    execution_provider=exec_provider,
+                                                    workers=workers,
+                                                    chunks=chunks)
+            for setting, portfolios, e in results:
+                if e is not None:
                     logger.warn(e)
+            return
+
+        for setting in settings:
+            try:
+                calculate_portfolios(setting=setting,
+                                     data_provider=data_provider,
+                                     execution_provider=exec_provider)
+            except Unsatisfiable as e:
+                logger.warn(e)
@@ -0,0 +1,127 @@
+import logging
+
+import numpy as np
+import pandas as pd
+
+# The number of investment cycles.
+NUM_CYCLES = 5
+
+# The latest rows folded in are refolded on the next update, as their prices may still be interpolated or filled in.
+REFOLD_DAYS = 5
+
+logger = logging.getLogger(__name__)
+
+
+class CycleMoments(object):
+    """
+    Per investment cycle sufficient statistics of daily returns: for every pair of columns, the number of days both have
+    a return, the sums of each over those days and the sum of their products, plus the sum of log returns for each
+    column. They give the same per cycle mean log returns and pairwise covariances as grouping the full history by
+    cycle, but can be updated with a handful of new days rather than recalculated over the whole history.
+    """
+    def __init__(self, columns):
+        self.columns = list(columns)
+        n = len(self.columns)
+        self.counts = np.zeros((NUM_CYCLES, n, n))
+        self.sums = np.zeros((NUM_CYCLES, n, n))
+        self.cross = np.zeros((NUM_CYCLES, n, n))
+        self.log_sums = np.zeros((NUM_CYCLES, n))
+        # The days folded in, with their cycle label (-1 for none) and a digest of their values.
+        self.dates = pd.DatetimeIndex([])
+        self.labels = np.zeros(0, dtype=int)
+        self.digests = np.zeros(0)
+        # The returns of the last REFOLD_DAYS days folded in, so they can be taken out again.
+        self.tail = np.zeros((0, n))
+        self._weights = np.random.RandomState(0).rand(n)
+
+    def fold(self, returns, cycles, begin):
+        """
+        Bring the statistics up to date with the returns from begin onwards, adding new days and removing those before
+        begin. Only the days since the last update are folded in, plus the last REFOLD_DAYS days folded previously.
+        :param returns: Pandas timeseries dataframe of daily returns with the same columns as these statistics. It must
+                        include the days before begin that were previously folded in, so they can be removed.
+        :param cycles: Pandas timeseries of the cycle observations from begin onwards.
+        :param begin: The first day of returns to use.
+        :return: False if the returns or cycles of days folded in before have changed, so the statistics need
+                 rebuilding. True otherwise.
+        """
+        if list(returns.columns) != self.columns:
+            return False
+        begin = pd.Timestamp(begin)
+        frame = returns.reindex(returns.index.union(self.dates))
+        values = frame.values.astype(float)
+        labels = cycles.reindex(frame.index, method='pad').fillna(-1).values.astype(int)
+        digests = self._digest(values)
+
+        # Every day folded in before, except the tail, must be just as it was. Days that are now before begin keep the
+        # cycle they were folded in with, as they're only being removed.
+        n_settled = len(self.dates) - len(self.tail)
+        settled = self.dates[:n_settled]
+        pos = frame.index.get_indexer(settled)
+        expired = np.asarray(settled < begin)
+        if (np.any(digests[pos] != self.digests[:n_settled]) or
+                np.any(labels[pos[~expired]] != self.labels[:n_settled][~expired])):
+            return False
+
+        self._add(self.tail, self.labels[n_settled:], -1)
+        self._add(values[pos[expired]], self.labels[:n_settled][expired], -1)
+        is_settled = np.zeros(len(frame), dtype=bool)
+        is_settled[pos] = True
+        new = np.nonzero((frame.index >= begin) & ~is_settled)[0]
+        self._add(values[new], labels[new], 1)
+
+        window = np.nonzero(frame.index >= begin)[0]
+        self.dates = frame.index[window]
+        self.labels = labels[window]
+        self.digests = digests[window]
+        self.tail = values[window[-REFOLD_DAYS:]]
+        logger.debug("Folded {} days of returns into the cycle moments, removed {}.".format(len(new), expired.sum()))
+        return True
+
+    def expected_returns(self, probs, columns):
+        """
+        :param probs: A 1x5 numpy array of the probabilities of each investment cycle.
+        :param columns: The columns to get expected returns for.
+        :return: Daily expected return as a pandas series indexed on columns.
+        """
+        ix = self._positions(columns)
+        counts = self.counts[:, ix, ix]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = np.where(counts > 0, self.log_sums[:, ix] / counts, np.nan)
+        return pd.Series(np.exp(means).T.dot(probs.ravel()) - 1, index=columns)
+
+    def covariance(self, probs, columns):
+        """
+        :param probs: A 1x5 numpy array of the probabilities of each investment cycle.
+        :param columns: The columns to get the covariance for.
+        :return: Daily covariance as a pandas dataframe indexed on columns on both axes.
+        """
+        ix = np.ix_(self._positions(columns), self._positions(columns))
+        sigma = 0
+        for c in range(NUM_CYCLES):
+            counts = self.counts[c][ix]
+            sums = self.sums[c][ix]
+            with np.errstate(invalid='ignore', divide='ignore'):
+                cov = (self.cross[c][ix] - sums * sums.T / counts) / (counts - 1)
+            sigma = sigma + np.where(counts > 1, cov, np.nan) * probs[0, c]
+        return pd.DataFrame(sigma, index=columns, columns=columns)
+
+    def _positions(self, columns):
+        lookup = {col: pos for pos, col in enumerate(self.columns)}
+        return np.array([lookup[col] for col in columns], dtype=int)
+
+    def _digest(self, values):
+        return np.where(np.isnan(values), np.pi, values).dot(self._weights)
+
+    def _add(self, values, labels, sign):
+        for c in range(NUM_CYCLES):
+            rows = values[labels == c]
+            if not len(rows):
+                continue
+            valid = ~np.isnan(rows)
+            filled = np.where(valid, rows, 0)
+            present = valid.astype(float)
+            self.counts[c] += sign * present.T.dot(present)
+            self.sums[c] += sign * filled.T.dot(present)
+            self.cross[c] += sign * filled.T.dot(filled)
+            self.log_sums[c] += sign * np.log(1 + filled).sum(axis=0)
@@ -6,6 +6,7 @@ import pandas as pd
 
 from common.constants import WEEKDAYS_PER_YEAR
 from portfolios.exceptions import OptimizationException
+from portfolios.prediction.cycle_moments import CycleMoments
 from portfolios.returns import get_return_history, get_benchmark_returns, filter_returns
 
 # TODO: Once we have automated predictions, reduce this value.
@@ -30,9 +31,12 @@ class InvestmentClock(object):
         """
         return self.data_provider.get_last_cycle_start()
 
-    def get_fund_predictions(self):
+    def get_fund_predictions(self, rebuild=False):
         """
         This method generates 12 month predictions for fund expected returns and covariance.
+        The per cycle return statistics are kept by the data provider between runs, and only the days since the last
+        run are folded into them.
+        :param rebuild: Rebuild the per cycle return statistics from the full history rather than updating them.
         :return: (ers, covars)
                  ers is a pandas series of 12 month expected return indexed on fund id
                  covars is a pandas dataframe of 12 month expected covariance indexed on both axis by fund id
@@ -46,11 +50,18 @@ class InvestmentClock(object):
         # Get the funds
         funds = self.data_provider.get_tickers()
 
+        # The days that have dropped out of the history since the last run are needed to remove them again.
+        moments = None if rebuild else self.data_provider.get_cycle_moments()
+        load_date = begin_date
+        if moments is not None and len(moments.dates):
+            load_date = min(begin_date, moments.dates[0].date())
+
         # Get all the return data relating to the funds
-        fund_returns, benchmark_returns = get_return_history(funds, begin_date, today)
+        fund_returns, benchmark_returns = get_return_history(funds, load_date, today)
 
         # For now we're assigning the benchmark returns for the return history.
-        returns = get_benchmark_returns(funds, benchmark_returns)
+        history = get_benchmark_returns(funds, benchmark_returns)
+        returns = history[history.index >= pd.Timestamp(begin_date)]
 
         # Filter any funds that don't have enough data.
         # Our latest start date is the first day of the last complete investment cycle from the current date.
@@ -70,9 +81,17 @@ class InvestmentClock(object):
 
         probs = np.array(self.get_normalized_probabilities(oldest_dt).tail(1))
 
-        return_cycles = self._merge_cycle_returns(returns, cycles)
-        mu = (1 + self._expected_returns_prob_v1(return_cycles, probs)) ** WEEKDAYS_PER_YEAR - 1
-        sigma = self._covariance_matrix_prob_v1(return_cycles, probs) * WEEKDAYS_PER_YEAR
+        columns = list(returns.columns)
+        self._check_full_cycle(returns, cycles)
+        if moments is None or not moments.fold(history, cycles, begin_date):
+            if moments is not None:
+                logger.info("Return history has changed since the cycle moments were built. Rebuilding them.")
+            moments = CycleMoments(history.columns)
+            moments.fold(history, cycles, begin_date)
+        self.data_provider.set_cycle_moments(moments)
+
+        mu = (1 + moments.expected_returns(probs, columns)) ** WEEKDAYS_PER_YEAR - 1
+        sigma = moments.covariance(probs, columns) * WEEKDAYS_PER_YEAR
         return mu, sigma
 
     def get_cycle_obs(self, begin_date):
@@ -105,12 +124,21 @@ class InvestmentClock(object):
         :param cycles: The Dataframe of the monthly investment cycle observations
         :return: Returns the merged dataframe
         """
+        self._check_full_cycle(returns, cycles)
         returns[CYCLE_LABEL] = cycles.reindex(returns.index, method='pad')
-        if len(returns[CYCLE_LABEL].unique()) != 5:
+        return returns
+
+    def _check_full_cycle(self, returns, cycles):
+        """
+        Check every investment cycle was observed over the days of the return observations.
+        :param returns: The Dataframe of the daily return observations
+        :param cycles: The Dataframe of the monthly investment cycle observations
+        :raises OptimizationException: If not.
+        """
+        if len(cycles.reindex(returns.index, method='pad').unique()) != 5:
             emsg = "A full investment cycle was not present in the available history ({} - {})"
             logger.error(emsg.format(returns.index[0], returns.index[-1]))
             raise OptimizationException("Not enough data for portfolio optimisation.")
-        return returns
 
     def _expected_returns_prob_v1(self, merged_df, prob_vector):
         """
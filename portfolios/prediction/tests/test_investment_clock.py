@@ -100,6 +100,20 @@ class InvestmentClockTest(TestCase):
         self.assertAlmostEqual(mu[2], -0.345612, 6)
         self.assertAlmostEqual(mu[3], -0.297295, 6)
 
+    def test_get_fund_predictions_incremental(self):
+        self.populate_observations()
+        self.populate_probabilities()
+        self.populate_returns()
+        mu, sigma = self.predictor.get_fund_predictions(rebuild=True)
+        moments = self.data_provider.get_cycle_moments()
+        self.assertIsNotNone(moments)
+        # Nothing has changed, so the kept moments are updated rather than rebuilt.
+        imu, isigma = self.predictor.get_fund_predictions()
+        self.assertListEqual(list(self.data_provider.get_cycle_moments().dates), list(moments.dates))
+        np.testing.assert_allclose(imu.values, mu.values)
+        np.testing.assert_allclose(isigma.values, sigma.values)
+        self.assertAlmostEqual(imu[1], 2.689327, 6)
+
     def test_get_fund_predictions_no_returns(self):
         self.populate_probabilities()
         with self.assertRaises(OptimizationException):
@@ -14,6 +14,29 @@ class DataProviderAbstract(ABC):
     def set_instrument_cache(self, data):
         raise NotImplementedError()
 
+    def get_or_build_instrument_cache(self, build):
+        """
+        Get the instrument data from the cache, or build it with build() and cache it if it's not there.
+        :param build: Callable returning the (covars, instruments, masks) instrument data.
+        """
+        data = self.get_instrument_cache()
+        if data is None:
+            data = build()
+            self.set_instrument_cache(data)
+        return data
+
+    def get_cycle_moments(self):
+        """
+        :return: The CycleMoments kept from the last investment clock prediction, or None if there are none.
+        """
+        return None
+
+    def set_cycle_moments(self, moments):
+        """
+        Keep the CycleMoments for the next investment clock prediction. By default they're not kept.
+        """
+        pass
+
     @abstractmethod
     def get_current_date(self):
         raise NotImplementedError()
@@ -7,6 +7,7 @@ from main import redis
 from main.models import AssetFeatureValue, MarketCap, MarkowitzScale, \
     PortfolioSet, Ticker, InvestmentCycleObservation, InvestmentCyclePrediction
 from django_pandas.io import read_frame
+from portfolios.instrument_store import get_instrument_store
 from .abstract import DataProviderAbstract
 
 
@@ -73,11 +74,30 @@ class DataProviderDjango(DataProviderAbstract):
                                       c=c)
 
     def get_instrument_cache(self):
+        store = get_instrument_store()
+        if store is not None:
+            return store.get()
         return cache.get(redis.Keys.INSTRUMENT_DATA)
 
     def set_instrument_cache(self, data):
+        store = get_instrument_store()
+        if store is not None:
+            store.save(data)
+            return
         cache.set(redis.Keys.INSTRUMENT_DATA, data, timeout=60 * 60 * 24)
 
+    def get_or_build_instrument_cache(self, build):
+        store = get_instrument_store()
+        if store is None:
+            return super(DataProviderDjango, self).get_or_build_instrument_cache(build)
+        return store.get_or_build(build)
+
+    def get_cycle_moments(self):
+        return cache.get(redis.Keys.CYCLE_MOMENTS)
+
+    def set_cycle_moments(self, moments):
+        cache.set(redis.Keys.CYCLE_MOMENTS, moments, timeout=60 * 60 * 24 * 7)
+
     def get_investment_cycles(self):
         # Populate the cache as we'll be hitting it a few times. Boolean evaluation causes full cache population
         obs = InvestmentCycleObservation.objects.all().filter(as_of__lt=self.get_current_date()).order_by('as_of')
@@ -1,19 +1,25 @@
 import logging
-from datetime import timedelta
+from datetime import datetime, timedelta
 
-from django.db.models import Sum, F
-from django.db.models.functions import Coalesce
 from main.management.commands.rebalance import get_weights
 
-from main.models import MarketOrderRequest, Ticker, PositionLot
+from main.models import MarketOrderRequest
+from main.tax_lots import TaxLotIndex
 from .abstract import ExecutionProviderAbstract
 
 logger = logging.getLogger('betasmartz.execution_provider_django')
 
 
 class ExecutionProviderDjango(ExecutionProviderAbstract):
+    def __init__(self, tax_lots=None):
+        """
+        :param tax_lots: A TaxLotIndex holding the lots of the goals the provider will be asked about, if they've been
+                         loaded together. Otherwise each goal's lots are loaded when needed.
+        """
+        self.tax_lots = tax_lots
+
     def get_execution_request(self, reason):
-        pass
+        return reason
 
     def create_market_order(self, account):
         order = MarketOrderRequest(account=account)
@@ -23,32 +29,25 @@ class ExecutionProviderDjango(ExecutionProviderAbstract):
         pass
 
     def get_asset_weights_without_tax_winners(self, goal):
-        lots = PositionLot.objects \
-            .filter(execution_distribution__transaction__from_goal=goal,
-                    execution_distribution__execution__asset__state=Ticker.State.ACTIVE.value) \
-            .annotate(ticker_id=F('execution_distribution__execution__asset__id'),
-                      price=F('execution_distribution__execution__asset__unit_price'),
-                      bought_price=F('execution_distribution__execution__price')) \
-            .annotate(tax_gain=F('price')-F('bought_price'))\
-            .values('ticker_id', 'tax_gain', 'quantity', 'price')
-
-        lots_no_tax_gain = [lot for lot in lots if lot['tax_gain'] < 0]
-
-        weights = get_weights(lots_no_tax_gain, goal.available_balance)
+        lots = [lot for lot in self._tax_lots(goal).active_lots(goal.id) if lot['price'] - lot['price_entry'] < 0]
+        weights = get_weights(lots, goal.available_balance)
         return weights
 
     def get_asset_weights_held_less_than1y(self, goal, today):
-        m1y = today - timedelta(days=366)
-        lots = PositionLot.objects.\
-            filter(execution_distribution__execution__executed__gt=m1y,
-                   execution_distribution__transaction__from_goal__id=goal.id,
-                   execution_distribution__execution__asset__state=Ticker.State.ACTIVE.value).\
-            annotate(tid=F('execution_distribution__execution__asset__id')).values('tid').\
-            annotate(value=Coalesce(Sum(F('quantity') * F('execution_distribution__execution__asset__unit_price')), 0))
+        m1y = datetime.combine(today - timedelta(days=366), datetime.min.time())
+        values = self._tax_lots(goal).values_bought_since(goal.id, m1y)
 
         weights = dict()
 
         bal = goal.available_balance
-        for l in lots:
-            weights[l['tid']] = l['value'] / bal
+        for tid, value in values.items():
+            weights[tid] = value / bal
         return weights
+
+    def _tax_lots(self, goal):
+        """
+        :return: The TaxLotIndex given to this provider if it holds the goal's lots, or one loaded with them.
+        """
+        if self.tax_lots is not None and self.tax_lots.has_goal(goal.id):
+            return self.tax_lots
+        return TaxLotIndex.load(goal_ids=[goal.id])
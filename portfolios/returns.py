@@ -2,14 +2,20 @@
 from datetime import timedelta, date
 import logging
 from collections import defaultdict
+import numpy as np
 import pandas as pd
 
+from django.contrib.contenttypes.models import ContentType
+from django.db import models
 from django.db.models.query import QuerySet
 
 # The largest acceptable daily return. Anything above this will be filtered out and replaced with an average.
 # This is an extremely poor way to deal with splits.
 LARGEST_DAILY_RETURN = 0.48
 
+# The most instrument ids we put in one IN clause when loading prices in bulk.
+PRICE_QUERY_CHUNK_SIZE = 500
+
 logger = logging.getLogger('portfolios.returns')
 
 
@@ -113,14 +119,39 @@ def get_return_history(funds, start_date, end_date):
               column names are "benchmark_content_type_id"_"benchmark_model_instance_id"
     """
     # TODO: Add asset class returns to this as well
-    benchmark_returns = pd.DataFrame()
-    fund_returns = pd.DataFrame()
-
     dates = pd.bdate_range(start_date, end_date)
 
+    # Instruments are identified by (content type id, object id) so different models can share an object id.
+    fund_keys = []
+    benchmark_keys = []
+    bids = set()
+    others = []
     for fund in funds:
-        # Add the benchmark returns if they're not already in there
-        # We need to use the content type to disambiguate the object Id as the same id may be used in multiple models.
+        if not isinstance(fund, models.Model):
+            # Funds from other data providers don't live in our database, so get their returns one by one.
+            others.append(fund)
+            continue
+        fund_keys.append((fund.id, (ContentType.objects.get_for_model(fund).id, fund.id)))
+        if fund.benchmark_content_type_id is None or fund.benchmark_object_id is None:
+            emsg = "Fund: {} has no benchmark defined."
+            logger.warn(emsg.format(fund))
+            continue
+        bid = benchmark_uid(fund)
+        if bid not in bids:
+            bids.add(bid)
+            benchmark_keys.append((bid, (fund.benchmark_content_type_id, fund.benchmark_object_id)))
+
+    if fund_keys:
+        keys = [key for _, key in fund_keys + benchmark_keys]
+        returns = get_bulk_price_returns(keys, dates)
+        returns.columns = [label for label, _ in fund_keys + benchmark_keys]
+        fund_returns = returns.iloc[:, :len(fund_keys)]
+        benchmark_returns = returns.iloc[:, len(fund_keys):]
+    else:
+        fund_returns = pd.DataFrame()
+        benchmark_returns = pd.DataFrame()
+
+    for fund in others:
         fund_returns[fund.id] = fund.get_returns(dates)
         if fund.benchmark is None:
             emsg = "Fund: {} has no benchmark defined."
@@ -295,16 +326,106 @@ def get_price_returns(instrument, dates, consecutive=False):
     rets = consec.pct_change()[1:]
 
     # Remove any outlandish returns.
-    brets = rets.loc[rets.abs() > LARGEST_DAILY_RETURN]
-    if len(brets) > 0:
+    outliers = rets.abs() > LARGEST_DAILY_RETURN
+    if outliers.any():
         avg = rets.mean()
         emsg = "Daily returns: {} are outside our specified limit of {}%. Replacing with the average: {}"
-        logger.warn(emsg.format(brets, LARGEST_DAILY_RETURN, avg))
-        brets[:] = avg
+        logger.warn(emsg.format(rets[outliers], LARGEST_DAILY_RETURN, avg))
+        rets = rets.where(~outliers, avg)
 
     return rets
 
 
+def get_bulk_prices(keys, dates):
+    """
+    Returns cleaned weekday prices for many instruments at once, cleaned the same way as get_prices.
+    The prices are loaded with one query per content type and chunk of PRICE_QUERY_CHUNK_SIZE instruments, rather than
+    one query per instrument.
+    :param keys: List of (content type id, object id) identifying the instruments.
+    :param dates: Pandas datetime index of dates to collect.
+    :return: A pandas dataframe indexed on dates with one column per key, in the order given.
+    """
+    from main.models import DailyPrice
+
+    prices = np.full((len(dates), len(keys)), np.nan)
+    columns = defaultdict(dict)
+    for col, (ctid, oid) in enumerate(keys):
+        columns[ctid][oid] = col
+
+    for ctid, cols in columns.items():
+        oids = list(cols.keys())
+        for start in range(0, len(oids), PRICE_QUERY_CHUNK_SIZE):
+            rows = DailyPrice.objects.filter(instrument_content_type_id=ctid,
+                                             instrument_object_id__in=oids[start:start + PRICE_QUERY_CHUNK_SIZE],
+                                             date__range=(dates[0] - timedelta(days=1), dates[-1]),
+                                             price__isnull=False)
+            rows = list(rows.values_list('instrument_object_id', 'date', 'price'))
+            if not rows:
+                continue
+            oid_col, day, price = zip(*rows)
+            # Prices on days not in dates (weekends, the day before the start) are dropped, as reindex does.
+            row_ix = dates.get_indexer(pd.to_datetime(day))
+            col_ix = np.array([cols[oid] for oid in oid_col])
+            found = row_ix >= 0
+            prices[row_ix[found], col_ix[found]] = np.array(price, dtype=float)[found]
+
+    # Remove negative prices and fill missing values
+    # We replace negs with NaN so they are interpolated.
+    with np.errstate(invalid='ignore'):
+        prices[prices <= 0] = np.nan
+    return pd.DataFrame(prices, index=dates, columns=list(range(len(keys)))).interpolate(method='time', limit=2)
+
+
+def get_bulk_price_returns(keys, dates):
+    """
+    Get the daily returns for many instruments at once, as get_price_returns would for each of them.
+    :param keys: List of (content type id, object id) identifying the instruments.
+    :param dates: Pandas datetime index of dates to collect.
+    :return: A pandas dataframe with one column per key, in the order given. The index runs from the first to the last
+             day any instrument has a return. Each column is NaN outside the run of its own returns.
+    """
+    prices = get_bulk_prices(keys, dates)
+    values = prices.values
+    valid = ~np.isnan(values)
+    n = len(dates)
+    has_data = valid.any(axis=0)
+    # The positions of each column's first and last valid price.
+    first = np.where(has_data, valid.argmax(axis=0), n)
+    last = np.where(has_data, n - 1 - valid[::-1].argmax(axis=0), -1)
+    rows = np.arange(n)[:, None]
+    in_run = (rows >= first) & (rows <= last)
+
+    gaps = (in_run & ~valid).any(axis=0)
+    for col in np.nonzero(gaps)[0]:
+        emsg = "Not generating full returns for instrument: {}. " \
+               "Generating longest data available from {} - {}"
+        logger.warn(emsg.format(keys[col], dates[first[col]], dates[last[col]]))
+
+    # Gaps inside a run are padded over, as pct_change does.
+    filled = prices.ffill().values
+    with np.errstate(invalid='ignore', divide='ignore'):
+        rets = np.full_like(values, np.nan)
+        rets[1:] = filled[1:] / filled[:-1] - 1
+    rets[~in_run | (rows == first)] = np.nan
+
+    # Remove any outlandish returns.
+    with np.errstate(invalid='ignore'):
+        outliers = np.abs(rets) > LARGEST_DAILY_RETURN
+    if outliers.any():
+        avgs = pd.DataFrame(rets).mean().values
+        for col in np.nonzero(outliers.any(axis=0))[0]:
+            emsg = "Daily returns: {} for instrument: {} are outside our specified limit of {}%. " \
+                   "Replacing with the average: {}"
+            logger.warn(emsg.format(rets[outliers[:, col], col], keys[col], LARGEST_DAILY_RETURN, avgs[col]))
+        rets = np.where(outliers, avgs[None, :], rets)
+
+    rets = pd.DataFrame(rets, index=dates, columns=prices.columns)
+    returned = np.nonzero(~np.isnan(rets.values).all(axis=1))[0]
+    if len(returned) == 0:
+        return rets.iloc[:0]
+    return rets.iloc[returned[0]:returned[-1] + 1]
+
+
 def build_fund_returns(dates):
     """
     Build the returns for the funds in our system between the given dates
@@ -2,15 +2,18 @@ from datetime import datetime
 from unittest import mock, skip
 from unittest.mock import MagicMock
 
+import pandas as pd
 from django.utils import timezone
-from django.test import TestCase
+from django.test import TestCase, TransactionTestCase
 
 from api.v1.tests.factories import GoalSettingFactory, GoalMetricFactory, GoalFactory, TickerFactory, \
     AssetFeatureValueFactory, PortfolioSetFactory, MarkowitzScaleFactory, MarketIndexFactory, AssetClassFactory, AssetFeatureFactory
 from main.management.commands.populate_test_data import populate_prices, populate_cycle_obs, populate_cycle_prediction, \
     delete_data
 from main.models import GoalMetric
-from portfolios.calculation import calc_opt_inputs, build_instruments, calculate_portfolio, calculate_portfolio_old
+from portfolios.calculation import calc_opt_inputs, build_instruments, calculate_portfolio, calculate_portfolio_old, \
+    calculate_portfolios, calculate_portfolios_parallel, get_masks, get_settings_masks, \
+    INSTRUMENT_TABLE_FEATURES_LABEL, INSTRUMENT_TABLE_PORTFOLIOSETS_LABEL
 from portfolios.providers.data.django import DataProviderDjango
 from portfolios.providers.execution.django import ExecutionProviderDjango
 
@@ -168,3 +171,152 @@ class CalculationTest(TestCase):
                                      execution_provider=execution_provider,
                                      idata=idata)
         self.assertTrue(True)
+
+    @mock.patch.object(timezone, 'now', MagicMock(return_value=mocked_now))
+    def test_calculate_portfolios_matches_calculate_portfolio(self):
+        asset_class1 = AssetClassFactory.create(name='US_TOTAL_BOND_MARKET')
+        asset_class2 = AssetClassFactory.create(name='HEDGE_FUNDS')
+        TickerFactory.create(symbol='IAGG', asset_class=asset_class1)
+        TickerFactory.create(symbol='ITOT', asset_class=asset_class2)
+        fund3 = TickerFactory.create(symbol='rest')
+        ps1 = PortfolioSetFactory.create(asset_classes=[asset_class1, asset_class2, fund3.asset_class])
+        settings = GoalSettingFactory.create()
+        GoalMetricFactory.create(group=settings.metric_group, type=GoalMetric.METRIC_TYPE_RISK_SCORE)
+        GoalFactory.create(selected_settings=settings, portfolio_set=ps1)
+
+        self.m_scale = MarkowitzScaleFactory.create()
+        populate_prices(500, asof=mocked_now.date())
+        populate_cycle_obs(500, asof=mocked_now.date())
+        populate_cycle_prediction(asof=mocked_now.date())
+        data_provider = DataProviderDjango()
+        execution_provider = ExecutionProviderDjango()
+        idata = build_instruments(data_provider)
+        data_provider.set_instrument_cache(idata)
+
+        portfolios = calculate_portfolios(setting=settings,
+                                          data_provider=data_provider,
+                                          execution_provider=execution_provider)
+        self.assertEqual(len(portfolios), 101)
+
+        # The sweep must give the same portfolios as solving each risk score on its own.
+        for risk_score, (weights, er, stdev) in portfolios[::25]:
+            s_weights, s_er, s_stdev = calculate_portfolio(settings=settings,
+                                                           data_provider=data_provider,
+                                                           execution_provider=execution_provider,
+                                                           idata=idata,
+                                                           risk_setting=risk_score)
+            self.assertListEqual(weights.index.tolist(), s_weights.index.tolist())
+            self.assertAlmostEqual(er, s_er, places=4)
+            self.assertAlmostEqual(stdev, s_stdev, places=4)
+
+    @mock.patch.object(timezone, 'now', MagicMock(return_value=mocked_now))
+    def test_calculate_portfolio_orderable(self):
+        asset_class1 = AssetClassFactory.create(name='US_TOTAL_BOND_MARKET')
+        asset_class2 = AssetClassFactory.create(name='HEDGE_FUNDS')
+        TickerFactory.create(symbol='IAGG', asset_class=asset_class1)
+        TickerFactory.create(symbol='ITOT', asset_class=asset_class2)
+        fund3 = TickerFactory.create(symbol='rest')
+        ps1 = PortfolioSetFactory.create(asset_classes=[asset_class1, asset_class2, fund3.asset_class])
+        settings = GoalSettingFactory.create()
+        GoalMetricFactory.create(group=settings.metric_group, type=GoalMetric.METRIC_TYPE_RISK_SCORE)
+        goal = GoalFactory.create(selected_settings=settings, portfolio_set=ps1, cash_balance=10000)
+
+        self.m_scale = MarkowitzScaleFactory.create()
+        populate_prices(500, asof=mocked_now.date())
+        populate_cycle_obs(500, asof=mocked_now.date())
+        populate_cycle_prediction(asof=mocked_now.date())
+        data_provider = DataProviderDjango()
+        idata = build_instruments(data_provider)
+        prices = idata[1].set_index('id')['price']
+
+        weights, er, stdev = calculate_portfolio(settings=settings,
+                                                 data_provider=data_provider,
+                                                 execution_provider=ExecutionProviderDjango(),
+                                                 idata=idata)
+        self.assertTrue(len(weights) > 0)
+        budget = goal.current_balance
+        for ticker_id, weight in weights.iteritems():
+            units = weight * budget / prices[ticker_id]
+            self.assertAlmostEqual(units, round(units), places=6)
+        self.assertLessEqual(weights.sum(), 1.00001)
+
+    def test_get_settings_masks(self):
+        instruments = pd.DataFrame({INSTRUMENT_TABLE_FEATURES_LABEL: [[1], [1, 2], [2], []],
+                                    INSTRUMENT_TABLE_PORTFOLIOSETS_LABEL: [[7], [7], [7, 8], [8]]},
+                                   index=['A', 'B', 'C', 'D'])
+        data_provider = MagicMock()
+        data_provider.get_asset_feature_values_ids.return_value = [1, 2]
+        data_provider.get_portfolio_sets_ids.return_value = [7, 8]
+        masks = get_masks(instruments, data_provider)
+        self.assertListEqual(masks[1].tolist(), [True, True, False, False])
+        self.assertListEqual(masks['PORTFOLIO-SET_8'].tolist(), [False, False, True, True])
+
+        settings = MagicMock()
+        settings.goal.portfolio_set.id = 7
+        # Remove anything with feature 2, and constrain feature 1.
+        settings.get_metrics_all.return_value = [
+            MagicMock(type=0, configured_val=0.0, comparison=2, feature=MagicMock(id=2)),
+            MagicMock(type=0, configured_val=0.5, comparison=1, feature=MagicMock(id=1)),
+        ]
+        symbol_ixs, cvx_masks = get_settings_masks(settings, masks)
+        self.assertListEqual(symbol_ixs, [0])
+        self.assertDictEqual(cvx_masks, {1: [0]})
+        # The second call for the same portfolio set and metrics is memoised, even with a new copy of the masks.
+        self.assertIs(get_settings_masks(settings, masks.copy())[0], symbol_ixs)
+        changed = masks.copy()
+        changed.iloc[1, 1] = False
+        self.assertListEqual(get_settings_masks(settings, changed)[0], [0, 1])
+
+        settings.goal.portfolio_set.id = 8
+        symbol_ixs, cvx_masks = get_settings_masks(settings, masks)
+        self.assertListEqual(symbol_ixs, [3])
+        self.assertDictEqual(cvx_masks, {1: []})
+
+
+class ParallelCalculationTest(TransactionTestCase):
+    # The worker processes read the settings through their own database connections, so the test data is committed.
+
+    @mock.patch.object(timezone, 'now', MagicMock(return_value=mocked_now))
+    def test_calculate_portfolios_parallel_matches_calculate_portfolios(self):
+        asset_class1 = AssetClassFactory.create(name='US_TOTAL_BOND_MARKET')
+        asset_class2 = AssetClassFactory.create(name='HEDGE_FUNDS')
+        TickerFactory.create(symbol='IAGG', asset_class=asset_class1)
+        TickerFactory.create(symbol='ITOT', asset_class=asset_class2)
+        fund3 = TickerFactory.create(symbol='rest')
+        ps1 = PortfolioSetFactory.create(asset_classes=[asset_class1, asset_class2, fund3.asset_class])
+        settings = []
+        for cash_balance in (10000, 2500, 40000):
+            setting = GoalSettingFactory.create()
+            GoalMetricFactory.create(group=setting.metric_group, type=GoalMetric.METRIC_TYPE_RISK_SCORE)
+            GoalFactory.create(selected_settings=setting, portfolio_set=ps1, cash_balance=cash_balance)
+            settings.append(setting)
+
+        MarkowitzScaleFactory.create()
+        populate_prices(500, asof=mocked_now.date())
+        populate_cycle_obs(500, asof=mocked_now.date())
+        populate_cycle_prediction(asof=mocked_now.date())
+        data_provider = DataProviderDjango()
+        execution_provider = ExecutionProviderDjango()
+        idata = build_instruments(data_provider)
+        data_provider.set_instrument_cache(idata)
+
+        expected = [calculate_portfolios(setting=setting,
+                                         data_provider=data_provider,
+                                         execution_provider=execution_provider,
+                                         idata=idata)
+                    for setting in settings]
+
+        # More settings than workers, then the risk scores of each setting split over the workers.
+        for workers, chunks in ((2, 1), (3, 4)):
+            results = calculate_portfolios_parallel(settings, data_provider, execution_provider, workers, chunks)
+            self.assertListEqual([setting.id for setting, _, _ in results], [setting.id for setting in settings])
+            for (_, portfolios, error), serial in zip(results, expected):
+                self.assertIsNone(error)
+                self.assertListEqual([risk_score for risk_score, _ in portfolios],
+                                     [risk_score for risk_score, _ in serial])
+                for (_, (weights, er, stdev)), (_, (s_weights, s_er, s_stdev)) in zip(portfolios, serial):
+                    self.assertListEqual(weights.index.tolist(), s_weights.index.tolist())
+                    for weight, s_weight in zip(weights, s_weights):
+                        self.assertAlmostEqual(weight, s_weight)
+                    self.assertAlmostEqual(er, s_er)
+                    self.assertAlmostEqual(stdev, s_stdev)
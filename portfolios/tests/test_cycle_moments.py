@@ -0,0 +1,49 @@
+import numpy as np
+import pandas as pd
+from django.test import TestCase
+
+from portfolios.exceptions import OptimizationException
+from portfolios.prediction.cycle_moments import CycleMoments
+from portfolios.prediction.investment_clock import InvestmentClock
+
+
+class CycleMomentsTest(TestCase):
+    def setUp(self):
+        self.dates = pd.bdate_range('2014-01-01', periods=600)
+        rng = np.random.RandomState(3)
+        self.returns = pd.DataFrame(rng.randn(600, 3) * 0.01, index=self.dates, columns=[1, 2, 3])
+        # A fund with a late start.
+        self.returns.iloc[:40, 2] = np.nan
+        months = pd.date_range('2013-12-01', self.dates[-1], freq='MS')
+        self.cycles = pd.Series(np.arange(len(months)) % 5, index=months)
+        self.probs = np.array([[0.1, 0.2, 0.3, 0.25, 0.15]])
+
+    def test_fold_matches_rebuild(self):
+        moments = CycleMoments(self.returns.columns)
+        self.assertTrue(moments.fold(self.returns.iloc[:500], self.cycles[self.cycles.index <= self.dates[499]],
+                                     self.dates[0]))
+
+        # A hundred new days and their cycles, the last days folded before filled in, and the start moved on.
+        returns = self.returns.copy()
+        returns.iloc[498:500] += 0.001
+        self.assertTrue(moments.fold(returns, self.cycles, self.dates[50]))
+
+        rebuilt = CycleMoments(self.returns.columns)
+        rebuilt.fold(returns, self.cycles, self.dates[50])
+        self.assertListEqual(moments.dates.tolist(), rebuilt.dates.tolist())
+        for name in ('counts', 'sums', 'cross', 'log_sums'):
+            self.assertTrue(np.allclose(getattr(moments, name), getattr(rebuilt, name)), name)
+        self.assertTrue(np.allclose(moments.expected_returns(self.probs, [3, 1]),
+                                    rebuilt.expected_returns(self.probs, [3, 1])))
+        self.assertTrue(np.allclose(moments.covariance(self.probs, [3, 1]),
+                                    rebuilt.covariance(self.probs, [3, 1])))
+
+        # A change to a day folded in before the tail needs a rebuild.
+        returns.iloc[100, 0] += 0.001
+        self.assertFalse(moments.fold(returns, self.cycles, self.dates[50]))
+
+    def test_check_full_cycle(self):
+        clock = InvestmentClock(None)
+        clock._check_full_cycle(self.returns, self.cycles)
+        with self.assertRaises(OptimizationException):
+            clock._check_full_cycle(self.returns.iloc[:60], self.cycles)
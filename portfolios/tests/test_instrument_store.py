@@ -0,0 +1,61 @@
+import shutil
+import tempfile
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+from django.test import TestCase
+
+from portfolios.instrument_store import InstrumentStore
+
+
+class InstrumentStoreTest(TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.store = InstrumentStore(self.path)
+        symbols = pd.Index(['AAA', 'BBB'], name='symbol')
+        covars = pd.DataFrame([[0.1, 0.02], [0.02, 0.3]], index=[3, 7], columns=[3, 7])
+        instruments = pd.DataFrame({'exp_ret': [0.05, 0.07],
+                                    'ac': ['US_BONDS', 'AU_STOCKS'],
+                                    'price': [10.5, 20.0],
+                                    'id': [3, 7]}, index=symbols)
+        masks = pd.DataFrame([[True, False], [False, True]], index=symbols, columns=[1, 'PORTFOLIO-SET_2'])
+        self.data = covars, instruments, masks
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_round_trip(self):
+        self.assertIsNone(self.store.get())
+        generation = self.store.save(self.data)
+        self.assertEqual(generation, 1)
+
+        # Load through a separate store, as another process would.
+        covars, instruments, masks = InstrumentStore(self.path).get()
+        np.testing.assert_array_equal(covars.values, self.data[0].values)
+        self.assertListEqual(covars.index.tolist(), [3, 7])
+        self.assertListEqual(instruments.index.tolist(), ['AAA', 'BBB'])
+        self.assertListEqual(instruments['ac'].tolist(), ['US_BONDS', 'AU_STOCKS'])
+        self.assertListEqual(instruments['id'].tolist(), [3, 7])
+        self.assertListEqual(masks.columns.tolist(), [1, 'PORTFOLIO-SET_2'])
+        self.assertListEqual(masks[1].tolist(), [True, False])
+
+    def test_generations(self):
+        self.store.save(self.data)
+        reader = InstrumentStore(self.path)
+        generation = reader.load()[0]
+        self.assertFalse(reader.is_stale(generation))
+        self.store.save(self.data)
+        self.assertTrue(reader.is_stale(generation))
+        self.assertEqual(reader.load()[0], generation + 1)
+
+    def test_get_or_build(self):
+        build = mock.MagicMock(return_value=self.data)
+        self.store.get_or_build(build)
+        self.store.get_or_build(build)
+        self.assertEqual(build.call_count, 1)
+
+        # Once expired, the data is rebuilt.
+        self.store.max_age = -1
+        self.store.get_or_build(build)
+        self.assertEqual(build.call_count, 2)
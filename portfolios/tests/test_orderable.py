@@ -0,0 +1,60 @@
+import itertools
+from unittest import mock
+
+import numpy as np
+from django.test import TestCase
+
+from portfolios.algorithms import orderable
+from portfolios.algorithms.markowitz import markowitz_cost
+from portfolios.algorithms.orderable import min_cost_alignment
+
+
+class OrderableTest(TestCase):
+    def random_problem(self, rng, n):
+        returns = rng.randn(n + 30, n) * 0.1
+        sigma = returns.T.dot(returns) / 30
+        mu = rng.rand(n) * 0.1
+        weights = rng.dirichlet(np.ones(n))
+        prices = rng.rand(n) * 100 + 10
+        budget = rng.rand() * 3000 + 300
+        qty = (weights * budget) // prices
+        return sigma, mu, weights, qty * prices / budget, (qty + 1) * prices / budget
+
+    def brute_force(self, weights, lows, highs, sigma, lam, mu, max_weight):
+        best = None
+        best_cost = np.inf
+        for choice in itertools.product([0, 1], repeat=len(weights)):
+            wts = np.where(choice, highs, lows)
+            if np.sum(wts) > max_weight:
+                continue
+            cost = markowitz_cost(np.expand_dims(wts, axis=0), sigma, lam, mu)
+            if cost < best_cost:
+                best, best_cost = wts, cost
+        return best, best_cost
+
+    def check_matches_brute_force(self, seed):
+        rng = np.random.RandomState(seed)
+        for _ in range(20):
+            n = rng.randint(2, 10)
+            lam = rng.rand() * 3
+            sigma, mu, weights, lows, highs = self.random_problem(rng, n)
+            best, best_cost = self.brute_force(weights, lows, highs, sigma, lam, mu, 1.00001)
+            res = min_cost_alignment(weights, np.arange(n), lows, highs, sigma, lam, mu, 1.00001)
+            if best is None:
+                self.assertIsNone(res)
+                continue
+            self.assertLessEqual(np.sum(res), 1.00001)
+            self.assertAlmostEqual(markowitz_cost(np.expand_dims(res, axis=0), sigma, lam, mu), best_cost, places=10)
+
+    def test_min_cost_alignment_batch(self):
+        self.check_matches_brute_force(0)
+
+    @mock.patch.object(orderable, 'ALIGNMENT_BATCH_BITS', 3)
+    def test_min_cost_alignment_branching(self):
+        # Make the batches small so the branch and bound is exercised.
+        self.check_matches_brute_force(1)
+
+    def test_min_cost_alignment_over_budget(self):
+        res = min_cost_alignment(np.array([0.5, 0.5]), [0, 1], [0.6, 0.6], [0.7, 0.7],
+                                 np.eye(2), 1.0, np.ones(2), 1.0)
+        self.assertIsNone(res)
@@ -0,0 +1,96 @@
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+from cvxpy import Variable, sum_entries
+from cvxpy.constraints import EqConstraint
+from django.test import TestCase
+
+from portfolios.algorithms import markowitz
+from portfolios.algorithms.markowitz import BACKEND_CVXPY, BACKEND_NATIVE, markowitz_optimizer_3, \
+    markowitz_problem, solve_markowitz
+from portfolios.algorithms.qp import linear_constraints, solve_qp
+from portfolios.calculation import INSTRUMENT_TABLE_ASSET_CLASS_LABEL, get_core_constraints, \
+    get_model_constraint_parameters
+from portfolios.exceptions import QPNotSupported
+
+
+class QPTest(TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(42)
+        returns = rng.randn(200, 6) * 0.01
+        self.sigma = np.cov(returns, rowvar=0)
+        self.mu = rng.rand(6) * 0.1
+
+    def test_native_matches_cvxpy(self):
+        xs = Variable(6)
+        constraints = [sum_entries(xs) == 1.0,
+                       xs >= 0,
+                       sum_entries(xs[[0, 1]]) >= 0.4,
+                       sum_entries(xs[[2, 3, 4]]) <= 0.3]
+        for lam in (0.0, 0.5, 5.0):
+            native, ncost = markowitz_optimizer_3(xs, self.sigma, lam, self.mu, constraints, backend=BACKEND_NATIVE)
+            cvx, ccost = markowitz_optimizer_3(xs, self.sigma, lam, self.mu, constraints, backend=BACKEND_CVXPY)
+            np.testing.assert_allclose(native, cvx, atol=1e-4)
+            self.assertAlmostEqual(ncost, ccost, places=6)
+
+    def test_infeasible(self):
+        xs = Variable(6)
+        constraints = [sum_entries(xs) == 1.0, xs >= 0, sum_entries(xs[[0, 1]]) >= 1.5]
+        # Infeasibility is reported without solving again with cvxpy.
+        with mock.patch.object(markowitz, 'solve_markowitz_problem') as cvx_solve:
+            weights, cost = markowitz_optimizer_3(xs, self.sigma, 1.0, self.mu, constraints, backend=BACKEND_NATIVE)
+            self.assertFalse(cvx_solve.called)
+        self.assertFalse(weights.any())
+        self.assertEqual(cost, np.inf)
+
+    def test_dependent_equalities_fall_back(self):
+        xs = Variable(6)
+        constraints = [sum_entries(xs) == 1.0, sum_entries(xs) == 1.0, xs >= 0]
+        with self.assertRaises(QPNotSupported):
+            solve_qp(2 * self.sigma, self.mu, np.ones((2, 6)), np.ones(2), np.eye(6), np.zeros(6))
+        native, _ = markowitz_optimizer_3(xs, self.sigma, 1.0, self.mu, constraints, backend=BACKEND_NATIVE)
+        cvx, _ = markowitz_optimizer_3(xs, self.sigma, 1.0, self.mu, constraints, backend=BACKEND_CVXPY)
+        np.testing.assert_allclose(native, cvx, atol=1e-4)
+
+    def test_linear_constraints_match_cvxpy(self):
+        instruments = pd.DataFrame({INSTRUMENT_TABLE_ASSET_CLASS_LABEL: ['EQ', 'EQ', 'BOND', 'BOND', 'BOND', 'CASH']})
+        xs, constraints = get_core_constraints(6)
+        model_constraints, params = get_model_constraint_parameters(instruments, xs)
+        constraints += model_constraints + [sum_entries(xs[[0, 2]]) <= 0.5, xs[[5]] == 0]
+        for ac, weight in (('EQ', 0.3), ('BOND', 0.4), ('CASH', 0.0)):
+            params[ac].value = weight
+
+        C_eq, b_eq, C_in, b_in = linear_constraints(xs, constraints)
+        rng = np.random.RandomState(7)
+        for _ in range(3):
+            x = rng.rand(6)
+            xs.value = x.reshape((6, 1))
+            eqs, ins = [], []
+            for constraint in constraints:
+                value = np.asarray(constraint._expr.value, dtype=float).ravel()
+                # cvxpy constraints are expr == 0 and expr <= 0, ours C_eq x == b_eq and C_in x >= b_in.
+                if type(constraint) is EqConstraint:
+                    eqs.append(value)
+                else:
+                    ins.append(-value)
+            np.testing.assert_allclose(C_eq.dot(x) - b_eq, np.concatenate(eqs), atol=1e-12)
+            np.testing.assert_allclose(C_in.dot(x) - b_in, np.concatenate(ins), atol=1e-12)
+
+        problem = markowitz_problem(xs, self.sigma, 1.0, self.mu, constraints)
+        native, _ = solve_markowitz(problem, xs, self.sigma, 1.0, self.mu, backend=BACKEND_NATIVE)
+        cvx, _ = solve_markowitz(problem, xs, self.sigma, 1.0, self.mu, backend=BACKEND_CVXPY)
+        np.testing.assert_allclose(native, cvx, atol=1e-4)
+
+    def test_solve_qp_infeasible(self):
+        res = solve_qp(np.eye(3), np.zeros(3),
+                       np.ones((1, 3)), np.array([1.0]),
+                       np.vstack([np.eye(3), -np.ones((1, 3))]), np.array([0, 0, 0, -0.5]))
+        self.assertIsNone(res)
+
+    def test_solve_qp_bounds(self):
+        # Minimise |x|^2 / 2 - x.(1, 2) on the simplex. The optimum is (0, 1).
+        res = solve_qp(np.eye(2), np.array([1.0, 2.0]),
+                       np.ones((1, 2)), np.array([1.0]),
+                       np.eye(2), np.zeros(2))
+        np.testing.assert_allclose(res, [0, 1], atol=1e-10)
@@ -0,0 +1,44 @@
+from datetime import date
+
+import numpy as np
+import pandas as pd
+from django.test import TestCase
+
+from api.v1.tests.factories import DailyPriceFactory, TickerFactory
+from portfolios.returns import benchmark_uid, get_price_returns, get_return_history
+
+
+class ReturnsTest(TestCase):
+    def setUp(self):
+        self.dates = pd.bdate_range(date(2016, 1, 4), date(2016, 3, 31))
+        rng = np.random.RandomState(7)
+        self.funds = [TickerFactory.create() for _ in range(3)]
+        for ix, fund in enumerate(self.funds):
+            prices = 100 * np.exp(np.cumsum(rng.randn(len(self.dates)) * 0.01))
+            # Give the funds a late start, a gap with a negative price, and a split sized jump.
+            if ix == 0:
+                prices[:10] = np.nan
+            elif ix == 1:
+                prices[20:23] = np.nan
+                prices[30] = -1
+            else:
+                prices[40:] *= 3
+            for dt, price in zip(self.dates, prices):
+                if not np.isnan(price):
+                    DailyPriceFactory.create(instrument=fund, date=dt.date(), price=price)
+            for dt, price in zip(self.dates, prices * 2):
+                if not np.isnan(price):
+                    DailyPriceFactory.create(instrument=fund.benchmark, date=dt.date(), price=abs(price))
+
+    def test_get_return_history_matches_per_fund(self):
+        fund_returns, benchmark_returns = get_return_history(self.funds, self.dates[0], self.dates[-1])
+        self.assertListEqual(list(fund_returns.columns), [fund.id for fund in self.funds])
+        self.assertListEqual(list(benchmark_returns.columns), [benchmark_uid(fund) for fund in self.funds])
+        for fund in self.funds:
+            expected = get_price_returns(fund, self.dates)
+            np.testing.assert_allclose(fund_returns[fund.id].dropna().values, expected.dropna().values)
+            self.assertListEqual(list(fund_returns[fund.id].dropna().index), list(expected.dropna().index))
+            expected = get_price_returns(fund.benchmark, self.dates)
+            np.testing.assert_allclose(benchmark_returns[benchmark_uid(fund)].dropna().values,
+                                       expected.dropna().values)
+        self.assertLessEqual(fund_returns.abs().max().max(), 0.48)
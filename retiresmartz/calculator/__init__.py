@@ -1,6 +1,7 @@
 import logging
 from itertools import chain
 
+import numpy as np
 import pandas as pd
 from django.db import transaction
 from django.utils import timezone
@@ -104,33 +105,45 @@ class Calculator(object):
         by the desired_cash_flow_calculator, two cash flow columns. First is
         'desired', second is 'actual'
 
-        calculate() resets the assets and cash_flow_providers, then iteratively
-        yields a value from the desired_cash_flow_calculator, then requests all
-        income for the date, then withdraws from the assets in order until the
-        desired_cash_flow is achieved.
+        calculate() resets the assets and cash_flow_providers, then lays out the months the
+        desired_cash_flow_calculator yields on a grid. The desired amounts and the cash flows that don't depend on
+        the assets are worked out for every month at once. The assets are then stepped through the months in turn,
+        withdrawing from them in order until the desired cash flow is achieved, as each withdrawal depends on the
+        shortfall left by the ones before.
 
         :return: asset_values, income_values
         """
         [fr.reset() for fr in chain(self._cash_flows, self._assets)]
 
-        asset_values = pd.DataFrame(columns=[a.name for a in self._assets])
-        income_values = pd.DataFrame(columns=['desired', 'actual'])
-
-        for date, desired_amount in desired_cash_flow_calculator:
-            cf_amount_total = 0
-            for cf in self._cash_flows:
-                cf_amount = cf.on(date)
-                cf_amount_total += cf_amount
-
-            amount_needed = desired_amount - cf_amount_total
-            asset_value = [0] * len(self._assets)
+        grid = desired_cash_flow_calculator.month_grid()
+        for fr in chain(self._cash_flows, self._assets):
+            fr.set_grid(grid)
+        dates = grid.dates[1:]
+        desired = desired_cash_flow_calculator.desired_amounts(grid)[1:].tolist()
+
+        # Cash flows drawn from an asset depend on its balance, so are taken month by month.
+        stepped = [cf for cf in self._cash_flows if isinstance(cf, Asset)]
+        cf_amount_totals = np.zeros(len(dates))
+        for cf in self._cash_flows:
+            if cf not in stepped:
+                cf_amount_totals += cf.amounts(grid)[1:]
+        cf_amount_totals = cf_amount_totals.tolist()
+
+        asset_values = np.zeros((len(dates), len(self._assets)))
+        actual = [0] * len(dates)
+        for ix, date in enumerate(dates):
+            cf_amount_total = cf_amount_totals[ix]
+            for cf in stepped:
+                cf_amount_total += cf.on(date)
+
+            amount_needed = desired[ix] - cf_amount_total
             for i, a in enumerate(self._assets):
                 if amount_needed > 0:
                     value = a.withdraw(date, amount_needed)
                     amount_needed -= value
-                asset_value[i] = a.balance(date)
-
-            asset_values.loc[date] = asset_value
-            income_values.loc[date] = [desired_amount, desired_amount - amount_needed]
+                asset_values[ix, i] = a.balance(date)
+            actual[ix] = desired[ix] - amount_needed
 
+        asset_values = pd.DataFrame(asset_values, index=dates, columns=[a.name for a in self._assets])
+        income_values = pd.DataFrame({'desired': desired, 'actual': actual}, index=dates, columns=['desired', 'actual'])
         return asset_values, income_values
@@ -3,11 +3,11 @@ from __future__ import unicode_literals
 import datetime
 from abc import ABCMeta, abstractmethod
 
+import numpy as np
 from dateutil.relativedelta import relativedelta
 
-from main.models import Inflation
 from retiresmartz.constants import IRS_LIFE_EXPECTANCY
-from .base import FinancialResource
+from .base import FinancialResource, MonthGrid
 from .cashflows import CashFlow
 
 
@@ -62,17 +62,31 @@ class TaxPaidAccount(Asset):
         self._contributions = contributions
         self._current_balance = opening_balance
         self._current_date = today
+        self._grid = None
+        self._current_index = 0
+
+    def set_grid(self, grid: MonthGrid):
+        if grid.today != self._today:
+            return
+        self._grid = grid
+        # The growth over the month to each grid date, and the contributions added at the end of it.
+        self._growth = (self._growth_factor + grid.monthly_inflation).tolist()
+        self._contribution_amounts = np.where(grid.between(None, self._retirement_date),
+                                              self._contributions * (1 + grid.inflation()),
+                                              0).tolist()
 
     def _update_balance(self, date: datetime.date):
-        tdt = self._current_date + relativedelta(months=1)
-        while tdt <= date:
-            # Grow the asset for the month
-            self._current_balance *= (self._growth_factor + Inflation.between(self._current_date, tdt))
-            # Add the contributions at the end of the month.
-            if tdt <= self._retirement_date:
-                self._current_balance += self._contributions * (1 + Inflation.between(self._today, tdt))
-            self._current_date = tdt
-            tdt = self._current_date + relativedelta(months=1)
+        if self._grid is None or not self._grid.covers(self._today, date):
+            # Not being stepped through a grid that reaches the date, so make one that does.
+            self.set_grid(MonthGrid(self._today, date))
+
+        target = self._grid.index(date)
+        for ix in range(self._current_index + 1, target + 1):
+            self._current_balance *= self._growth[ix]
+            self._current_balance += self._contribution_amounts[ix]
+        if target > self._current_index:
+            self._current_index = target
+            self._current_date = self._grid.dates[target]
 
     def balance(self, date: datetime.date) -> float:
         # date must be >= _current_date
@@ -103,6 +117,7 @@ class TaxPaidAccount(Asset):
     def reset(self):
         self._current_date = self._today
         self._current_balance = self._opening_balance
+        self._current_index = 0
 
 
 class TaxDeferredAccount(TaxPaidAccount, CashFlow):
@@ -1,7 +1,90 @@
 from __future__ import unicode_literals
 
+import calendar
 import datetime
 from abc import ABCMeta, abstractmethod
+from bisect import bisect_right
+
+import numpy as np
+
+from main.inflation import get_index as get_inflation_index
+
+
+class MonthGrid(object):
+    """
+    The months a calculation steps through: today, then a month at a time up to an end date. Each date is a month after
+    the one before, as relativedelta steps them, so a day clamped to the end of a short month stays clamped.
+    The cumulative inflation at each date is looked up once, so the inflation between any of them is an array operation.
+    """
+    def __init__(self, today: datetime.date, end: datetime.date):
+        """
+        :param today: The first date of the grid.
+        :param end: The last date of the grid is the last monthly step on or before this.
+        :raises ValidationError: If there aren't inflation figures for every month of the grid.
+        """
+        self.today = today
+        self.dates = [today]
+        year, month, day = today.year, today.month, today.day
+        while True:
+            year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+            day = min(day, calendar.monthrange(year, month)[1])
+            dt = datetime.date(year, month, day)
+            if dt > end:
+                break
+            self.dates.append(dt)
+
+        self._index = get_inflation_index()
+        self._dates = np.array(self.dates, dtype=object)
+        self._cumulative = self._index.cumulative(self.dates)
+        # The inflation over each month to each date, as Inflation.between(previous date, date). NaN for today.
+        self.monthly_inflation = np.concatenate(([np.nan], self._cumulative[1:] / self._cumulative[:-1] - 1))
+
+    def __len__(self):
+        return len(self.dates)
+
+    def covers(self, today: datetime.date, dt: datetime.date) -> bool:
+        """
+        :return: True if the grid starts at today and reaches dt.
+        """
+        return self.today == today and dt < self._next_date()
+
+    def index(self, dt: datetime.date) -> int:
+        """
+        :return: The position of the last grid date on or before dt.
+        """
+        return bisect_right(self.dates, dt) - 1
+
+    def between(self, begin: datetime.date, end: datetime.date) -> np.ndarray:
+        """
+        :return: A boolean array of which grid dates are from begin to end, inclusive. Either may be None for no limit.
+        """
+        mask = np.ones(len(self.dates), dtype=bool)
+        if begin is not None:
+            mask &= self._dates >= begin
+        if end is not None:
+            mask &= self._dates <= end
+        return mask
+
+    def inflation(self, begin: datetime.date=None, mask: np.ndarray=None) -> np.ndarray:
+        """
+        :param begin: The date to calculate the inflation from. Defaults to today.
+        :param mask: Which grid dates the inflation is needed for. Defaults to all of them.
+        :return: Inflation.between(begin, date) for each grid date in the mask, and 0 for the others.
+        """
+        if mask is None:
+            mask = np.ones(len(self.dates), dtype=bool)
+        if begin is None or begin == self.today:
+            first = self._cumulative[0]
+        else:
+            if (self._dates[mask] < begin).any():
+                raise ValueError('End date must not be before begin date.')
+            first = self._index.cumulative(begin)
+        return np.where(mask, self._cumulative / first - 1, 0)
+
+    def _next_date(self):
+        last = self.dates[-1]
+        year, month = (last.year + 1, 1) if last.month == 12 else (last.year, last.month + 1)
+        return datetime.date(year, month, min(last.day, calendar.monthrange(year, month)[1]))
 
 
 class FinancialResource:
@@ -11,6 +94,13 @@ class FinancialResource:
     def reset(self):
         raise NotImplementedError()
 
+    def set_grid(self, grid: MonthGrid):
+        """
+        Tell the resource the months it is about to be stepped through, so it can work out what it needs for them at
+        once rather than month by month.
+        """
+        pass
+
 
 class DesiredCashFlow(FinancialResource):
     __metaclass__ = ABCMeta
@@ -24,3 +114,18 @@ class DesiredCashFlow(FinancialResource):
     @abstractmethod
     def next(self) -> (datetime.date, float):
         raise NotImplementedError()
+
+    @abstractmethod
+    def month_grid(self) -> MonthGrid:
+        """
+        :return: The grid of today and the dates this yields.
+        """
+        raise NotImplementedError()
+
+    @abstractmethod
+    def desired_amounts(self, grid: MonthGrid) -> np.ndarray:
+        """
+        :return: The amount this yields for each date of the grid after today, as an array the length of the grid.
+                 The amount for today is 0.
+        """
+        raise NotImplementedError()
@@ -3,11 +3,12 @@ from __future__ import unicode_literals
 import datetime
 from abc import abstractmethod, ABCMeta
 
+import numpy as np
 from dateutil.relativedelta import relativedelta
 
 from common.utils import months_between
 from main.models import Inflation
-from .base import FinancialResource
+from .base import FinancialResource, MonthGrid
 
 
 class CashFlow(FinancialResource):
@@ -43,6 +44,16 @@ class CashFlow(FinancialResource):
     def _for_date(self, date: datetime.date) -> float:
         raise NotImplementedError()
 
+    def amounts(self, grid: MonthGrid) -> np.ndarray:
+        """
+        The cash flow on every date of the grid, as on() would give it called for each date in turn after a reset.
+        Leaves the cash flow reset.
+        """
+        self.reset()
+        amounts = np.array([self.on(dt) for dt in grid.dates], dtype=float)
+        self.reset()
+        return amounts
+
     def reset(self):
         self.current_date = None
 
@@ -68,6 +79,9 @@ class ReverseMortgage(CashFlow):
     def _for_date(self, date: datetime.date) -> float:
         return self.monthly_payment
 
+    def amounts(self, grid: MonthGrid) -> np.ndarray:
+        return np.where(grid.between(self.start_date, self.end_date), self.monthly_payment, 0)
+
 
 class InflatedCashFlow(CashFlow):
     def __init__(self,
@@ -89,6 +103,10 @@ class InflatedCashFlow(CashFlow):
     def _for_date(self, date: datetime.date) -> float:
         return self._amount * (1 + Inflation.between(self._today, date))
 
+    def amounts(self, grid: MonthGrid) -> np.ndarray:
+        mask = grid.between(self.start_date, self.end_date)
+        return np.where(mask, self._amount * (1 + grid.inflation(self._today, mask)), 0)
+
 
 class EmploymentIncome(CashFlow):
     def __init__(self, income: float, growth: float, today: datetime.date, end_date: datetime.date):
@@ -115,6 +133,14 @@ class EmploymentIncome(CashFlow):
             tdt = self._last_date + relativedelta(months=1)
         return self._current_income
 
+    def amounts(self, grid: MonthGrid) -> np.ndarray:
+        if grid.today != self.start_date:
+            return super().amounts(grid)
+        # Grow the income for each month, in the same order as _for_date does.
+        factors = self._growth_factor + grid.monthly_inflation[1:]
+        incomes = np.cumprod(np.concatenate(([self._income], factors)))
+        return np.where(grid.between(self.start_date, self.end_date), incomes, 0)
+
     def reset(self):
         super().reset()
         self._last_date = self.start_date
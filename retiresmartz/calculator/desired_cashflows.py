@@ -2,11 +2,12 @@ from __future__ import unicode_literals
 
 import datetime
 
+import numpy as np
 from dateutil.relativedelta import relativedelta
 
 from main.models import Inflation
 from retiresmartz.calculator.cashflows import CashFlow
-from .base import DesiredCashFlow
+from .base import DesiredCashFlow, MonthGrid
 
 
 class RetiresmartzDesiredCashFlow(DesiredCashFlow, CashFlow):
@@ -55,3 +56,21 @@ class RetiresmartzDesiredCashFlow(DesiredCashFlow, CashFlow):
     def _for_date(self, date: datetime.date):
         assert date == self._current_date
         return self._cur_payment
+
+    def month_grid(self) -> MonthGrid:
+        return MonthGrid(self._today, self._stop_date)
+
+    def desired_amounts(self, grid: MonthGrid) -> np.ndarray:
+        # Each month's amount is the one for the month before: the current income up to retirement, and the retirement
+        # income, inflated, after it.
+        working = grid.between(None, self._retirement_date)
+        income = self._current_income.amounts(grid)
+        retired = self._retirement_income * (1 + grid.inflation())
+        payments = np.where(working, income, retired)
+        return np.concatenate(([0], payments[:-1]))
+
+    def amounts(self, grid: MonthGrid) -> np.ndarray:
+        # As a cash flow, this pays the current income up to retirement.
+        amounts = np.where(grid.between(self.start_date, self.end_date), self.desired_amounts(grid), 0)
+        amounts[0] = 0
+        return amounts
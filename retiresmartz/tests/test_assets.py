@@ -4,6 +4,7 @@ from dateutil.relativedelta import relativedelta
 from django.test import TestCase
 
 from common.utils import months_between
+from main.inflation import invalidate_index as invalidate_inflation_index
 from main.models import Inflation
 from retiresmartz.calculator.assets import TaxPaidAccount
 
@@ -21,9 +22,8 @@ class AssetTests(TestCase):
         while dt <= self.death:
             inflations.append(Inflation(year=dt.year, month=dt.month, value=0.001))
             dt += relativedelta(months=1)
-        if hasattr(Inflation, '_cum_data'):
-            del Inflation._cum_data
         Inflation.objects.bulk_create(inflations)
+        invalidate_inflation_index()
 
     def test_tax_paid_account(self):
         ac = TaxPaidAccount(name="Test Account",
@@ -3,6 +3,7 @@ import datetime
 from dateutil.relativedelta import relativedelta
 from django.test import TestCase
 
+from main.inflation import invalidate_index as invalidate_inflation_index
 from main.models import Inflation
 from retiresmartz.calculator import Calculator
 from retiresmartz.calculator.assets import TaxDeferredAccount, TaxPaidAccount
@@ -22,9 +23,8 @@ class CalculatorTest(TestCase):
         while dt <= self.death:
             inflations.append(Inflation(year=dt.year, month=dt.month, value=0.001))
             dt += relativedelta(months=1)
-        if hasattr(Inflation, '_cum_data'):
-            del Inflation._cum_data
         Inflation.objects.bulk_create(inflations)
+        invalidate_inflation_index()
 
     def test_calculate(self):
         dob = datetime.date(1960, 3, 14)
@@ -56,3 +56,10 @@ class CalculatorTest(TestCase):
         # TODO: Actually test the calculator is working properly
         self.assertEqual(len(asset_values.values), 460)
         self.assertEqual(len(income_values.values), 460)
+        self.assertEqual(asset_values.index[0], self.today + relativedelta(months=1))
+        self.assertEqual(asset_values.index[-1], self.death)
+        # Before retirement the income is all from employment, and the assets only grow.
+        self.assertEqual(income_values['desired'].iloc[0], 4000)
+        working = income_values.index < self.retirement
+        self.assertListEqual(list(income_values['actual'][working]), list(income_values['desired'][working]))
+        self.assertTrue((asset_values[working].diff().iloc[1:] > 0).all().all())
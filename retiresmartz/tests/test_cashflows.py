@@ -4,8 +4,10 @@ from dateutil.relativedelta import relativedelta
 from django.test import TestCase
 
 from common.utils import months_between
+from main.inflation import invalidate_index as invalidate_inflation_index
 from main.models import Inflation
-from retiresmartz.calculator.cashflows import InflatedCashFlow, ReverseMortgage, EmploymentIncome
+from retiresmartz.calculator.base import MonthGrid
+from retiresmartz.calculator.cashflows import CashFlow, InflatedCashFlow, ReverseMortgage, EmploymentIncome
 
 
 class CashFlowTests(TestCase):
@@ -21,9 +23,8 @@ class CashFlowTests(TestCase):
         while dt <= self.death:
             inflations.append(Inflation(year=dt.year, month=dt.month, value=0.001))
             dt += relativedelta(months=1)
-        if hasattr(Inflation, '_cum_data'):
-            del Inflation._cum_data
         Inflation.objects.bulk_create(inflations)
+        invalidate_inflation_index()
 
     def test_inflated_cash_flow(self):
         cf = InflatedCashFlow(amount=116,
@@ -113,3 +114,14 @@ class CashFlowTests(TestCase):
         # Make sure a reset allows previous dates again, and we get the same result
         cf.reset()
         self.assertAlmostEqual(predicted, cf.on(self.retirement), 4)
+
+    def test_amounts(self):
+        grid = MonthGrid(self.today, self.death)
+        self.assertEqual(len(grid), months_between(self.today, self.death) + 1)
+        cash_flows = [InflatedCashFlow(116, datetime.date(2015, 9, 1), self.retirement,
+                                       self.dob + relativedelta(years=85)),
+                      ReverseMortgage(200000, self.today, self.retirement, self.death),
+                      EmploymentIncome(4000, 0.01, self.today, self.retirement)]
+        for cf in cash_flows:
+            # The amounts for the whole grid are those given month by month.
+            self.assertListEqual(list(cf.amounts(grid)), list(CashFlow.amounts(cf, grid)))
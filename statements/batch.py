@@ -0,0 +1,142 @@
+"""
+Generates the PDFs of many statements at once, such as for a month end run over every account.
+
+The HTML of each statement is rendered here, as that needs the database, and the PDFs are made from it in a pool of
+worker processes. Each worker keeps the resources it fetched, so the static images, stylesheets and logos are loaded
+once per worker rather than once per statement. A statement is skipped if its HTML hashes the same as that its PDF was
+made from. The PDFs are written to storage from a pool of threads while the next ones render.
+
+Generation is synchronous: it runs in the calling process, such as the generate_statements management command, and
+isn't queued to a task worker.
+"""
+import logging
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.files.base import ContentFile
+from django.db import connections
+
+from statements.rendering import content_hash, html_to_pdf
+
+logger = logging.getLogger(__name__)
+
+# The most statements read and rendered to HTML at a time.
+BATCH_SIZE = 100
+
+# The most PDFs written to storage at once.
+STORAGE_THREADS = 4
+
+
+def statement_models():
+    """
+    :return: {name: (model, related fields the statement templates use)}
+    """
+    from statements.models import RecordOfAdvice, RetirementStatementOfAdvice, StatementOfAdvice
+
+    owner = ('account__primary_owner__user', 'account__primary_owner__advisor__user',
+             'account__primary_owner__advisor__firm')
+    return {
+        'statement_of_advice': (StatementOfAdvice, owner),
+        'retirement_statement_of_advice': (RetirementStatementOfAdvice,
+                                           ('retirement_plan__client__user', 'retirement_plan__client__advisor__user',
+                                            'retirement_plan__client__advisor__firm')),
+        'record_of_advice': (RecordOfAdvice, owner),
+    }
+
+
+def generate_model_statements(name, ids=None, force=False, processes=None, batch_size=BATCH_SIZE):
+    """
+    Generate the PDFs of the statements of one type.
+    :param name: The key of the type in statement_models()
+    :param ids: The ids of the statements to generate, or None for all of them.
+    :return: As for generate_statements
+    """
+    model, related = statement_models()[name]
+    statements = model.objects.select_related(*related).order_by('id')
+    if ids is not None:
+        statements = statements.filter(id__in=list(ids))
+    return generate_statements(statements, force=force, processes=processes, batch_size=batch_size)
+
+
+def generate_statements(statements, force=False, processes=None, batch_size=BATCH_SIZE):
+    """
+    Render the PDFs of the statements whose HTML has changed since their last PDF, and write them to storage.
+    :param statements: Iterable of PDFStatements. A queryset is read batch_size statements at a time.
+    :param force: Render every statement, even if its HTML is unchanged.
+    :param processes: The number of worker processes. None for one per CPU. 1 renders in this process.
+    :return: {'generated': , 'skipped': , 'failed': } counts of statements.
+    """
+    counts = {'generated': 0, 'skipped': 0, 'failed': 0}
+    if processes == 1:
+        pool = None
+        render = map
+    else:
+        # The workers are forked, and mustn't share our database connections.
+        connections.close_all()
+        pool = multiprocessing.Pool(processes)
+        render = pool.imap
+    writer = ThreadPoolExecutor(STORAGE_THREADS)
+    try:
+        for batch in _batches(statements, batch_size):
+            todo = []
+            for statement in batch:
+                html = statement.render_html()
+                digest = content_hash(html)
+                if statement.pdf and statement.content_hash == digest and not force:
+                    counts['skipped'] += 1
+                else:
+                    todo.append((statement, html, digest))
+
+            writes = []
+            pdfs = render(html_to_pdf, [html for _, html, _ in todo])
+            for statement, _, digest in todo:
+                try:
+                    pdf = next(pdfs)
+                except Exception:
+                    logger.exception("Couldn't render the PDF of {}".format(statement))
+                    counts['failed'] += 1
+                    continue
+                writes.append((statement, digest, writer.submit(_write_pdf, statement, pdf)))
+
+            for statement, digest, write in writes:
+                try:
+                    name = write.result()
+                except Exception:
+                    logger.exception("Couldn't write the PDF of {}".format(statement))
+                    counts['failed'] += 1
+                    continue
+                old_name = statement.pdf.name
+                type(statement).objects.filter(id=statement.id).update(pdf=name, content_hash=digest)
+                if old_name and old_name != name:
+                    writer.submit(statement.pdf.storage.delete, old_name)
+                counts['generated'] += 1
+            logger.info("Generated {generated}, skipped {skipped} and failed {failed} statements so far".format(
+                **counts))
+    finally:
+        writer.shutdown(wait=True)
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return counts
+
+
+def _write_pdf(statement, pdf):
+    """
+    :return: The name the PDF was saved as.
+    """
+    field = statement.pdf.field
+    return statement.pdf.storage.save(field.generate_filename(statement, statement.pdf_name), ContentFile(pdf))
+
+
+def _batches(statements, size):
+    if hasattr(statements, 'iterator'):
+        # Only read a batch at a time, rather than caching the whole queryset.
+        statements = statements.iterator()
+    batch = []
+    for statement in statements:
+        batch.append(statement)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
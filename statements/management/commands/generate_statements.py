@@ -0,0 +1,29 @@
+import logging
+
+from django.core.management.base import BaseCommand
+
+from statements.batch import BATCH_SIZE, generate_model_statements, statement_models
+
+logger = logging.getLogger("generate_statements")
+
+
+class Command(BaseCommand):
+    help = "Renders the PDFs of the statements whose contents have changed since their last PDF was made."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--type', dest='types', action='append', choices=sorted(statement_models()),
+                            help='Type of statement to generate. May be given more than once. Defaults to all types.')
+        parser.add_argument('--id', dest='ids', type=int, action='append',
+                            help='Id of a statement to generate. May be given more than once. Defaults to all.')
+        parser.add_argument('--force', action='store_true', default=False,
+                            help='Render every statement, even those whose contents are unchanged.')
+        parser.add_argument('--processes', type=int,
+                            help='Number of processes to render the PDFs in. Defaults to one per CPU.')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                            help='Number of statements to read from the database at a time.')
+
+    def handle(self, *args, **options):
+        for name in options['types'] or sorted(statement_models()):
+            counts = generate_model_statements(name, ids=options['ids'], force=options['force'],
+                                               processes=options['processes'], batch_size=options['batch_size'])
+            logger.info("{}: generated {generated}, skipped {skipped} and failed {failed}".format(name, **counts))
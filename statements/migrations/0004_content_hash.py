@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('statements', '0003_auto_20160920_0455'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recordofadvice',
+            name='content_hash',
+            field=models.CharField(max_length=64, blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='retirementstatementofadvice',
+            name='content_hash',
+            field=models.CharField(max_length=64, blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='statementofadvice',
+            name='content_hash',
+            field=models.CharField(max_length=64, blank=True, default=''),
+        ),
+    ]
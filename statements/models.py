@@ -1,16 +1,18 @@
 import logging
 from django.db import models
-from weasyprint import HTML
 from django.conf import settings
-from io import BytesIO
 from django.core.files.base import ContentFile
 
+from statements.rendering import content_hash, html_to_pdf
+
 logger = logging.getLogger(__name__)
 
 
 class PDFStatement(models.Model):
     create_date = models.DateTimeField(auto_now_add=True)
     pdf = models.FileField(null=True, blank=True)
+    # The hash of the HTML the pdf was rendered from.
+    content_hash = models.CharField(max_length=64, blank=True, default='')
 
     @property
     def date(self):
@@ -29,20 +31,25 @@ class PDFStatement(models.Model):
             'firm': self.client.advisor.firm,
         })
 
-    def render_pdf(self, template_name=None):
+    def render_html(self, template_name=None):
         html = self.render_template(template_name)
         # Have to source the images locally for WeasyPrint
         static_path = settings.STATICFILES_DIRS[0]
-        html = html.replace('/static/', 'file://%s/' % static_path)
-        pdf_builder = HTML(string=html)
-        return pdf_builder.write_pdf()
+        return html.replace('/static/', 'file://%s/' % static_path)
+
+    def render_pdf(self, template_name=None):
+        return html_to_pdf(self.render_html(template_name))
+
+    @property
+    def pdf_name(self):
+        return '%s.pdf' % self.account
 
     def save(self, *args, **kwargs):
         super(PDFStatement, self).save(*args, **kwargs)
         if not self.pdf:
-            bio = BytesIO(self.render_pdf())
-            self.pdf.save('%s.pdf' % self.account,
-                          ContentFile(bio.getvalue()))
+            html = self.render_html()
+            self.content_hash = content_hash(html)
+            self.pdf.save(self.pdf_name, ContentFile(html_to_pdf(html)))
 
     @property
     def default_template(self):
@@ -0,0 +1,50 @@
+"""
+Turns statement HTML into PDFs. The resources a statement links to, such as the static background images, stylesheets
+and firm logos, are fetched once per process and reused for every document rendered there after.
+"""
+import hashlib
+import logging
+
+from weasyprint import HTML, default_url_fetcher
+
+logger = logging.getLogger(__name__)
+
+# The most resources kept in each process.
+RESOURCE_CACHE_SIZE = 256
+
+_resources = {}
+
+
+def cached_url_fetcher(url):
+    """
+    A WeasyPrint url fetcher that keeps what it fetched for the life of the process. data: URLs aren't kept.
+    """
+    if url.lower().startswith('data:'):
+        return default_url_fetcher(url)
+    if url not in _resources:
+        result = default_url_fetcher(url)
+        if 'file_obj' in result:
+            file_obj = result.pop('file_obj')
+            try:
+                result['string'] = file_obj.read()
+            finally:
+                file_obj.close()
+        if len(_resources) >= RESOURCE_CACHE_SIZE:
+            _resources.clear()
+        _resources[url] = result
+    return dict(_resources[url])
+
+
+def html_to_pdf(html):
+    """
+    :param html: The statement HTML, with any static files as file:// URLs.
+    :return: The PDF bytes.
+    """
+    return HTML(string=html, url_fetcher=cached_url_fetcher).write_pdf()
+
+
+def content_hash(html):
+    """
+    :return: A hash of the statement HTML. The PDF only needs rendering again when this changes.
+    """
+    return hashlib.sha256(html.encode('utf-8')).hexdigest()
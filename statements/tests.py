@@ -7,6 +7,8 @@ from api.v1.tests.factories import ClientFactory, ClientAccountFactory, External
                                    RetirementPlanFactory
 from main.constants import ACCOUNT_TYPE_PERSONAL
 from common.constants import GROUP_SUPPORT_STAFF
+from statements.batch import generate_model_statements
+from statements.models import StatementOfAdvice
 
 import sys
 
@@ -77,3 +79,19 @@ class StatementTest(TestCase):
         if '-v3' in sys.argv:
             open('.test.blank-soa.pdf', 'wb+').write(test_pdf)
             open('.test.real-soa.pdf', 'wb+').write(real_soa)
+
+    def test_generate_statements(self):
+        soa = StatementOfAdviceFactory(account=self.betasmartz_client_account)
+        self.assertTrue(soa.pdf)
+        self.assertEqual(len(soa.content_hash), 64)
+
+        # Nothing has changed since the PDF was made on save.
+        counts = generate_model_statements('statement_of_advice', processes=1)
+        self.assertDictEqual(counts, {'generated': 0, 'skipped': 1, 'failed': 0})
+
+        StatementOfAdvice.objects.filter(id=soa.id).update(content_hash='')
+        counts = generate_model_statements('statement_of_advice', processes=1)
+        self.assertDictEqual(counts, {'generated': 1, 'skipped': 0, 'failed': 0})
+        regenerated = StatementOfAdvice.objects.get(id=soa.id)
+        self.assertEqual(regenerated.content_hash, soa.content_hash)
+        self.assertGreaterEqual(regenerated.pdf.size, 25*1024)
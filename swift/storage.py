@@ -1,11 +1,16 @@
 import hmac
+import io
 import mimetypes
 import magic
 import os
+import queue
 import re
+import shutil
+import tempfile
+import threading
+from contextlib import contextmanager
 from datetime import datetime
 from hashlib import sha1
-from io import BytesIO
 from time import time
 
 from django.utils.deconstruct import deconstructible
@@ -23,6 +28,7 @@ logger = logging.getLogger(__name__)
 
 try:
     import swiftclient
+    from swiftclient.utils import LengthWrapper
 except ImportError:
     raise ImproperlyConfigured("Could not load swiftclient library")
 
@@ -31,6 +37,107 @@ def setting(name, default=None):
     return getattr(settings, name, default)
 
 
+class ConnectionPool(object):
+    """
+    A bounded pool of HTTP connections to one storage URL, shared by all the threads of the process. A connection is
+    only used for one request at a time. A streamed download keeps its connection until the body has been read to the
+    end or closed.
+    """
+    def __init__(self, url, size, timeout):
+        self.url = url
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    def get(self):
+        """
+        :return: An idle connection, or a new one if there are free slots. Waits up to timeout seconds for one.
+        """
+        if not self._slots.acquire(timeout=self.timeout):
+            raise swiftclient.ClientException(
+                "No connection to {} was free within {} seconds".format(self.url, self.timeout))
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return swiftclient.http_connection(self.url)
+
+    def put(self, conn, reuse=True):
+        """
+        Give a connection back to the pool.
+        :param reuse: False if the connection is in an unknown state, so it's dropped rather than used again.
+        """
+        if reuse:
+            self._idle.put(conn)
+        self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        conn = self.get()
+        try:
+            yield conn
+        except swiftclient.ClientException:
+            # The error response was read in full, so the connection is still good.
+            self.put(conn)
+            raise
+        except Exception:
+            self.put(conn, reuse=False)
+            raise
+        else:
+            self.put(conn)
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(url, size, timeout):
+    """
+    :return: The process wide ConnectionPool for the storage URL.
+    """
+    with _pools_lock:
+        if url not in _pools:
+            _pools[url] = ConnectionPool(url, size, timeout)
+        return _pools[url]
+
+
+class SwiftObjectFile(io.RawIOBase):
+    """
+    A read only file over a streamed object body, read a chunk at a time rather than all into memory. It can't seek.
+    """
+    def __init__(self, name, mode, body, release):
+        """
+        :param body: The object body, as swiftclient.get_object returns it when given a resp_chunk_size.
+        :param release: Called with whether the body was read to the end once the file is done with it.
+        """
+        super(SwiftObjectFile, self).__init__()
+        self.name = name
+        self.mode = mode
+        self._body = body
+        self._release = release
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        if self._body is None:
+            return 0
+        data = self._body.read(len(b))
+        if not data:
+            self._finish(True)
+            return 0
+        b[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        self._finish(False)
+        super(SwiftObjectFile, self).close()
+
+    def _finish(self, complete):
+        if self._body is not None:
+            self._body = None
+            self._release(complete)
+
+
 @deconstructible
 class SwiftStorage(Storage):
     api_auth_url = setting('SWIFT_AUTH_URL')
@@ -61,6 +168,21 @@ class SwiftStorage(Storage):
     _token_creation_time = 0
     _token = ''
     name_prefix = setting('SWIFT_NAME_PREFIX', "")
+    # Objects are read and written this many bytes at a time.
+    chunk_size = setting('SWIFT_CHUNK_SIZE', 64 * 1024)
+    # Files bigger than this are uploaded in segments of this size, with a manifest object to join them up.
+    segment_size = setting('SWIFT_SEGMENT_SIZE', 256 * 1024 * 1024)
+    segments_container_name = setting('SWIFT_SEGMENTS_CONTAINER_NAME')
+    # The most objects fetched with each request for a container listing.
+    listing_limit = setting('SWIFT_LISTING_LIMIT', 1000)
+    # The most connections open to the storage at once in a process, and how long to wait for a free one.
+    pool_size = setting('SWIFT_POOL_SIZE', 10)
+    pool_timeout = setting('SWIFT_POOL_TIMEOUT', 30)
+    # Objects read are kept in this directory, if set, so they can be served again without downloading them.
+    cache_dir = setting('SWIFT_CACHE_DIR')
+    cache_timeout = setting('SWIFT_CACHE_TIMEOUT', 60 * 60)
+    cache_max_size = setting('SWIFT_CACHE_MAX_SIZE', 1024 * 1024 * 1024)
+    cache_max_object_size = setting('SWIFT_CACHE_MAX_OBJECT_SIZE', 32 * 1024 * 1024)
 
     def __init__(self, **settings):
         # check if some of the settings provided as class attributes
@@ -89,14 +211,17 @@ class SwiftStorage(Storage):
             self.api_key,
             auth_version=self.auth_version,
             os_options=os_options)
-        self.http_conn = swiftclient.http_connection(self.storage_url)
+        self.pool = get_pool(self.storage_url, self.pool_size, self.pool_timeout)
+        if self.segments_container_name is None:
+            self.segments_container_name = self.container_name + '_segments'
 
         # Check container
         try:
-            swiftclient.head_container(self.storage_url,
-                                       self.token,
-                                       self.container_name,
-                                       http_conn=self.http_conn)
+            with self.pool.connection() as conn:
+                swiftclient.head_container(self.storage_url,
+                                           self.token,
+                                           self.container_name,
+                                           http_conn=conn)
         except swiftclient.ClientException:
             headers = {}
             if self.auto_create_container:
@@ -105,11 +230,12 @@ class SwiftStorage(Storage):
                 if self.auto_create_container_allow_orgin:
                     headers['X-Container-Meta-Access-Control-Allow-Origin'] = \
                         self.auto_create_container_allow_orgin
-                swiftclient.put_container(self.storage_url,
-                                          self.token,
-                                          self.container_name,
-                                          http_conn=self.http_conn,
-                                          headers=headers)
+                with self.pool.connection() as conn:
+                    swiftclient.put_container(self.storage_url,
+                                              self.token,
+                                              self.container_name,
+                                              http_conn=conn,
+                                              headers=headers)
             else:
                 raise ImproperlyConfigured(
                     "Container %s does not exist." % self.container_name)
@@ -153,18 +279,40 @@ class SwiftStorage(Storage):
     token = property(get_token, set_token)
 
     def _open(self, name, mode='rb'):
+        """
+        Stream the object rather than reading it into memory. If there's a cache directory, objects small enough are
+        copied there on the way and served from there until they're older than the cache timeout.
+        """
         if self.name_prefix:
             name = self.name_prefix + name
 
-        headers, content = swiftclient.get_object(self.storage_url,
-                                                  self.token,
-                                                  self.container_name,
-                                                  name,
-                                                  http_conn=self.http_conn)
-        buf = BytesIO(content)
-        buf.name = os.path.basename(name)
-        buf.mode = mode
-        return File(buf)
+        cached = self._cache_path(name)
+        if cached is not None and os.path.exists(cached) and time() - os.path.getmtime(cached) < self.cache_timeout:
+            return File(open(cached, mode), name=os.path.basename(name))
+
+        conn = self.pool.get()
+        try:
+            headers, body = swiftclient.get_object(self.storage_url,
+                                                   self.token,
+                                                   self.container_name,
+                                                   name,
+                                                   http_conn=conn,
+                                                   resp_chunk_size=self.chunk_size)
+        except Exception as e:
+            self.pool.put(conn, reuse=isinstance(e, swiftclient.ClientException))
+            raise
+        raw = SwiftObjectFile(os.path.basename(name), mode, body,
+                              lambda complete: self.pool.put(conn, reuse=complete))
+        stream = io.BufferedReader(raw, buffer_size=self.chunk_size)
+        size = int(headers.get('content-length', 0))
+        if cached is not None and size <= self.cache_max_object_size:
+            with stream:
+                self._cache_object(cached, stream)
+            return File(open(cached, mode), name=os.path.basename(name))
+
+        f = File(stream, name=os.path.basename(name))
+        f.size = size
+        return f
 
     def _save(self, name, content):
         # quick fix for '.' directories end up on softlayer strip the ./ from name
@@ -180,15 +328,57 @@ class SwiftStorage(Storage):
         else:
             content_type = mimetypes.guess_type(name)[0]
         self.get_token()  # in case token is old
-        swiftclient.put_object(self.storage_url,
-                               self.token,
-                               self.container_name,
-                               name,
-                               content,
-                               http_conn=self.http_conn,
-                               content_type=content_type)
+        # The segments of a large object being replaced are removed once the new object is in place.
+        old_manifest = self._manifest(name)
+        size = content.size
+        manifest = None
+        if size > self.segment_size:
+            manifest = self._save_segments(name, content, size, content_type)
+        else:
+            with self.pool.connection() as conn:
+                swiftclient.put_object(self.storage_url,
+                                       self.token,
+                                       self.container_name,
+                                       name,
+                                       content,
+                                       content_length=size,
+                                       chunk_size=self.chunk_size,
+                                       http_conn=conn,
+                                       content_type=content_type)
+        self._forget(name)
+        if old_manifest and old_manifest != manifest:
+            self._delete_segments(old_manifest)
         return name
 
+    def _save_segments(self, name, content, size, content_type):
+        """
+        Upload the content as a dynamic large object: segments of up to segment_size in the segments container, then a
+        manifest object under name that joins them up. Each segment is streamed from the content.
+        :return: The manifest, as the X-Object-Manifest header of the object.
+        """
+        prefix = '{}/{:f}/'.format(name, time())
+        manifest = urlparse.quote('{}/{}'.format(self.segments_container_name, prefix))
+        with self.pool.connection() as conn:
+            swiftclient.put_container(self.storage_url, self.token, self.segments_container_name, http_conn=conn)
+            for ix, offset in enumerate(range(0, size, self.segment_size)):
+                swiftclient.put_object(self.storage_url,
+                                       self.token,
+                                       self.segments_container_name,
+                                       '{}{:08d}'.format(prefix, ix),
+                                       LengthWrapper(content, min(self.segment_size, size - offset)),
+                                       chunk_size=self.chunk_size,
+                                       http_conn=conn)
+            swiftclient.put_object(self.storage_url,
+                                   self.token,
+                                   self.container_name,
+                                   name,
+                                   '',
+                                   http_conn=conn,
+                                   content_type=content_type,
+                                   headers={'X-Object-Manifest': manifest})
+        logger.info("Uploaded {} in {} segments".format(name, (size - 1) // self.segment_size + 1))
+        return manifest
+
     def get_headers(self, name):
         """
         Optimization : only fetch headers once when several calls are made
@@ -202,12 +392,13 @@ class SwiftStorage(Storage):
 
         if name != self.last_headers_name:
             # miss -> update
-            self.last_headers_value = swiftclient.head_object(
-                self.storage_url,
-                self.token,
-                self.container_name,
-                name,
-                http_conn=self.http_conn)
+            with self.pool.connection() as conn:
+                self.last_headers_value = swiftclient.head_object(
+                    self.storage_url,
+                    self.token,
+                    self.container_name,
+                    name,
+                    http_conn=conn)
             self.last_headers_name = name
         return self.last_headers_value
 
@@ -219,14 +410,21 @@ class SwiftStorage(Storage):
         return True
 
     def delete(self, name):
+        manifest = self._manifest(name)
         try:
-            swiftclient.delete_object(self.storage_url,
-                                      self.token,
-                                      self.container_name,
-                                      name,
-                                      http_conn=self.http_conn)
+            with self.pool.connection() as conn:
+                swiftclient.delete_object(self.storage_url,
+                                          self.token,
+                                          self.container_name,
+                                          name,
+                                          http_conn=conn)
         except swiftclient.ClientException:
             pass
+        else:
+            if manifest:
+                # Remove the segments of a large object too.
+                self._delete_segments(manifest)
+        self._forget(name)
 
     def get_valid_name(self, name):
         s = name.strip().replace(' ', '_')
@@ -277,18 +475,19 @@ class SwiftStorage(Storage):
         return '.' not in name
 
     def listdir(self, path):
-        container = swiftclient.get_container(self.storage_url, self.token,
-                                              self.container_name)
+        """
+        List one level of the container under path, a page at a time.
+        """
         files = []
         dirs = []
         path = self.name_prefix + path
-        for obj in container[1]:
-            if not obj['name'].startswith(path):
+        if path and not path.endswith('/'):
+            path += '/'
+        for obj in self._iter_listing(self.container_name, prefix=path, delimiter='/'):
+            key = obj.get('subdir', obj.get('name'))[len(path):].strip('/')
+            if not key:
                 continue
 
-            remaining_path = obj['name'][len(path):].split('/')
-            key = remaining_path[0] if remaining_path[0] else remaining_path[1]
-
             if not self.isdir(key):
                 files.append(key)
             elif key not in dirs:
@@ -296,22 +495,116 @@ class SwiftStorage(Storage):
         return dirs, files
 
     def makedirs(self, dirs):
-        swiftclient.put_object(self.storage_url,
-                               token=self.token,
-                               container=self.container_name,
-                               name=self.name_prefix + dirs,
-                               contents='')
+        with self.pool.connection() as conn:
+            swiftclient.put_object(self.storage_url,
+                                   token=self.token,
+                                   container=self.container_name,
+                                   name=self.name_prefix + dirs,
+                                   contents='',
+                                   http_conn=conn)
 
     def rmtree(self, abs_path):
-        container = swiftclient.get_container(self.storage_url, self.token,
-                                              self.container_name)
+        self._delete_listed(self.container_name, abs_path)
 
-        for obj in container[1]:
-            if obj['name'].startswith(abs_path):
+    def _iter_listing(self, container, prefix=None, delimiter=None):
+        """
+        :return: Iterator over the objects in the container starting with prefix, fetched listing_limit at a time.
+        """
+        marker = None
+        while True:
+            with self.pool.connection() as conn:
+                page = swiftclient.get_container(self.storage_url,
+                                                 self.token,
+                                                 container,
+                                                 marker=marker,
+                                                 limit=self.listing_limit,
+                                                 prefix=prefix,
+                                                 delimiter=delimiter,
+                                                 http_conn=conn)[1]
+            for obj in page:
+                yield obj
+            if len(page) < self.listing_limit:
+                return
+            marker = page[-1].get('name', page[-1].get('subdir'))
+
+    def _delete_listed(self, container, prefix):
+        # Collect the names first, so deleting doesn't move the listing on under us.
+        names = [obj['name'] for obj in self._iter_listing(container, prefix=prefix) if 'name' in obj]
+        for name in names:
+            with self.pool.connection() as conn:
                 swiftclient.delete_object(self.storage_url,
                                           token=self.token,
-                                          container=self.container_name,
-                                          name=obj['name'])
+                                          container=container,
+                                          name=name,
+                                          http_conn=conn)
+
+    def _manifest(self, name):
+        """
+        :return: The segments the object named joins up, as its X-Object-Manifest header gives them, or None if it's
+                 not a large object or doesn't exist.
+        """
+        try:
+            with self.pool.connection() as conn:
+                headers = swiftclient.head_object(self.storage_url,
+                                                  self.token,
+                                                  self.container_name,
+                                                  name,
+                                                  http_conn=conn)
+        except swiftclient.ClientException:
+            return None
+        return headers.get('x-object-manifest')
+
+    def _delete_segments(self, manifest):
+        container, prefix = urlparse.unquote(manifest).split('/', 1)
+        self._delete_listed(container, prefix)
+
+    def _forget(self, name):
+        """
+        Drop what we know about an object that has been written or deleted.
+        """
+        if name == self.last_headers_name:
+            self.last_headers_name = None
+        cached = self._cache_path(name)
+        if cached is not None and os.path.exists(cached):
+            os.remove(cached)
+
+    def _cache_path(self, name):
+        """
+        :return: Where the object is kept in the cache directory, or None if there's no cache.
+        """
+        if not self.cache_dir:
+            return None
+        key = sha1('{}/{}'.format(self.container_name, name).encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, key)
+
+    def _cache_object(self, path, stream):
+        """
+        Copy the stream to path, via a temporary file so readers never see part of it, then keep the cache directory
+        under cache_max_size by removing the files read least recently.
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=self.cache_dir, prefix='.tmp', delete=False) as tmp:
+            shutil.copyfileobj(stream, tmp, self.chunk_size)
+        os.replace(tmp.name, path)
+
+        entries = []
+        for entry in os.listdir(self.cache_dir):
+            if entry.startswith('.tmp'):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.cache_dir, entry))
+            except OSError:
+                continue
+            entries.append((stat.st_atime, stat.st_size, entry))
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry in sorted(entries):
+            if total <= self.cache_max_size:
+                break
+            try:
+                os.remove(os.path.join(self.cache_dir, entry))
+            except OSError:
+                pass
+            total -= size
 
 
 class StaticSwiftStorage(SwiftStorage):
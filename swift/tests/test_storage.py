@@ -0,0 +1,183 @@
+import os
+import shutil
+import tempfile
+from io import BytesIO
+from unittest import mock
+
+from django.core.files.base import ContentFile
+from django.test import TestCase
+
+from swift import storage
+
+
+class FakeBody(object):
+    def __init__(self, data):
+        self._data = BytesIO(data)
+
+    def read(self, length=None):
+        return self._data.read(length)
+
+
+class FakeSwift(object):
+    """
+    Enough of an object store to stand in for the swiftclient functions the storage uses.
+    """
+    def __init__(self):
+        self.containers = {'media': {}}
+        self.listings = 0
+        self.connections = 0
+        self.downloads = 0
+
+    def http_connection(self, url):
+        self.connections += 1
+        return url, self.connections
+
+    def head_container(self, url, token, container, http_conn=None):
+        return {}
+
+    def put_container(self, url, token, container, http_conn=None, headers=None):
+        self.containers.setdefault(container, {})
+
+    def put_object(self, url, token=None, container=None, name=None, contents=None, content_length=None,
+                   chunk_size=None, http_conn=None, content_type=None, headers=None):
+        if isinstance(contents, (str, bytes)):
+            chunks = [contents]
+        else:
+            chunks = []
+            chunk = contents.read(7)
+            while chunk:
+                chunks.append(chunk)
+                chunk = contents.read(7)
+        data = b''.join(chunk.encode() if isinstance(chunk, str) else chunk for chunk in chunks)
+        self.containers[container][name] = (data, headers or {})
+
+    def head_object(self, url, token, container, name, http_conn=None):
+        if name not in self.containers[container]:
+            raise storage.swiftclient.ClientException('Object HEAD failed', http_status=404)
+        data, headers = self.containers[container][name]
+        headers = {key.lower(): value for key, value in headers.items()}
+        headers['content-length'] = str(len(data))
+        return headers
+
+    def get_object(self, url, token, container, name, http_conn=None, resp_chunk_size=None):
+        headers = self.head_object(url, token, container, name)
+        self.downloads += 1
+        return headers, FakeBody(self.containers[container][name][0])
+
+    def delete_object(self, url, token=None, container=None, name=None, http_conn=None):
+        del self.containers[container][name]
+
+    def get_container(self, url, token, container, marker=None, limit=None, prefix=None, delimiter=None,
+                      http_conn=None):
+        self.listings += 1
+        listing = []
+        for name in sorted(self.containers[container]):
+            if prefix and not name.startswith(prefix):
+                continue
+            rest = name[len(prefix or ''):]
+            if delimiter and delimiter in rest:
+                entry = {'subdir': (prefix or '') + rest.split(delimiter)[0] + delimiter}
+            else:
+                entry = {'name': name}
+            key = entry.get('name', entry.get('subdir'))
+            if (marker is None or key > marker) and entry not in listing:
+                listing.append(entry)
+        return {}, listing[:limit]
+
+
+class SwiftStorageTest(TestCase):
+    def setUp(self):
+        self.swift = FakeSwift()
+        names = ['http_connection', 'head_container', 'put_container', 'put_object', 'head_object', 'get_object',
+                 'delete_object', 'get_container']
+        patches = [mock.patch.object(storage.swiftclient, name, getattr(self.swift, name)) for name in names]
+        patches.append(mock.patch.object(storage.swiftclient, 'get_auth', return_value=('http://swift', 'token')))
+        patches.append(mock.patch.dict(storage._pools, clear=True))
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.storage = storage.SwiftStorage(container_name='media', listing_limit=2, pool_size=1, pool_timeout=0,
+                                            segment_size=10, chunk_size=4)
+
+    def test_open_streams(self):
+        self.storage.save('doc.txt', ContentFile(b'statement'))
+        f = self.storage.open('doc.txt')
+        self.assertEqual(f.size, 9)
+        self.assertEqual(f.read(4), b'stat')
+        # The only connection is still streaming the body.
+        self.assertRaises(storage.swiftclient.ClientException, self.storage.pool.get)
+        self.assertEqual(f.read(), b'ement')
+        self.assertTrue(self.storage.exists('doc.txt'))
+        self.assertEqual(self.swift.connections, 1)
+
+    def test_save_segments(self):
+        self.storage.save('big.txt', ContentFile(b'0123456789abcdefghijklmno'))
+        segments = self.swift.containers['media_segments']
+        self.assertListEqual([data for _, (data, _) in sorted(segments.items())],
+                             [b'0123456789', b'abcdefghij', b'klmno'])
+        self.assertIn('X-Object-Manifest', self.swift.containers['media']['big.txt'][1])
+        self.storage.delete('big.txt')
+        self.assertDictEqual(segments, {})
+
+    def test_listing_pages(self):
+        for name in ('a/1.txt', 'a/2.txt', 'a/b/3.txt', 'a/c/4.txt', 'd/5.txt'):
+            self.storage.save(name, ContentFile(b'x'))
+        self.assertEqual(self.storage.listdir('a'), (['b', 'c'], ['1.txt', '2.txt']))
+        self.assertEqual(self.swift.listings, 3)
+        self.storage.rmtree('a/')
+        self.assertListEqual(list(self.swift.containers['media']), ['d/5.txt'])
+
+    def test_save_replaces_segments(self):
+        self.storage.auto_overwrite = True
+        self.storage.save('big.txt', ContentFile(b'0123456789abcdefghijklmno'))
+        self.storage.save('big.txt', ContentFile(b'ABCDEFGHIJKLMNOP'))
+        segments = self.swift.containers['media_segments']
+        # Only the new object's segments are left.
+        self.assertListEqual([data for _, (data, _) in sorted(segments.items())], [b'ABCDEFGHIJ', b'KLMNOP'])
+        manifest = self.swift.containers['media']['big.txt'][1]['X-Object-Manifest']
+        self.assertTrue(all(('media_segments/' + name).startswith(manifest) for name in segments))
+
+        self.storage.save('big.txt', ContentFile(b'small'))
+        self.assertDictEqual(segments, {})
+        self.assertEqual(self.swift.containers['media']['big.txt'][0], b'small')
+
+    def test_cache(self):
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        self.storage.cache_dir = cache_dir
+        self.storage.auto_overwrite = True
+        self.storage.save('doc.txt', ContentFile(b'statement'))
+        for _ in range(2):
+            with self.storage.open('doc.txt') as f:
+                self.assertEqual(f.read(), b'statement')
+        # The second read was served from the cache, and the connection went back to the pool.
+        self.assertEqual(self.swift.downloads, 1)
+        self.assertTrue(os.path.exists(self.storage._cache_path('doc.txt')))
+        self.assertIsNotNone(self.storage.pool.get())
+
+    def test_cache_invalidation(self):
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        self.storage.cache_dir = cache_dir
+        self.storage.auto_overwrite = True
+        self.storage.save('doc.txt', ContentFile(b'statement'))
+        with self.storage.open('doc.txt') as f:
+            f.read()
+
+        self.storage.save('doc.txt', ContentFile(b'revised'))
+        self.assertFalse(os.path.exists(self.storage._cache_path('doc.txt')))
+        with self.storage.open('doc.txt') as f:
+            self.assertEqual(f.read(), b'revised')
+        self.assertEqual(self.swift.downloads, 2)
+
+        self.storage.delete('doc.txt')
+        self.assertFalse(os.path.exists(self.storage._cache_path('doc.txt')))
+        self.assertRaises(storage.swiftclient.ClientException, self.storage.open, 'doc.txt')
+
+        # Expired copies are downloaded again.
+        self.storage.save('doc.txt', ContentFile(b'statement'))
+        self.storage.cache_timeout = 0
+        for _ in range(2):
+            with self.storage.open('doc.txt') as f:
+                self.assertEqual(f.read(), b'statement')
+        self.assertEqual(self.swift.downloads, 4)